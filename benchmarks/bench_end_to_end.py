@@ -0,0 +1,124 @@
+"""End to end, from bytes on a socket to actions dispatched on the executor, with outputs.NullBackend
+
+Runs main.run_chat_loop against local_irc_server.LocalTwitchServer so nothing touches Twitch or the keyboard,
+with latency tracing on so every run also reports the per-stage percentiles.
+Run from the repository root with:
+    python -m benchmarks.bench_end_to_end
+or as part of the whole suite with run_benchmarks.py
+"""
+import asyncio, contextlib, io, time
+
+from typing import Container
+
+import dispatch
+import executor
+import keymap
+import latency
+import main
+import outputs
+import twitch
+
+from local_irc_server import ChatLoad, LocalTwitchServer
+
+from benchmarks.common import CHATTER, make_aliases, make_chat, make_keymap
+
+RATES = (10, 100, 1000, 10000)
+
+class CountingMatcher(keymap.KeymapTrie):
+    '''KeymapTrie that counts the chat messages it sees and matches'''
+    def __init__(self, keymap: keymap.Keymap) -> None:
+        super().__init__(keymap)
+        self.n_messages = 0
+        self.n_matched  = 0
+
+    def match(self, payload: str, username: str = "", dev_users: Container[str] = frozenset()) -> keymap.Command:
+        self.n_messages += 1
+        command = super().match(payload, username, dev_users)
+        self.n_matched += command is not None
+        return command
+
+async def _wait_for_join(server: LocalTwitchServer) -> None:
+    while not any(client.channels for client in server.clients):
+        await asyncio.sleep(0.01)
+
+async def _chat_loop(server: LocalTwitchServer, matcher: CountingMatcher, store: twitch.MessageStore, duration: float = None, stream: bytes = None) -> dict[str, float]:
+    chat = asyncio.create_task(main.run_chat_loop("channel", matcher, frozenset(), dispatch.AnarchyDispatcher(),
+                                                  twitchIrc=server.twitch_irc(), store=store, reconnect=False))
+    await _wait_for_join(server)
+    cpu, start = time.thread_time(), time.perf_counter()
+    if stream:
+        await asyncio.to_thread(server.call_soon, server.broadcast(stream, joined_only=True))
+    else:
+        await asyncio.sleep(duration)
+    await asyncio.to_thread(server.stop) # Without reconnecting, the connection closing ends the chat loop once it has drained what it had
+    await chat
+    return {"elapsed_s": time.perf_counter() - start, "client_cpu_s": time.thread_time() - cpu}
+
+def _run_once(load: ChatLoad, n_aliases: int, store: twitch.MessageStore, duration: float = None, stream: bytes = None) -> dict[str, float]:
+    matcher = CountingMatcher(make_keymap(n_aliases))
+    server = LocalTwitchServer(load=load).start_in_thread()
+    tracer = latency.LatencyTracer()
+    latency.set_default(tracer)
+    backend = outputs.NullBackend()
+    outputs.set_default(backend)
+    with executor.LaneExecutor() as pool, contextlib.redirect_stdout(io.StringIO()): # Commands print when they are busy
+        executor.set_default(pool)
+        timings = asyncio.run(_chat_loop(server, matcher, store, duration, stream))
+        stats = pool.stats()
+    executor.set_default(None)
+    latency.set_default(latency.LatencyTracer(enabled=False))
+    outputs.set_default(None)
+    return timings | {
+        "n_sent":       server.n_sent if stream is None else stream.count(b"\r\n"),
+        "n_messages":   matcher.n_messages,
+        "n_matched":    matcher.n_matched,
+        "n_dispatched": stats["submitted"],
+        "n_rejected":   stats["rejected"],
+        "n_output_events": backend.n_events,
+        "n_dropped":    sum(store.dropped.values()),
+        "messages_per_second": matcher.n_messages / timings["elapsed_s"],
+        "client_cpu_per_message_us": timings["client_cpu_s"] / max(1, matcher.n_messages) * 1e6,
+        "latency": tracer.snapshot(),
+    }
+
+def run_throughput(n_messages: int = 20000, n_aliases: int = 100) -> dict[str, float]:
+    """Send a fixed burst of chat as fast as the socket allows and time until every message is dispatched
+
+    Args:
+        n_messages (int, optional): chat messages in the burst, half of them commands. Defaults to 20000.
+        n_aliases (int, optional): aliases in the keymap. Defaults to 100.
+
+    Returns:
+        dict[str, float]: timings and counts
+    """
+    stream = b"".join(packet + b"\r\n" for packet in make_chat(make_aliases(n_aliases), n_messages))
+    return _run_once(ChatLoad(rate=0), n_aliases, twitch.MessageStore(), stream=stream)
+
+def run_rates(rates: tuple[float, ...] = RATES, duration: float = 2.0, n_aliases: int = 100) -> dict[str, dict[str, float]]:
+    """Hold a steady chat rate and see whether the client keeps up, with the default bounded message store
+
+    Args:
+        rates (tuple[float, ...], optional): chat messages per second. Defaults to RATES.
+        duration (float, optional): seconds at each rate. Defaults to 2.0.
+        n_aliases (int, optional): aliases in the keymap, the chat is half commands. Defaults to 100.
+
+    Returns:
+        dict[str, dict[str, float]]: timings and counts by rate
+    """
+    aliases = make_aliases(n_aliases)
+    mix = {alias: 1 for alias in aliases} | {text: len(aliases) / len(CHATTER) for text in CHATTER}
+    return {str(rate): _run_once(ChatLoad(rate=rate, n_users=1000, mix=mix), n_aliases, twitch.MessageStore(50), duration=duration)
+            for rate in rates}
+
+def run(quick: bool = False) -> dict[str, dict]:
+    return {
+        "throughput": run_throughput(2000 if quick else 20000),
+        "rates":      run_rates(duration=0.5 if quick else 2.0),
+    }
+
+if __name__ == "__main__":
+    results = run()
+    print(f"throughput {results['throughput']['messages_per_second']:10.0f} messages/s")
+    for rate, result in results["rates"].items():
+        print(f"{rate:>6}/s  received {result['n_messages']:6} of {result['n_sent']:6}  dropped {result['n_dropped']:6}"
+              f"  dispatched {result['n_dispatched']:6}  {result['client_cpu_per_message_us']:8.1f} us CPU per message")
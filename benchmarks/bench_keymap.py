@@ -0,0 +1,43 @@
+"""Keymap building and matching as the number of aliases grows
+
+Run from the repository root with:
+    python -m benchmarks.bench_keymap
+or as part of the whole suite with run_benchmarks.py
+"""
+import keymap
+import main
+from twitch import IrcParser
+
+from benchmarks.common import make_aliases, make_chat, make_config, time_us
+
+SIZES = (10, 100, 1000, 10000)
+
+def run(sizes: tuple[int, ...] = SIZES, n_messages: int = 1000) -> dict[str, dict[str, float]]:
+    """Time keymap.make_keymap_entry, compiling the trie and main.message_filter for each keymap size
+
+    Args:
+        sizes (tuple[int, ...], optional): numbers of aliases to try. Defaults to SIZES.
+        n_messages (int, optional): chat messages per message_filter timing, half of them commands. Defaults to 1000.
+
+    Returns:
+        dict[str, dict[str, float]]: by number of aliases, microseconds per keymap build or per message
+    """
+    results = {}
+    for n_aliases in sizes:
+        config = make_config(n_aliases)
+        aliases = make_aliases(n_aliases)
+        number = max(1, 1000 // n_aliases)
+        mykeymap = keymap.make_keymap_entry(config)
+        matcher = keymap.KeymapTrie(mykeymap)
+        messages = [msg.payload_as_tuple() for msg in IrcParser().parse(make_chat(aliases, n_messages))]
+        results[str(n_aliases)] = {
+            "make_keymap_entry_us":    time_us(lambda: keymap.make_keymap_entry(config), number, repeat=3),
+            "compile_trie_us":         time_us(lambda: keymap.KeymapTrie(mykeymap), number, repeat=3),
+            "message_filter_us":       time_us(lambda: [main.message_filter(msg, matcher) for msg in messages], 20) / n_messages,
+            "message_filter_dev_us":   time_us(lambda: [main.message_filter(msg, matcher, frozenset(["viewer1"])) for msg in messages], 20) / n_messages,
+        }
+    return results
+
+if __name__ == "__main__":
+    for n_aliases, timings in run().items():
+        print(f"{n_aliases:>6} aliases  " + "  ".join(f"{name} {us:10.2f}" for name, us in timings.items()))
@@ -0,0 +1,103 @@
+"""Microbenchmarks of framing and parsing, against the original split based parser
+
+Run from the repository root with:
+    python -m benchmarks.bench_parser
+or as part of the whole suite with run_benchmarks.py
+"""
+import logging
+
+import twitch
+from twitch import TwitchMessageEnum
+
+from benchmarks.common import make_aliases, make_chat, time_us
+
+PACKETS = [
+    b":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #channel :forward",
+    b":someone_else!someone_else@someone_else.tmi.twitch.tv PRIVMSG #channel :look left please chat",
+    b"PING :tmi.twitch.tv",
+    b":justinfan1!justinfan1@justinfan1.tmi.twitch.tv JOIN #channel",
+    b":tmi.twitch.tv 001 justinfan1 :Welcome, GLHF!",
+]
+
+TAGGED_PACKETS = [
+    b"@badge-info=subscriber/8;badges=subscriber/6,premium/1;color=#1E90FF;display-name=Viewer;emotes=;first-msg=0;flags=;id=a1b2;mod=0;"
+    b"room-id=12345;subscriber=1;tmi-sent-ts=1660000000000;turbo=0;user-id=67890;user-type= " + packet for packet in PACKETS[:2]
+]
+
+def legacy_split_command_and_packet(packet: bytes) -> tuple[str, TwitchMessageEnum, str]:
+    '''The parser as it was before the single pass rewrite, kept only as a baseline'''
+    logging.debug("Splitting: %s", packet)
+    ret_fail = (None, None, None)
+    if not packet or 0 == len(packet):
+        return ret_fail
+    username = b''
+    cmd, payload = packet.split(b' ', maxsplit=1)
+    if cmd.endswith(b'.tmi.twitch.tv'):
+        username = cmd.split(b'.tmi.twitch.tv', maxsplit=1)[0]
+        try:
+            username = username.split(b'@', maxsplit=1)[1]
+        except IndexError:
+            pass
+        cmd, payload = payload.split(b' ', maxsplit=1)
+    try:
+        return (username.decode("utf-8"), TwitchMessageEnum[cmd.decode("utf-8")], payload.decode("utf-8"))
+    except KeyError:
+        return ret_fail
+
+def legacy_parse(packets: list[bytes]) -> list[tuple]:
+    parsed = [legacy_split_command_and_packet(x) for x in packets if len(x)]
+    return [x for x in parsed if x[1] is not None]
+
+def legacy_payload_as_tuple(payload: str) -> tuple[str, str]:
+    channel, message = payload.split(':', maxsplit=1)
+    return (channel.rstrip().lstrip('#'), message.lstrip().rstrip())
+
+def frame_with_builder(builder: twitch.MessageBuilder, stream: bytes, chunk_size: int) -> int:
+    '''Push a stream through a MessageBuilder in socket sized chunks, as BufferedSocket does'''
+    n = 0
+    for i in range(0, len(stream), chunk_size):
+        builder.append(stream[i:i + chunk_size])
+        n += sum(1 for _ in builder.frames())
+    return n
+
+def frame_with_splitter(splitter: twitch.MessageSplitter, stream: bytes, chunk_size: int) -> int:
+    '''The same with the original MessageSplitter, carrying the partial packet over by hand'''
+    n, remainder = 0, b""
+    for i in range(0, len(stream), chunk_size):
+        packets, remainder = splitter(remainder + stream[i:i + chunk_size])
+        remainder = remainder or b""
+        n += len(packets)
+    return n
+
+def run(number: int = 2000) -> dict[str, float]:
+    """Time each stage over a batch of 100 packets
+
+    Args:
+        number (int, optional): calls per timing. Defaults to 2000.
+
+    Returns:
+        dict[str, float]: microseconds per batch of 100 packets, by benchmark
+    """
+    parser = twitch.IrcParser()
+    parser_no_tags = twitch.IrcParser(parse_tags=False)
+    batch = PACKETS * 20
+    tagged_batch = TAGGED_PACKETS * 50
+    stream = b"".join(packet + b"\r\n" for packet in make_chat(make_aliases(100), 100))
+    builder = twitch.MessageBuilderDefault()
+    splitter = twitch.MessageSplitter()
+    return {
+        "split_command_and_packet_us":        time_us(lambda: [twitch.TwitchIrc.split_command_and_packet(x) for x in batch], number),
+        "legacy_split_command_and_packet_us": time_us(lambda: [legacy_split_command_and_packet(x) for x in batch], number),
+        "message_splitter_us":                time_us(lambda: frame_with_splitter(splitter, stream, 512), number),
+        "message_builder_us":                 time_us(lambda: frame_with_builder(builder, stream, 512), number),
+        "legacy_parse_us":                    time_us(lambda: legacy_parse(batch), number),
+        "parse_us":                           time_us(lambda: parser.parse(batch), number),
+        "legacy_parse_and_split_us":          time_us(lambda: [legacy_payload_as_tuple(x[2]) for x in legacy_parse(batch) if x[1] == TwitchMessageEnum.PRIVMSG], number),
+        "parse_and_split_us":                 time_us(lambda: [x.payload_as_tuple() for x in parser.parse(batch) if x.id == TwitchMessageEnum.PRIVMSG], number),
+        "parse_tagged_us":                    time_us(lambda: parser.parse(tagged_batch), number),
+        "parse_tagged_skip_tags_us":          time_us(lambda: parser_no_tags.parse(tagged_batch), number),
+    }
+
+if __name__ == "__main__":
+    for name, us in run().items():
+        print(f"{name:36} {us:10.1f} us per 100 packets")
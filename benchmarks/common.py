@@ -0,0 +1,73 @@
+"""Helpers shared by the benchmarks, synthetic keymaps and chat so runs are reproducible"""
+import random, timeit
+
+from configparser import ConfigParser
+
+import keymap
+
+KEYBOARD_BUTTONS = ["w", "a", "s", "d", "j", "v", "e", "space"]
+MOUSE_BUTTONS    = ["lmb", "mmb", "rmb", "move 500 0", "move -500 0", "move 0 500", "move 0 -500"]
+CHATTER          = ["lol", "gg", "this is fine", "KEKW", "what a play", "hello chat", "can we go back to the start"]
+
+def time_us(fn, number: int, repeat: int = 5) -> float:
+    '''Best of `repeat`, in microseconds per call'''
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+def make_aliases(n_aliases: int, seed: int = 0) -> list[str]:
+    '''Distinct, realistic looking aliases such as "jump left 12"'''
+    rng = random.Random(seed)
+    verbs = ["go", "look", "jump", "run", "walk", "turn", "press", "use", "hold", "tap"]
+    nouns = ["left", "right", "up", "down", "forward", "back", "door", "map", "item", "menu"]
+    return [f"{rng.choice(verbs)} {rng.choice(nouns)} {i}" for i in range(n_aliases)]
+
+def make_config(n_aliases: int, aliases_per_command: int = 2, seed: int = 0) -> ConfigParser:
+    """Config with a synthetic keymap, about a tenth of the commands on the mouse
+
+    Args:
+        n_aliases (int): total number of chat aliases across all the commands
+        aliases_per_command (int, optional): aliases sharing each command. Defaults to 2.
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        ConfigParser: config with keyboard.chat.commands and mouse.chat.commands sections
+    """
+    rng = random.Random(seed)
+    aliases = make_aliases(n_aliases, seed)
+    config = ConfigParser()
+    config["keyboard.chat.commands"] = {}
+    config["mouse.chat.commands"] = {}
+    for i in range(0, n_aliases, aliases_per_command):
+        keys = ", ".join(aliases[i:i + aliases_per_command])
+        if rng.random() < 0.1:
+            config["mouse.chat.commands"][keys] = rng.choice(MOUSE_BUTTONS)
+        else:
+            config["keyboard.chat.commands"][keys] = rng.choice(KEYBOARD_BUTTONS)
+    return config
+
+def make_keymap(n_aliases: int, seed: int = 0) -> keymap.Keymap:
+    '''Synthetic keymap with no durations, so with outputs.NullBackend the actions cost only their own overhead'''
+    return keymap.make_keymap_entry(make_config(n_aliases, seed=seed))
+
+def make_chat(aliases: list[str], n: int, match_ratio: float = 0.5, n_users: int = 1000, tags: bool = False, channel: str = "channel", seed: int = 0) -> list[bytes]:
+    """Synthetic PRIVMSG packets, without the trailing \\r\\n
+
+    Args:
+        aliases (list[str]): chat commands to draw the matching messages from
+        n (int): number of packets
+        match_ratio (float, optional): fraction of messages that are commands, the rest are chatter. Defaults to 0.5.
+        n_users (int, optional): distinct chatters. Defaults to 1000.
+        tags (bool, optional): add IRCv3 tags. Defaults to False.
+        channel (str, optional): channel name. Defaults to "channel".
+        seed (int, optional): random seed. Defaults to 0.
+
+    Returns:
+        list[bytes]: packets
+    """
+    rng = random.Random(seed)
+    packets = []
+    for _ in range(n):
+        user = f"viewer{rng.randrange(n_users)}"
+        text = rng.choice(aliases) if rng.random() < match_ratio else rng.choice(CHATTER)
+        prefix = f"@badges=;display-name={user};mod=0;subscriber=0;user-id={user[6:]} " if tags else ""
+        packets.append(f"{prefix}:{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #{channel} :{text}".encode())
+    return packets
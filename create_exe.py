@@ -1,19 +1,29 @@
-import os
+import argparse, os
 import PyInstaller.__main__
 
 DIRPATH = os.path.dirname(os.path.realpath(__file__))
 DIRNAME = DIRPATH.split('\\')[-1]
 
-def build() -> None:
+def build(onefile: bool = True) -> None:
+    """Build the exe
+
+    Args:
+        onefile (bool, optional): one self extracting exe, else a folder which starts quicker as nothing is unpacked at each launch. Defaults to True.
+    """
     PyInstaller.__main__.run([
         f'{DIRPATH}\\main.py',
         #'--clean',
         '-n', DIRNAME,
-        '--onefile',
+        '--onefile' if onefile else '--onedir',
         '--noconfirm',
         '--log-level', 'WARN',
         '--hidden-import', 'pynput.keyboard._win32',
         '--hidden-import', 'pynput.mouse._win32',
+        # Never imported by the app, keep them out so there is less to unpack at launch
+        '--exclude-module', 'tkinter',
+        '--exclude-module', 'pyparsing',
+        '--exclude-module', 'pytest',
+        '--exclude-module', 'benchmarks',
         '--add-data', f'{DIRPATH}\\README.md;.',
         '--add-data', f'{DIRPATH}\\katatoRIOT.png;img',
         '-i', 'katatoRIOT.png',
@@ -21,4 +31,6 @@ def build() -> None:
     ])
 
 if __name__ == "__main__":
-    build()
\ No newline at end of file
+    argparser = argparse.ArgumentParser(description="Build the TwitchPlays exe with PyInstaller")
+    argparser.add_argument("--onedir", action="store_true", help="build a folder rather than one exe, for faster startup")
+    build(not argparser.parse_args().onedir)
\ No newline at end of file
@@ -9,6 +9,15 @@ class ConfigKeys:
     broadcaster     = "broadcaster.commands"
     keyboard        = "keyboard.chat.commands"
     mouse           = "mouse.chat.commands"
+    dispatch        = "dispatch"
+    executor        = "executor"
+    latency         = "latency"
+    outputs         = "outputs"
+    keymap          = "keymap"
+    ratelimit       = "ratelimit"
+    spam            = "spam"
+    timers          = "timers"
+    metrics         = "metrics"
 
     @staticmethod
     def as_dict() -> dict[str, str]:
@@ -33,16 +42,128 @@ def generate_default_config() -> ConfigParser:
 
     config[ConfigKeys.logging] = {
         "; DEBUG, INFO, WARNING, ERROR, CRITICAL": None,
-        "DebugLevel": "INFO"
+        "DebugLevel": "INFO",
+        "; Log a repeated message once per this many seconds, with a count of the rest, 0 to log every one": None,
+        "RepeatWindowSeconds": "5",
+        "; Gzip old log files in the background": None,
+        "CompressRotated": "yes",
     }
     config[ConfigKeys.twitch] = {
-        "TwitchChannelName": "DrGreenGiant"
+        "; Comma separated to drive one game from several channels, see [keyboard.chat.commands.<channel>] for per channel commands": None,
+        "TwitchChannelName": "DrGreenGiant",
+        "; Channels joined on each anonymous connection, more channels open more connections": None,
+        "ChannelsPerConnection": "20",
+        "; Max bytes read from the socket at a time": None,
+        "ReceiveChunkSize": "4096",
+        "; Ask Twitch for IRCv3 tags (user id, badges, mod and sub status) on every message": None,
+        "RequestTags": "no",
+        "; Messages waiting to be processed before the overload policy kicks in": None,
+        "MaxMessages": "50",
+        "; drop-oldest, drop-newest, sample (keep a random sample) or commands-only (ignore chat that isn't a command)": None,
+        "OverloadPolicy": "drop-oldest",
+        "; Record raw chat traffic to this file for replay.py, leave empty to not record": None,
+        "CaptureFile": "",
+        "; Replace a connection that is lost or asked to reconnect, waiting a random time up to ReconnectBackoffSeconds doubled for each failure": None,
+        "Reconnect": "yes",
+        "ReconnectBackoffSeconds": "1",
+        "ReconnectBackoffMaxSeconds": "60",
+        "; Keep a spare connection joined to the same channels, to switch to in milliseconds rather than reconnecting": None,
+        "Standby": "no",
+        "; PING the server after this many seconds of quiet, and drop the connection if it does not answer within PingTimeoutSeconds, 0 to not": None,
+        "PingSeconds": "60",
+        "PingTimeoutSeconds": "10",
     }
     config[ConfigKeys.broadcaster] = {
         "; Allows you to start and stop the keyboard and mouse outputs of this programme when in game": None,
         "OutputToggleOnOff": "shift+backspace",
         "StartState": "on",
     }
+    config[ConfigKeys.dispatch] = {
+        "; anarchy runs every command, democracy runs only the most voted command(s) each window": None,
+        "Mode": "anarchy",
+        "; fixed or sliding, a sliding window is re-evaluated SlidingSteps times per window": None,
+        "WindowType": "fixed",
+        "WindowSeconds": "2.0",
+        "SlidingSteps": "4",
+        "Winners": "1",
+        "; first (first voted for), keymap (earliest in this file) or random": None,
+        "TieBreak": "first",
+    }
+    config[ConfigKeys.executor] = {
+        "; pool runs actions on a fixed number of worker threads, thread starts a new thread per action": None,
+        "Type": "pool",
+        "Workers": "4",
+        "; actions waiting per worker before new ones are rejected": None,
+        "QueueSize": "16",
+        "; actions on the same lane run in order; button, device (keyboard or mouse) or command": None,
+        "LaneBy": "button",
+    }
+    config[ConfigKeys.outputs] = {
+        "; pynput (the real keyboard and mouse), null (do nothing) or recording (write every event to RecordingFile)": None,
+        "Backend": "pynput",
+        "RecordingFile": "outputs.jsonl",
+        "; Hand events to the backend several at a time, up to BatchSize, rather than one per call": None,
+        "Batch": "no",
+        "BatchSize": "32",
+        "; Mouse moves are split into MouseRate steps a second along a linear, ease_in_out or ease_out path": None,
+        "MouseRate": "100",
+        "MouseEasing": "ease_in_out",
+        "; How far a move may arc to one side, as a fraction of its length, 0 for straight lines": None,
+        "MouseBend": "0",
+        "; Sum every mouse move in progress into one move per step, rather than each move sending its own": None,
+        "MouseMixing": "yes",
+    }
+    config[ConfigKeys.latency] = {
+        "; Time every message from the socket to the first key press or mouse move, in stages": None,
+        "Enabled": "no",
+        "; Log percentiles of each stage this often, 0 to only log them on exit": None,
+        "LogEverySeconds": "60",
+        "; Log, and write to DumpFile if set, the percentiles when this is pressed": None,
+        "DumpHotkey": "<shift>+<f12>",
+        "DumpFile": "",
+    }
+    config[ConfigKeys.timers] = {
+        "; Key releases and repeats are timed to the nearest tick": None,
+        "TickMilliseconds": "1",
+        "; Spin rather than sleep for the last moment before each timer, for sub-millisecond timing at the cost of some CPU, 0 to only sleep": None,
+        "SpinMicroseconds": "0",
+    }
+    config[ConfigKeys.ratelimit] = {
+        "; Limit how fast each chatter can run commands, UserRate a second with bursts of up to UserBurst": None,
+        "; A command can also have its own limit per chatter with the ur tag, e.g. ur:0.2 for once every 5s": None,
+        "; Off by default so every command runs as before, set Enabled = yes to turn it on, ur tags included": None,
+        "Enabled": "no",
+        "UserRate": "1",
+        "UserBurst": "5",
+        "; Chatters tracked at once, and seconds after which a quiet chatter is forgotten": None,
+        "MaxUsers": "50000",
+        "IdleSeconds": "300",
+    }
+    config[ConfigKeys.spam] = {
+        "; Collapse repeated chat lines before they are matched against the commands, a line from N chatters runs once in anarchy and is N votes in democracy": None,
+        "; Off by default as it changes what chat does, e.g. many chatters typing forward together move once, set Enabled = yes to turn it on": None,
+        "Enabled": "no",
+        "; A chatter repeating themselves within UserWindowSeconds is dropped, anyone repeating a line within TextWindowSeconds is folded into it, 0 to not check": None,
+        "UserWindowSeconds": "1",
+        "TextWindowSeconds": "0.25",
+        "MaxKeys": "100000",
+    }
+    config[ConfigKeys.metrics] = {
+        "; Counters and gauges for the running instance, served on localhost at /metrics and /metrics.json": None,
+        "Enabled": "no",
+        "; 0 to not serve them": None,
+        "Port": "9108",
+        "; Also write them to this file as JSON every WriteEverySeconds, blank to not write them": None,
+        "File": "",
+        "WriteEverySeconds": "10",
+    }
+    config[ConfigKeys.keymap] = {
+        "; Pick up changes to the chat commands in this file without restarting, other settings still need a restart": None,
+        "HotReload": "yes",
+        "ReloadCheckSeconds": "1",
+        "; Compiled keymaps are kept here so an unchanged config starts faster, blank to not cache": None,
+        "CacheDir": ".keymap_cache",
+    }
     config[ConfigKeys.keyboard] = {
         "; Chat commands, comma seperated = key duration(seconds, optional)": None,
         "forward, forwards":            "w   3",
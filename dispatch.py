@@ -0,0 +1,154 @@
+import logging
+
+import asyncio, random, time
+
+from collections import deque
+from configparser import ConfigParser
+from enum import Enum, unique
+from typing import Callable, Optional
+
+from keymap import Command
+
+@unique
+class DispatchMode(Enum):
+    '''How matched chat commands are turned into actions'''
+    ANARCHY   = "anarchy"   # Run every command as soon as it is matched
+    DEMOCRACY = "democracy" # Collect votes over a window and run the winner(s)
+
+@unique
+class TieBreak(Enum):
+    '''Which command wins when several have the same number of votes'''
+    FIRST  = "first"  # The one first voted for in the window
+    KEYMAP = "keymap" # The one earliest in the keymap
+    RANDOM = "random" # Pick at random
+
+class AnarchyDispatcher:
+    '''Runs each command straight away, the original behaviour'''
+    def submit(self, command: Command, now: float = None, received_at: float = None, votes: int = 1) -> None:
+        '''Run a command, once however many `votes` it stands for as repeats are collapsed to stop spam'''
+        command.run(received_at=received_at)
+
+    def tick(self, now: float = None) -> list[Command]:
+        return []
+
+    def time_to_next_tick(self, now: float = None) -> Optional[float]:
+        return None
+
+    def set_keymap(self, keymap: list[Command]) -> None:
+        pass
+
+class DemocracyDispatcher:
+    """Counts votes per command over a fixed or sliding time window and runs only the winners
+
+    The window is divided into `n_buckets` sub-windows.  A fixed window (`n_buckets` == 1) is tallied and
+    reset every `window` seconds.  A sliding window is evaluated every `window / n_buckets` seconds over
+    the trailing `window` seconds.
+
+    Votes are O(1), and memory is bounded by `n_buckets` x the number of distinct commands in the keymap
+    whatever the chat volume.
+    """
+    def __init__(self, window: float = 2.0, n_buckets: int = 1, n_winners: int = 1, tie_break: TieBreak = TieBreak.FIRST,
+                 keymap: list[Command] = None, clock: Callable[[], float] = time.monotonic) -> None:
+        if window <= 0 or n_buckets < 1 or n_winners < 1:
+            raise ValueError("Window, number of buckets and number of winners must be positive")
+        self.step      = window / n_buckets
+        self.n_winners = n_winners
+        self.tie_break = tie_break
+        self.set_keymap(keymap or [])
+        self.clock     = clock
+        self.buckets: deque[dict[int, int]] = deque([{}], maxlen=n_buckets) # Votes by id(command), newest last
+        self.totals: dict[int, list] = {} # id(command) -> [command, votes] over the whole window, in first vote order
+        self.next_tick = self.clock() + self.step
+
+    def set_keymap(self, keymap: list[Command]) -> None:
+        """Use a new keymap's order for tie breaks, e.g. after a reload.  Votes already cast still count"""
+        self.order = {id(command): i for i, command in enumerate(keymap)}
+
+    def submit(self, command: Command, now: float = None, received_at: float = None, votes: int = 1) -> None:
+        """Cast `votes` for a command in the current window, `received_at` is ignored as the wait for the window is deliberate"""
+        key = id(command)
+        bucket = self.buckets[-1]
+        bucket[key] = bucket.get(key, 0) + votes
+        if (entry := self.totals.get(key)):
+            entry[1] += votes
+        else:
+            self.totals[key] = [command, votes]
+
+    def winners(self) -> list[Command]:
+        """Get the commands with the most votes in the current window, best first"""
+        entries = list(self.totals.values())
+        match self.tie_break:
+            case TieBreak.KEYMAP:
+                entries.sort(key=lambda e: self.order.get(id(e[0]), len(self.order)))
+            case TieBreak.RANDOM:
+                random.shuffle(entries)
+        entries.sort(key=lambda e: e[1], reverse=True) # Stable, so ties keep the order above
+        return [command for command, _ in entries[:self.n_winners]]
+
+    def _expire_oldest(self) -> None:
+        if len(self.buckets) == self.buckets.maxlen:
+            for key, votes in self.buckets[0].items():
+                entry = self.totals[key]
+                entry[1] -= votes
+                if entry[1] <= 0:
+                    del self.totals[key]
+        self.buckets.append({})
+
+    def tick(self, now: float = None) -> list[Command]:
+        """Close the current window (or sub-window) if it is due, and run the winners
+
+        Args:
+            now (float, optional): current time from `clock`. Defaults to None which reads the clock.
+
+        Returns:
+            list[Command]: commands that were run
+        """
+        now = self.clock() if now is None else now
+        if now < self.next_tick:
+            return []
+        # Catch up in whole steps, an idle chat doesn't need a tick per missed step
+        n_steps = 1 + int((now - self.next_tick) // self.step)
+        self.next_tick += self.step * n_steps
+
+        ran = self.winners()
+        for command in ran:
+            logging.debug("Democracy chose %s with %d votes", command.keys, self.totals[id(command)][1])
+            command.run()
+        for _ in range(min(n_steps, self.buckets.maxlen)): # Every step that has passed, past the window is all of them
+            self._expire_oldest()
+        return ran
+
+    def time_to_next_tick(self, now: float = None) -> Optional[float]:
+        now = self.clock() if now is None else now
+        return max(0.0, self.next_tick - now)
+
+Dispatcher = AnarchyDispatcher | DemocracyDispatcher
+
+def make_dispatcher(config: ConfigParser, keymap: list[Command] = None) -> Dispatcher:
+    """Make the dispatcher chosen in the config, defaulting to anarchy if the section is missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+        keymap (list[Command], optional): keymap, used for keymap order tie breaks. Defaults to None.
+
+    Returns:
+        Dispatcher: dispatcher to submit matched commands to
+    """
+    section = config["dispatch"] if config.has_section("dispatch") else {}
+    mode = DispatchMode(section.get("Mode", DispatchMode.ANARCHY.value).lower())
+    if mode == DispatchMode.ANARCHY:
+        return AnarchyDispatcher()
+
+    window    = float(section.get("WindowSeconds", 2.0))
+    sliding   = section.get("WindowType", "fixed").lower() == "sliding"
+    n_buckets = int(section.get("SlidingSteps", 4)) if sliding else 1
+    n_winners = int(section.get("Winners", 1))
+    tie_break = TieBreak(section.get("TieBreak", TieBreak.FIRST.value).lower())
+    logging.info(f"Democracy mode: {'sliding' if sliding else 'fixed'} {window}s window, top {n_winners}, ties broken by {tie_break.value}")
+    return DemocracyDispatcher(window, n_buckets, n_winners, tie_break, keymap)
+
+async def tick_forever(dispatcher: Dispatcher) -> None:
+    """Tick the dispatcher at the end of each window, for running alongside the chat loop"""
+    while (delay := dispatcher.time_to_next_tick()) is not None:
+        await asyncio.sleep(delay)
+        dispatcher.tick()
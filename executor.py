@@ -0,0 +1,146 @@
+import logging
+
+import queue, threading
+
+from configparser import ConfigParser
+from typing import Callable, Hashable, Optional
+
+class ThreadPerTaskExecutor:
+    '''Starts a new thread for every task, the original behaviour.  Lanes are ignored'''
+    def __init__(self, lane_by: str = "button") -> None:
+        self.lane_by   = lane_by
+        self.submitted = 0
+
+    def submit(self, fn: Callable[[], None], lane: Hashable = None) -> bool:
+        threading.Thread(target=fn, daemon=True).start()
+        self.submitted += 1
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {"submitted": self.submitted, "rejected": 0, "completed": 0, "queue_depth": 0}
+
+    def shutdown(self, wait: bool = True) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+class LaneExecutor:
+    """Fixed size pool of worker threads, each with its own bounded queue
+
+    Every task submitted on the same lane goes to the same worker, so e.g. all the actions for one key
+    run in the order they were accepted and never overlap.  When a worker's queue is full the task is
+    rejected rather than queued, so a chat flood cannot build up an unbounded backlog.
+
+    `lane_by` tells `keymap.Command` what to use as its lane; "button", "device" or "command".
+    """
+    def __init__(self, n_workers: int = 4, max_queue: int = 16, lane_by: str = "button") -> None:
+        if n_workers < 1 or max_queue < 1:
+            raise ValueError("Need at least one worker and a queue of at least one")
+        self.lane_by    = lane_by
+        self.queues: list[queue.Queue] = [queue.Queue(max_queue) for _ in range(n_workers)]
+        self.completed  = [0] * n_workers # One slot per worker so workers never contend
+        self.submitted  = 0
+        self.rejected   = 0
+        self.next_lane  = 0
+        self.closed     = False
+        self.lock       = threading.Lock()
+        self.workers    = [threading.Thread(target=self._work, args=(i,), name=f"LaneExecutor-{i}", daemon=True) for i in range(n_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def _work(self, index: int) -> None:
+        q = self.queues[index]
+        while (fn := q.get()) is not None:
+            try:
+                fn()
+            except Exception:
+                logging.exception("Task on worker %d failed", index)
+            self.completed[index] += 1
+            if self.closed and q.empty(): # Shut down while the queue was too full to take the stop signal
+                break
+
+    def submit(self, fn: Callable[[], None], lane: Hashable = None) -> bool:
+        """Queue a task to run on the worker that owns its lane
+
+        Args:
+            fn (Callable[[], None]): task to run
+            lane (Hashable, optional): tasks with equal lanes run in order on one worker. Defaults to None which spreads tasks round robin.
+
+        Returns:
+            bool: true if queued, false if the lane's queue was full or the executor is shut down
+        """
+        with self.lock:
+            if self.closed:
+                self.rejected += 1
+                return False
+            if lane is None:
+                index = self.next_lane = (self.next_lane + 1) % len(self.queues)
+            else:
+                index = hash(lane) % len(self.queues)
+            try:
+                self.queues[index].put_nowait(fn)
+                self.submitted += 1
+                return True
+            except queue.Full:
+                self.rejected += 1
+                logging.debug("Rejected task for lane %s, queue full", lane)
+                return False
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def stats(self) -> dict[str, int]:
+        return {"submitted": self.submitted, "rejected": self.rejected, "completed": sum(self.completed), "queue_depth": self.queue_depth()}
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers once they have finished everything already queued, never blocking on a full queue"""
+        with self.lock: # Nothing more is queued after this, so a worker finding its queue empty can stop
+            self.closed = True
+        for q in self.queues:
+            try:
+                q.put_nowait(None)
+            except queue.Full:
+                pass # The worker stops once it has emptied the queue
+        if wait:
+            for worker in self.workers:
+                worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+Executor = ThreadPerTaskExecutor | LaneExecutor
+
+_default: Optional[Executor] = None
+
+def get_default() -> Executor:
+    """Executor used by `keymap.Command.run` when none is given, a thread per task unless `set_default` was called"""
+    global _default
+    if _default is None:
+        _default = ThreadPerTaskExecutor()
+    return _default
+
+def set_default(executor: Executor) -> None:
+    global _default
+    _default = executor
+
+def make_executor(config: ConfigParser) -> Executor:
+    """Make the executor chosen in the config, defaulting to a pool if the section is missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        Executor: executor to run actions on
+    """
+    section = config["executor"] if config.has_section("executor") else {}
+    lane_by = section.get("LaneBy", "button").lower()
+    if section.get("Type", "pool").lower() == "thread":
+        return ThreadPerTaskExecutor(lane_by)
+    return LaneExecutor(int(section.get("Workers", 4)), int(section.get("QueueSize", 16)), lane_by)
@@ -0,0 +1,130 @@
+import logging
+
+import threading
+
+from typing import Callable, Hashable, Optional
+
+import timers
+
+class _Hold:
+    __slots__ = ("deadline", "release", "flush", "holders", "released", "timer", "on_release")
+
+    def __init__(self, deadline: float, release: Callable[[], None], flush: Callable[[], None]) -> None:
+        self.deadline = deadline
+        self.release  = release
+        self.flush    = flush
+        self.holders  = 1 # Requests folded into this hold
+        self.released = threading.Event()
+        self.timer: Optional[timers.Timer] = None
+        self.on_release: list[Callable[[], None]] = []
+
+class KeyHolder:
+    """Keeps every held key or button, with when to let go of it, and lets go of them on the timer wheel
+
+    Holding a key that is already held only pushes its release back, if need be, rather than pressing it
+    again, so overlapping commands for the same key, whichever command they come from, make one long hold
+    and a release never cuts another hold short.  Under spam the number of presses, releases and threads
+    stays the same however many requests there are.
+    """
+    def __init__(self, wheel: timers.TimerWheel = None) -> None:
+        self.wheel      = wheel # None for timers.get_default(), looked up when first needed
+        self.held: dict[Hashable, _Hold] = {}
+        self.lock       = threading.RLock()
+        self.closed     = False
+        self.n_presses  = 0
+        self.n_extended = 0
+        self.n_releases = 0
+
+    def _wheel(self) -> timers.TimerWheel:
+        if self.wheel is None:
+            self.wheel = timers.get_default()
+        return self.wheel
+
+    def hold(self, key: Hashable, seconds: float, press: Callable[[], None], release: Callable[[], None],
+             flush: Callable[[], None] = lambda: None, on_release: Callable[[], None] = None) -> threading.Event:
+        """Hold a key for at least `seconds` from now
+
+        Args:
+            key (Hashable): what is held, holds of the same key are folded together
+            seconds (float): how long to hold it for
+            press (Callable[[], None]): presses it, only called if it is not already held
+            release (Callable[[], None]): lets go of it, called once when the last hold runs out
+            flush (Callable[[], None], optional): called after pressing and after releasing. Defaults to doing nothing.
+            on_release (Callable[[], None], optional): called once it has been released, e.g. to press it again. Defaults to None.
+
+        Returns:
+            threading.Event: set once the key has been released
+        """
+        wheel = self._wheel()
+        deadline = wheel.clock() + max(0.0, seconds)
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Key holder is closed")
+            if (hold := self.held.get(key)) is not None:
+                hold.holders += 1
+                self.n_extended += 1
+                if on_release:
+                    hold.on_release.append(on_release)
+                if deadline <= hold.deadline:
+                    return hold.released
+                hold.deadline = deadline
+                hold.timer.cancel()
+            else:
+                press()
+                flush()
+                hold = self.held[key] = _Hold(deadline, release, flush) # Only once pressed, or a failed press would leave a hold with no timer
+                if on_release:
+                    hold.on_release.append(on_release)
+                self.n_presses += 1
+                if seconds <= 0: # A tap, let go straight away rather than on the wheel
+                    self._release(key)
+                    return hold.released
+            hold.timer = wheel.call_at(deadline, lambda: self._expire(key, hold))
+            return hold.released
+
+    def is_held(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.held
+
+    def _expire(self, key: Hashable, hold: _Hold) -> None:
+        with self.lock:
+            if self.held.get(key) is hold:
+                self._release(key)
+
+    def _release(self, key: Hashable) -> None:
+        '''Let go of a key, with the lock held so a press of the same key cannot slip in between'''
+        hold = self.held.pop(key)
+        try:
+            hold.release()
+            hold.flush()
+        except Exception:
+            logging.exception("Failed to release %s", key)
+        self.n_releases += 1
+        hold.released.set()
+        for fn in hold.on_release if not self.closed else ():
+            try:
+                fn()
+            except Exception:
+                logging.exception("Failed after releasing %s", key)
+
+    def release_all(self) -> None:
+        '''Let go of everything held now, e.g. when turned off or exiting so no key is left stuck down'''
+        with self.lock:
+            for key, hold in list(self.held.items()):
+                if hold.timer:
+                    hold.timer.cancel()
+                self._release(key)
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True # First, so nothing waiting on a release presses again
+            self.release_all()
+
+_default = KeyHolder()
+
+def get_default() -> KeyHolder:
+    return _default
+
+def set_default(holder: KeyHolder) -> None:
+    global _default
+    _default = holder
@@ -2,14 +2,17 @@ import logging
 
 import time
 
-from threading import Thread
 from types import FunctionType
-from typing import Callable, Optional
+from typing import Callable, Container, Hashable, Optional
 from configparser import ConfigParser
 from outputs import KeyboardOutputs, MouseOutputs, LogOutputs, PrintOutputs
 from dataclasses import dataclass, field
 import random
 
+import executor
+import latency
+import metrics
+
 @dataclass
 class Command:
     keys: list[str]
@@ -19,10 +22,11 @@ class Command:
     repeats: int = 1
     cooldown: Optional[float] = None
     random_chance: Optional[int] = None # TODO
+    user_rate: Optional[float] = None # Commands a second per chatter, see ratelimit.UserRateLimiter
     enabled: bool = True
     is_dev_command: bool = False
 
-    last_run: float = 0
+    last_run: float = 0 # time.monotonic(), 0 for never
     is_running: bool = False # TODO this needs to be a mutex
 
     @staticmethod
@@ -31,7 +35,8 @@ class Command:
             "cd": "cooldown",
             "d": "duration", # from API
             "n": "repeats", # from API
-            "r": "random_chance"
+            "r": "random_chance",
+            "ur": "user_rate",
         }
 
     @classmethod
@@ -42,8 +47,8 @@ class Command:
             return None
 
     def is_on_cooldown(self) -> bool:
-        delta = time.time() - self.last_run
-        if self.cooldown:
+        delta = time.monotonic() - self.last_run
+        if self.cooldown and self.last_run:
             return delta < self.cooldown
         return False
 
@@ -60,38 +65,88 @@ class Command:
                 if self.check_random_chance_success():
                     return True
                 else:
-                    print(f"{self.keys} failed random chance of {self.random_chance}%")
+                    metrics.inc("commands_rejected_random_chance")
+                    logging.info("%s failed random chance of %s%%", self.keys, self.random_chance)
             else:
-                print(f"{self.keys} is on cooldown")
+                metrics.inc("commands_rejected_cooldown")
+                logging.info("%s is on cooldown", self.keys)
         else:
-            print(f"{self.keys} is already running")
+            metrics.inc("commands_rejected_running")
+            logging.info("%s is already running", self.keys)
         return False
 
     def get_runner(self) -> Optional[Callable]:
         if self.can_run():
-            self.last_run = time.time()
+            self.last_run = time.monotonic()
 
             def fn() -> None:
                 self.is_running = True
-                self.fn(self.button, self.duration, int(self.repeats)) # TODO kwargs?
-                self.is_running = False
+                metrics.inc("commands_executed")
+                try:
+                    self.fn(self.button, self.duration, int(self.repeats)) # TODO kwargs?
+                finally:
+                    self.is_running = False
+                    metrics.inc("commands_finished")
 
             return fn
         return None
 
-    def run(self) -> bool:
+    def lane(self, by: str = "button") -> Hashable:
+        """Which executor lane this command's actions go on, actions on one lane never overlap
+
+        Args:
+            by (str, optional): "button" (the key or mouse button/move), "device" (keyboard or mouse) or "command". Defaults to "button".
+
+        Returns:
+            Hashable: lane
+        """
+        match by:
+            case "device":
+                return "mouse" if isinstance(self.button, list) else "keyboard"
+            case "command":
+                return id(self)
+            case _:
+                return tuple(self.button[:1]) if isinstance(self.button, list) else self.button
+
+    def run(self, pool: "executor.Executor" = None, received_at: float = None) -> bool:
+        """Check the command can run and queue it on the executor
+
+        Args:
+            pool (executor.Executor, optional): where to run it. Defaults to None which uses executor.get_default().
+            received_at (float, optional): latency.now() when the triggering message arrived, for latency tracing. Defaults to None.
+
+        Returns:
+            bool: true if queued
+        """
+        started_at = latency.now()
+        last_run = self.last_run
         runner = self.get_runner()
         if runner:
-            Thread(target=runner).start()
-            return True
+            pool = pool if pool else executor.get_default()
+            self.is_running = True # Queued counts as running so a flood can't queue the same command repeatedly
+            accepted = pool.submit(latency.traced(runner, received_at), self.lane(pool.lane_by))
+            if received_at is not None:
+                latency.record("dispatch", latency.now() - started_at)
+            if accepted:
+                metrics.inc("commands_dispatched")
+                return True
+            metrics.inc("commands_rejected_queue_full")
+            self.is_running = False
+            self.last_run = last_run # Rejected, so don't start the cooldown
         return False
 
-def execute_runners(runners: list[Callable]):
-    for runner in runners:
-        thread = Thread(target=runner)
-        thread.start()
-        thread.join()
+def execute_runners(runners: list[Callable], pool: "executor.Executor" = None, lane: Hashable = "execute_runners") -> bool:
+    """Run several runners one after the other on a single executor lane
+
+    Returns:
+        bool: true if accepted by the executor
+    """
+    def fn() -> None:
+        for runner in runners:
+            runner()
         # TODO this will need to lock the commands for the duration of the whole thing
+    pool = pool if pool else executor.get_default()
+    return pool.submit(fn, lane)
 
 Keymap = list[Command]
 
@@ -113,10 +168,13 @@ def split_csv(keys: str, delimiter: str = ',') -> list[str]:
     return [s.strip() for s in keys.split(delimiter)]
 
 
-def make_mouse_keymap(config: ConfigParser) -> Keymap:
+KEYBOARD_SECTION = "keyboard.chat.commands"
+MOUSE_SECTION    = "mouse.chat.commands"
+
+def make_mouse_keymap(config: ConfigParser, section: str = MOUSE_SECTION) -> Keymap:
     ret = []
 
-    for k, v in config['mouse.chat.commands'].items():
+    for k, v in config[section].items():
         commands, actions = (split_csv(k, ','), split_csv(v, ','))
 
         actions_splitted = actions[0].split()
@@ -139,10 +197,10 @@ def make_mouse_keymap(config: ConfigParser) -> Keymap:
 
     return ret
 
-def make_keyboard_keymap(config: ConfigParser) -> Keymap:
+def make_keyboard_keymap(config: ConfigParser, section: str = KEYBOARD_SECTION) -> Keymap:
     ret = []
 
-    for k, v in config['keyboard.chat.commands'].items():
+    for k, v in config[section].items():
         commands, actions = (split_csv(k, ','), split_csv(v, ','))
 
         button = actions[0]
@@ -165,6 +223,88 @@ def make_keyboard_keymap(config: ConfigParser) -> Keymap:
 def make_keymap_entry(config: ConfigParser) -> Keymap:
     return make_keyboard_keymap(config) + make_mouse_keymap(config)
 
+def make_channel_keymaps(config: ConfigParser, channels: list[str]) -> dict[str, Keymap]:
+    """Keymap for each channel, from the default sections unless the channel has its own
+
+    A channel overrides the keyboard or mouse commands with a section named after it, e.g.
+    [keyboard.chat.commands.somechannel].  Channels without their own section share the default
+    commands, so cooldowns and running state are shared between them too.
+
+    Args:
+        config (ConfigParser): parsed config.ini
+        channels (list[str]): lower case channel names
+
+    Returns:
+        dict[str, Keymap]: keymap by channel
+    """
+    keyboard, mouse = make_keyboard_keymap(config), make_mouse_keymap(config)
+    keymaps = {}
+    for channel in channels:
+        keyboard_section, mouse_section = f"{KEYBOARD_SECTION}.{channel}", f"{MOUSE_SECTION}.{channel}"
+        keymaps[channel] = ((make_keyboard_keymap(config, keyboard_section) if config.has_section(keyboard_section) else keyboard)
+                            + (make_mouse_keymap(config, mouse_section) if config.has_section(mouse_section) else mouse))
+    return keymaps
+
+@dataclass(slots=True)
+class KeymapTrieNode:
+    children: dict[str, "KeymapTrieNode"] = field(default_factory=dict)
+    commands: list[tuple[int, Command]] = field(default_factory=list) # (keymap order, command) of aliases ending here
+
+class KeymapTrie:
+    '''Keymap compiled into a prefix trie over the normalised aliases'''
+    '''Matching costs O(length of the longest alias) regardless of how many commands or aliases are in the keymap'''
+    def __init__(self, keymap: Keymap, prefer_longest: bool = False) -> None:
+        """Compile a keymap
+
+        Args:
+            keymap (Keymap): commands to match, earlier commands win ties as in the original linear search
+            prefer_longest (bool, optional): return the command with the longest matching alias rather than the first in the keymap. Defaults to False.
+        """
+        self.keymap         = keymap
+        self.prefer_longest = prefer_longest
+        self.root           = KeymapTrieNode()
+        self.max_depth      = 0
+
+        for order, command in enumerate(keymap):
+            for key in command.keys:
+                key = key.lower().strip()
+                node = self.root
+                for char in key:
+                    node = node.children.setdefault(char, KeymapTrieNode())
+                if not any(c is command for _, c in node.commands):
+                    node.commands.append((order, command))
+                self.max_depth = max(self.max_depth, len(key))
+
+    @staticmethod
+    def _first_allowed(node: KeymapTrieNode, username: str, dev_users: Container[str]) -> Optional[tuple[int, Command]]:
+        for order, command in node.commands:
+            if not command.is_dev_command or username.lower() in dev_users:
+                return (order, command)
+        return None
+
+    def match(self, payload: str, username: str = "", dev_users: Container[str] = frozenset()) -> Optional[Command]:
+        """Find the command whose alias the chat message starts with
+
+        Args:
+            payload (str): chat message text
+            username (str, optional): who sent it, for dev commands. Defaults to "".
+            dev_users (Container[str], optional): lower case usernames allowed to run dev commands, ideally a set. Defaults to frozenset().
+
+        Returns:
+            Optional[Command]: matching command or None
+        """
+        text = payload.lstrip()[:self.max_depth].lower()
+        node = self.root
+        best = self._first_allowed(node, username, dev_users)
+        for char in text:
+            node = node.children.get(char)
+            if node is None:
+                break
+            if node.commands and (found := self._first_allowed(node, username, dev_users)):
+                if self.prefer_longest or not best or found[0] < best[0]:
+                    best = found
+        return best[1] if best else None
+
 def log_keymap(keymap: Keymap, to_console = False) -> str:
     out_fn = logging.debug if not to_console else print
     rep = ""
@@ -0,0 +1,163 @@
+"""Compiled keymaps cached on disk by config content, and hot reloading of config.ini
+
+Only the chat commands are reloaded, other settings such as [dispatch] still need a restart.
+"""
+import logging
+
+import asyncio, dataclasses, hashlib, os, pathlib, pickle
+
+from configparser import ConfigParser
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import default_config
+import keymap
+from keymap import Command, Keymap, KeymapTrie
+
+CACHE_FORMAT = 2 # Bump whenever Command, KeymapTrie or what goes into them changes, so old caches are ignored
+CACHE_KEEP   = 5 # Most recent caches kept, older ones are deleted
+
+# Settings of a Command that come from the config, copied onto the live command when it is reloaded
+CONFIG_FIELDS = tuple(f.name for f in dataclasses.fields(Command) if f.name not in ("last_run", "is_running"))
+
+@dataclass(slots=True)
+class CompiledKeymap:
+    digest:   str                        # Hash of the config it was built from
+    keymaps:  dict[str, Keymap]          # By lower case channel name
+    matchers: dict[str, KeymapTrie]      # The same, compiled
+
+    @property
+    def commands(self) -> Keymap:
+        '''Every distinct command, in order'''
+        return list({id(command): command for km in self.keymaps.values() for command in km}.values())
+
+def get_channels(config: ConfigParser) -> list[str]:
+    return [channel.lower() for channel in keymap.split_csv(config[default_config.ConfigKeys.twitch]["TwitchChannelName"])]
+
+def config_digest(data: bytes) -> str:
+    return hashlib.sha256(CACHE_FORMAT.to_bytes(4, "little") + data).hexdigest()
+
+def compile_keymap(config: ConfigParser, digest: str = "") -> CompiledKeymap:
+    keymaps = keymap.make_channel_keymaps(config, get_channels(config))
+    return CompiledKeymap(digest, keymaps, {channel: KeymapTrie(km) for channel, km in keymaps.items()})
+
+def _prune(cache_dir: pathlib.Path) -> None:
+    caches = sorted(cache_dir.glob("keymap-*.pickle"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for old in caches[CACHE_KEEP:]:
+        old.unlink(missing_ok=True)
+
+def load(filename: str = "config.ini", cache_dir: Optional[str] = ".keymap_cache") -> tuple[ConfigParser, CompiledKeymap]:
+    """Read the config and get its compiled keymap, from the cache if this exact config has been compiled before
+
+    Args:
+        filename (str, optional): config file. Defaults to "config.ini".
+        cache_dir (Optional[str], optional): where compiled keymaps are kept, None to not cache. Defaults to ".keymap_cache".
+
+    Returns:
+        tuple[ConfigParser, CompiledKeymap]: parsed config and its keymap
+    """
+    if not os.path.isfile(filename):
+        default_config.make_default(filename)
+    with open(filename, "rb") as f:
+        data = f.read()
+    digest = config_digest(data)
+    config = ConfigParser()
+    config.read_string(data.decode("utf-8"), filename)
+
+    cache_file = pathlib.Path(cache_dir) / f"keymap-{digest}.pickle" if cache_dir else None
+    if cache_file and cache_file.is_file():
+        try:
+            with open(cache_file, "rb") as f:
+                compiled = pickle.load(f)
+            if isinstance(compiled, CompiledKeymap) and compiled.digest == digest:
+                logging.debug("Keymap loaded from %s", cache_file)
+                return (config, compiled)
+        except Exception as e: # A cache from older code can fail to unpickle in many ways, it is only a cache
+            logging.debug("Ignoring keymap cache %s: %s", cache_file, e)
+
+    compiled = compile_keymap(config, digest)
+    if cache_file:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, "wb") as f:
+                pickle.dump(compiled, f)
+            _prune(cache_file.parent)
+        except OSError as e:
+            logging.warning("Could not cache the keymap in %s: %s", cache_dir, e)
+    return (config, compiled)
+
+def command_identity(command: Command) -> tuple:
+    '''Commands with the same aliases and button are the same command, whatever their other settings'''
+    return (tuple(command.keys), repr(command.button))
+
+def carry_over_state(old: CompiledKeymap, new: CompiledKeymap) -> int:
+    """Swap the live commands into a newly compiled keymap wherever a command is unchanged
+
+    A live command takes on any new settings, e.g. a retuned cooldown, but keeps its last run time and
+    running state, and actions already queued or running keep working on it.
+
+    Args:
+        old (CompiledKeymap): keymap in use
+        new (CompiledKeymap): keymap just compiled, modified in place
+
+    Returns:
+        int: number of commands carried over
+    """
+    live = {command_identity(command): command for command in old.commands}
+    replacements: dict[int, Command] = {}
+    for command in new.commands:
+        if (current := live.get(command_identity(command))) is not None:
+            for name in CONFIG_FIELDS:
+                setattr(current, name, getattr(command, name))
+            replacements[id(command)] = current
+    new.keymaps = {channel: [replacements.get(id(command), command) for command in km] for channel, km in new.keymaps.items()}
+    new.matchers = {channel: KeymapTrie(km) for channel, km in new.keymaps.items()}
+    return len(replacements)
+
+class KeymapReloader:
+    """Watches the config file and recompiles the keymap when it changes
+
+    Run `watch_forever` alongside the chat loop.  Checking is a stat of the file every `interval` seconds,
+    compiling happens on a worker thread, and the new keymap is handed over on the event loop so it only
+    ever takes effect between two messages.
+    """
+    def __init__(self, filename: str, compiled: CompiledKeymap, cache_dir: Optional[str] = ".keymap_cache", interval: float = 1.0) -> None:
+        self.filename  = filename
+        self.current   = compiled
+        self.cache_dir = cache_dir
+        self.interval  = interval
+        self.stat      = self._stat()
+
+    def _stat(self) -> Optional[tuple[int, int]]:
+        try:
+            st = os.stat(self.filename)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    async def check(self) -> Optional[CompiledKeymap]:
+        """Recompile if the file has changed
+
+        Returns:
+            Optional[CompiledKeymap]: the new keymap, with the live commands carried over, or None if nothing changed
+        """
+        if (stat := self._stat()) is None or stat == self.stat:
+            return None
+        self.stat = stat
+        try:
+            _, compiled = await asyncio.to_thread(load, self.filename, self.cache_dir)
+        except Exception:
+            logging.exception("Keeping the current keymap, %s could not be loaded", self.filename)
+            return None
+        if compiled.digest == self.current.digest:
+            return None
+        n_kept = carry_over_state(self.current, compiled)
+        logging.info(f"Reloaded the keymap from {self.filename}, {len(compiled.commands)} commands of which {n_kept} kept their state")
+        self.current = compiled
+        return compiled
+
+    async def watch_forever(self, on_reload: Callable[[CompiledKeymap], None]) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            if (compiled := await self.check()):
+                on_reload(compiled)
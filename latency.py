@@ -0,0 +1,186 @@
+import logging
+
+import asyncio, json, threading, time
+
+from configparser import ConfigParser
+from typing import Callable, Optional
+
+now = time.perf_counter # Monotonic, and unlike time.monotonic has sub-millisecond resolution on Windows too
+
+class Histogram:
+    """Latency histogram with log-linear buckets, as in HdrHistogram
+
+    Values are whole microseconds.  Below 2 * SUB_BUCKETS they are exact; above that each power of two is
+    split into SUB_BUCKETS buckets, so percentiles are within about 3% while memory stays fixed.
+    """
+    SUB_BUCKET_BITS = 5
+    SUB_BUCKETS     = 1 << SUB_BUCKET_BITS
+    N_BUCKETS       = 1024 # Enough for over an hour
+
+    def __init__(self) -> None:
+        self.counts = [0] * self.N_BUCKETS
+        self.count  = 0
+        self.total  = 0
+        self.max    = 0
+
+    @classmethod
+    def bucket(cls, value: int) -> int:
+        shift = max(0, value.bit_length() - cls.SUB_BUCKET_BITS - 1)
+        return min((shift << cls.SUB_BUCKET_BITS) + (value >> shift), cls.N_BUCKETS - 1)
+
+    @classmethod
+    def bucket_range(cls, index: int) -> tuple[int, int]:
+        '''Lowest and one past the highest microsecond value counted in a bucket'''
+        shift = max(0, (index >> cls.SUB_BUCKET_BITS) - 1)
+        low = (index - (shift << cls.SUB_BUCKET_BITS)) << shift
+        return (low, low + (1 << shift))
+
+    def record(self, seconds: float) -> None:
+        value = max(0, int(seconds * 1e6))
+        self.counts[self.bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float:
+        """Value below which p percent of the recorded values fall
+
+        Args:
+            p (float): percentile, 0 to 100
+
+        Returns:
+            float: microseconds, the middle of the bucket it falls in, 0 if nothing was recorded
+        """
+        if not self.count:
+            return 0.0
+        target = max(1, round(self.count * p / 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                low, high = self.bucket_range(index)
+                return float(min((low + high - 1) / 2, self.max))
+        return float(self.max)
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "count":   self.count,
+            "mean_us": self.total / self.count if self.count else 0.0,
+            "p50_us":  self.percentile(50),
+            "p90_us":  self.percentile(90),
+            "p99_us":  self.percentile(99),
+            "p999_us": self.percentile(99.9),
+            "max_us":  float(self.max),
+        }
+
+class LatencyTracer:
+    """Per-stage latency histograms, from the bytes arriving on the socket to the first keyboard or mouse event
+
+    Stages, in order:
+        parse:      parsing one chunk of received bytes into messages
+        receive:    a message's bytes arriving until the chat loop picks it up, i.e. parse plus queueing
+        filter:     matching a chat message against the keymap
+        dispatch:   Command.run, cooldown and chance checks then queueing on the executor
+        executor:   waiting on the executor for a worker
+        output:     the worker starting the action until its first press or move
+        end_to_end: the message's bytes arriving until its first press or move
+    """
+    STAGES = ("parse", "receive", "filter", "dispatch", "executor", "output", "end_to_end")
+
+    def __init__(self, enabled: bool = True, log_interval: Optional[float] = None) -> None:
+        self.enabled      = enabled
+        self.log_interval = log_interval
+        self.histograms   = {stage: Histogram() for stage in self.STAGES}
+        self.lock         = threading.Lock() # Executor workers record too
+
+    def record(self, stage: str, seconds: float) -> None:
+        if self.enabled:
+            with self.lock:
+                self.histograms[stage].record(seconds)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        '''Percentiles of every stage that has seen anything'''
+        with self.lock:
+            return {stage: h.summary() for stage, h in self.histograms.items() if h.count}
+
+    def reset(self) -> None:
+        with self.lock:
+            self.histograms = {stage: Histogram() for stage in self.STAGES}
+
+    def dump(self, filename: str) -> None:
+        '''Write the snapshot as JSON'''
+        with open(filename, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+
+    def log_percentiles(self, level: int = logging.INFO) -> None:
+        for stage, s in self.snapshot().items():
+            logging.log(level, f"Latency {stage:10} n={s['count']:<7} p50={s['p50_us'] / 1000:8.2f}ms p90={s['p90_us'] / 1000:8.2f}ms"
+                               f" p99={s['p99_us'] / 1000:8.2f}ms max={s['max_us'] / 1000:8.2f}ms")
+
+    async def log_forever(self) -> None:
+        """Log the percentiles every `log_interval` seconds, for running alongside the chat loop"""
+        while self.enabled and self.log_interval:
+            await asyncio.sleep(self.log_interval)
+            self.log_percentiles()
+
+_default = LatencyTracer(enabled=False)
+_pending = threading.local() # (received_at, started_at) of the action running on this thread, until its first output
+
+def get_default() -> LatencyTracer:
+    return _default
+
+def set_default(tracer: LatencyTracer) -> None:
+    global _default
+    _default = tracer
+
+def record(stage: str, seconds: float) -> None:
+    _default.record(stage, seconds)
+
+def traced(fn: Callable[[], None], received_at: Optional[float]) -> Callable[[], None]:
+    """Wrap an action so the executor wait, and the time to its first output, are recorded against when its message arrived
+
+    Args:
+        fn (Callable[[], None]): action to run on the executor
+        received_at (Optional[float]): `now()` when the message that triggered it arrived, None to not trace
+
+    Returns:
+        Callable[[], None]: the action, wrapped if tracing
+    """
+    if received_at is None or not _default.enabled:
+        return fn
+    submitted_at = now()
+
+    def run_traced() -> None:
+        started_at = now()
+        record("executor", started_at - submitted_at)
+        _pending.trace = (received_at, started_at)
+        try:
+            fn()
+        finally:
+            _pending.trace = None
+    return run_traced
+
+def mark_output() -> None:
+    '''Called by outputs.py just before each press or move, records the first one of a traced action'''
+    trace = getattr(_pending, "trace", None)
+    if trace:
+        _pending.trace = None
+        received_at, started_at = trace
+        t = now()
+        record("output", t - started_at)
+        record("end_to_end", t - received_at)
+
+def make_tracer(config: ConfigParser) -> LatencyTracer:
+    """Make the tracer set up in the config, disabled if the section is missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        LatencyTracer: tracer to pass to `set_default`
+    """
+    if not config.has_section("latency"):
+        return LatencyTracer(enabled=False)
+    section = config["latency"]
+    interval = section.getfloat("LogEverySeconds", fallback=60.0)
+    return LatencyTracer(section.getboolean("Enabled", fallback=False), interval if interval > 0 else None)
@@ -0,0 +1,243 @@
+"""Local stand-in for the Twitch IRC server with a synthetic chat load generator
+
+Speaks enough of the Twitch dialect for logging in, JOIN, PING/PONG, CAP REQ and RECONNECT, so the whole
+ingest path can be tested and load tested offline.  For example
+    python local_irc_server.py --port 6667 --rate 500 --users 2000 --burst-size 300 --burst-every 5
+then point the client at it with TwitchIrc.set_default_server("127.0.0.1", 6667).
+"""
+import logging
+
+import argparse, asyncio, random, threading, uuid
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+from twitch import TwitchIrc
+
+@dataclass(slots=True)
+class ChatLoad:
+    '''Shape of the synthetic chat sent to every joined channel'''
+    rate:              float = 10.0  # Messages per second, on average
+    n_users:           int   = 100   # Distinct chatters
+    mix:               dict[str, float] = field(default_factory=lambda: {"forward": 3, "look left": 1, "look right": 1, "lol": 5})
+    burst_every:       Optional[float] = None # Seconds between bursts, None for no bursts
+    burst_size:        int   = 100   # Extra messages in each burst, all in one write
+    split_probability: float = 0.0   # Chance a write is split into two at a random byte, to exercise partial frames
+    tags:              bool  = False # Add IRCv3 tags, as if the client had sent CAP REQ :twitch.tv/tags
+
+    def message(self, channel: str, tags: bool = False) -> bytes:
+        return self.messages(channel, 1)[1 if tags or self.tags else 0]
+
+    def messages(self, channel: str, n: int) -> tuple[bytes, bytes]:
+        '''`n` random messages, without and with tags, so every client joined to a channel gets the same chat'''
+        plain, tagged = [], []
+        for _ in range(n):
+            user = f"viewer{random.randrange(self.n_users)}"
+            text = random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+            line = f":{user}!{user}@{user}.tmi.twitch.tv PRIVMSG #{channel} :{text}\r\n"
+            plain.append(line)
+            tagged.append(f"@badges=;display-name={user};id={uuid.uuid4()};mod=0;subscriber=0;user-id={user[6:]} {line}")
+        return "".join(plain).encode(), "".join(tagged).encode()
+
+class LocalTwitchClient:
+    '''One client connection to the local server'''
+    def __init__(self, server: "LocalTwitchServer", reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.server   = server
+        self.reader   = reader
+        self.writer   = writer
+        self.nick     = "justinfan"
+        self.channels: set[str] = set()
+        self.tags     = False
+        self.n_pongs  = 0
+        self.lock     = asyncio.Lock() # A split write must not have another write land in the middle of it
+        self.task     = asyncio.current_task()
+
+    async def write(self, data: bytes) -> None:
+        async with self.lock:
+            if self.writer.is_closing():
+                return
+            if len(data) > 1 and random.random() < self.server.load.split_probability:
+                cut = random.randrange(1, len(data))
+                self.writer.write(data[:cut])
+                await self.writer.drain()
+                await asyncio.sleep(0)
+                data = data[cut:]
+            self.writer.write(data)
+            await self.writer.drain()
+
+    async def handle(self) -> None:
+        while (line := await self.reader.readline()):
+            line = line.rstrip(b"\r\n").decode("utf-8", "replace")
+            command, _, rest = line.partition(" ")
+            self.server.received.append(line)
+            match command:
+                case "NICK":
+                    self.nick = rest
+                    await self.write(b"".join(f":tmi.twitch.tv {n} {self.nick} :-\r\n".encode() for n in ("001", "002", "003", "004", "375", "372", "376")))
+                case "CAP":
+                    self.tags = "twitch.tv/tags" in rest
+                    await self.write(f":tmi.twitch.tv CAP * ACK :{rest.partition(':')[2]}\r\n".encode())
+                case "JOIN":
+                    for channel in rest.split(","):
+                        channel = channel.strip().lstrip("#")
+                        if not channel:
+                            continue # Twitch silently ignores these
+                        self.channels.add(channel)
+                        await self.write((f":{self.nick}!{self.nick}@{self.nick}.tmi.twitch.tv JOIN #{channel}\r\n"
+                                          f":{self.nick}.tmi.twitch.tv 353 {self.nick} = #{channel} :{self.nick}\r\n"
+                                          f":{self.nick}.tmi.twitch.tv 366 {self.nick} #{channel} :End of /NAMES list\r\n").encode())
+                case "PART":
+                    self.channels.discard(rest.strip().lstrip("#"))
+                case "PING":
+                    await self.write(f":tmi.twitch.tv PONG tmi.twitch.tv {rest}\r\n".encode())
+                case "PONG":
+                    self.n_pongs += 1
+        self.writer.close()
+
+class LocalTwitchServer:
+    """Local IRC server that sends synthetic chat to every client that has joined a channel
+
+    Use `async with` inside an event loop, or `start_in_thread`/`stop` from synchronous code.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, load: ChatLoad = None, ping_interval: float = None) -> None:
+        self.host          = host
+        self.port          = port
+        self.load          = load if load else ChatLoad(rate=0)
+        self.ping_interval = ping_interval
+        self.clients: list[LocalTwitchClient] = []
+        self.received: list[str] = [] # Every line received from any client
+        self.n_sent        = 0
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.tasks: list[asyncio.Task] = []
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopping: Optional[asyncio.Event] = None
+
+    def twitch_irc(self) -> TwitchIrc:
+        '''Server definition to hand to a client connection'''
+        return TwitchIrc(self.host, self.port)
+
+    async def _on_connect(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        client = LocalTwitchClient(self, reader, writer)
+        self.clients.append(client)
+        try:
+            await client.handle()
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.remove(client)
+
+    async def start(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_server(self._on_connect, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.tasks = [asyncio.create_task(self._generate_chat())]
+        if self.ping_interval:
+            self.tasks.append(asyncio.create_task(self._ping()))
+        logging.info("Local Twitch IRC server listening on %s:%d", self.host, self.port)
+
+    async def close(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        clients = list(self.clients)
+        for client in clients:
+            client.writer.close()
+        await asyncio.gather(*(client.task for client in clients), return_exceptions=True)
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def broadcast(self, data: bytes, joined_only: bool = False) -> None:
+        for client in list(self.clients):
+            if client.channels or not joined_only:
+                await client.write(data)
+
+    async def send_reconnect(self) -> None:
+        '''Tell every client to reconnect, as Twitch does before a server restart'''
+        await self.broadcast(b":tmi.twitch.tv RECONNECT\r\n")
+
+    async def _ping(self) -> None:
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            await self.broadcast(b"PING :tmi.twitch.tv\r\n")
+
+    async def _generate_chat(self, tick: float = 0.01) -> None:
+        owed = 0.0
+        next_burst = self.loop.time() + self.load.burst_every if self.load.burst_every else None
+        while True:
+            await asyncio.sleep(tick)
+            owed += self.load.rate * tick
+            n, owed = int(owed), owed - int(owed)
+            if next_burst and self.loop.time() >= next_burst:
+                n += self.load.burst_size
+                next_burst += self.load.burst_every
+            if not n:
+                continue
+            chat = {channel: self.load.messages(channel, n) for channel in {channel for client in self.clients for channel in client.channels}}
+            for client in list(self.clients):
+                for channel in list(client.channels):
+                    await client.write(chat[channel][1 if client.tags or self.load.tags else 0])
+                    self.n_sent += n
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def start_in_thread(self) -> "LocalTwitchServer":
+        '''Run the server on its own event loop in a background thread, returns once it is listening'''
+        started = threading.Event()
+
+        async def serve() -> None:
+            await self.start()
+            started.set()
+            self.stopping = asyncio.Event()
+            await self.stopping.wait()
+            await self.close()
+
+        self.thread = threading.Thread(target=asyncio.run, args=(serve(),), name="LocalTwitchServer", daemon=True)
+        self.thread.start()
+        started.wait()
+        return self
+
+    def call_soon(self, coroutine) -> None:
+        '''Run a coroutine such as `send_reconnect()` on the server thread'''
+        asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.stopping.set)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start_in_thread()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+def parse_mix(mix: str) -> dict[str, float]:
+    '''"forward:3,look left:1" to {"forward": 3.0, "look left": 1.0}'''
+    return {text.strip(): float(weight) for text, _, weight in (item.rpartition(":") for item in mix.split(","))}
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Local stand-in for the Twitch IRC server with synthetic chat")
+    argparser.add_argument("--host", default="127.0.0.1")
+    argparser.add_argument("--port", type=int, default=6667)
+    argparser.add_argument("--rate", type=float, default=10.0, help="chat messages per second per channel")
+    argparser.add_argument("--users", type=int, default=100, help="number of distinct chatters")
+    argparser.add_argument("--mix", default="forward:3,look left:1,look right:1,lol:5", help="message:weight, comma separated")
+    argparser.add_argument("--burst-every", type=float, default=None, help="seconds between bursts")
+    argparser.add_argument("--burst-size", type=int, default=100, help="messages per burst")
+    argparser.add_argument("--split", type=float, default=0.0, help="probability of splitting a write mid frame")
+    argparser.add_argument("--tags", action="store_true", help="send IRCv3 tags")
+    argparser.add_argument("--ping", type=float, default=60.0, help="seconds between PINGs")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    load = ChatLoad(args.rate, args.users, parse_mix(args.mix), args.burst_every, args.burst_size, args.split, args.tags)
+
+    async def serve_forever() -> None:
+        async with LocalTwitchServer(args.host, args.port, load, args.ping) as server:
+            await server.server.serve_forever()
+
+    asyncio.run(serve_forever())
@@ -0,0 +1,126 @@
+import logging
+import logging.handlers
+
+import gzip, os, pathlib, queue, shutil, time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread
+
+    The stock handler formats every record before queueing it; here the record goes on the queue as it is,
+    so a log call on the dispatch or output threads costs little more than a queue put.  Everything stays in
+    this process, so there is no need to flatten records for pickling.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+class RepeatFilter(logging.Filter):
+    """Lets the first of a run of identical messages through and counts the rest for `window` seconds
+
+    Messages are the same if they come from the same place with the same arguments.  The next one let
+    through after the window says how many were suppressed, so a flood of e.g. cooldown rejections is
+    a line every few seconds however fast it comes.
+    """
+    MAX_KEYS = 10000 # Forget everything if this many different messages are being tracked, to bound memory
+
+    def __init__(self, window: float = 5.0, clock: Callable[[], float] = time.monotonic) -> None:
+        super().__init__()
+        self.window     = window
+        self.clock      = clock
+        self.seen: dict[tuple, list] = {} # key -> [let through at, suppressed since]
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        try:
+            key = (record.name, record.levelno, record.pathname, record.lineno, str(record.msg), repr(record.args))
+        except Exception:
+            return True
+        now = self.clock()
+        if (seen := self.seen.get(key)) is not None and now - seen[0] < self.window:
+            seen[1] += 1
+            self.suppressed += 1
+            return False
+        if len(self.seen) >= self.MAX_KEYS:
+            self.seen.clear()
+        if seen and seen[1]:
+            record.msg = f"{record.getMessage()} (repeated {seen[1]} more times)"
+            record.args = None
+        self.seen[key] = [now, 0]
+        return True
+
+class RepeatSuppressingListener(logging.handlers.QueueListener):
+    '''QueueListener that drops repeats before any handler sees them'''
+    def __init__(self, q: queue.SimpleQueue, *handlers: logging.Handler, repeat_filter: Optional[RepeatFilter] = None) -> None:
+        super().__init__(q, *handlers, respect_handler_level=True)
+        self.repeat_filter = repeat_filter
+
+    def handle(self, record: logging.LogRecord) -> None:
+        if self.repeat_filter is None or self.repeat_filter.filter(record):
+            super().handle(record)
+
+class GzipRotator:
+    """Rotator for file handlers that compresses each rotated file on a background thread
+
+    Set as the handler's `rotator`, with `namer` for the .gz name, so rotating is only a rename on the
+    logging thread.  Only the newest `keep` compressed files are kept.
+    """
+    def __init__(self, keep: int = 10) -> None:
+        self.keep     = keep
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="log-compress")
+
+    @staticmethod
+    def namer(name: str) -> str:
+        return name + ".gz"
+
+    def __call__(self, source: str, dest: str) -> None:
+        plain = dest[:-len(".gz")] if dest.endswith(".gz") else dest
+        os.replace(source, plain)
+        self.executor.submit(self._compress, plain, dest)
+
+    def _compress(self, plain: str, dest: str) -> None:
+        try:
+            with open(plain, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+            os.remove(plain)
+            compressed = sorted(pathlib.Path(dest).parent.glob(pathlib.Path(plain).name.split(".")[0] + ".*.gz"), key=os.path.getmtime)
+            for old in compressed[:-self.keep] if self.keep else []:
+                old.unlink(missing_ok=True)
+        except OSError as e:
+            print(f"Could not compress {plain}: {e}") # Not logged, this runs under the logging machinery
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+class QueueLogging:
+    '''The queue, the listener writing to the real handlers, and the compressor, to stop at exit'''
+    def __init__(self, listener: RepeatSuppressingListener, rotator: Optional[GzipRotator] = None) -> None:
+        self.listener = listener
+        self.rotator  = rotator
+
+    def stop(self) -> None:
+        '''Write out everything still queued'''
+        self.listener.stop()
+        if self.rotator:
+            self.rotator.shutdown()
+
+def start(handlers: list[logging.Handler], level: int = logging.INFO, repeat_window: float = 5.0,
+          rotator: Optional[GzipRotator] = None) -> QueueLogging:
+    """Send everything logged through a queue to `handlers` on a listener thread
+
+    Args:
+        handlers (list[logging.Handler]): where records end up, only ever called from the listener thread
+        level (int, optional): root logger level. Defaults to logging.INFO.
+        repeat_window (float, optional): seconds to suppress repeats of a message for, 0 to let them all through. Defaults to 5.0.
+        rotator (Optional[GzipRotator], optional): compressor used by the handlers, shut down with the rest. Defaults to None.
+
+    Returns:
+        QueueLogging: call `stop` before exiting
+    """
+    q = queue.SimpleQueue() # Unbounded so logging never blocks, repeats are dropped on the far side
+    listener = RepeatSuppressingListener(q, *handlers, repeat_filter=RepeatFilter(repeat_window) if repeat_window > 0 else None)
+    logging.root.handlers = [LazyQueueHandler(q)]
+    logging.root.setLevel(level)
+    listener.start()
+    return QueueLogging(listener, rotator)
@@ -1,23 +1,54 @@
 VERSION = 0.10
 
+import time
+LAUNCHED = time.perf_counter() # Before anything else is imported, for the startup report
+
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
-from time           import sleep
+import asyncio
+import atexit
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses    import dataclass
+import contextlib
 import pathlib
-import multiprocessing as mp
-from threading import Thread
-from typing import Optional
+import threading
+from typing import Callable, Container, Optional
 
-import pynput.keyboard
+# pynput is only imported in the background once main() is running, see start_hotkey_listener and outputs.PynputBackend
 
 import twitch
+import twitch_async
 import default_config
+import dispatch
+import executor
+import holds
 import keymap
+import keymap_cache
+import latency
+import logqueue
+import metrics
+import motion
+import outputs
+import ratelimit
+import replay
+import spam
+import startup
+import timers
+
+CONFIG_FILE = "config.ini"
+
+def setup_logging(log_level: int = logging.INFO, repeat_window: float = 5.0, compress: bool = True) -> logqueue.QueueLogging:
+    """Setup the global logger, writing to the console and a rotating file from a background thread
+
+    Args:
+        log_level (int, optional): root logger level. Defaults to logging.INFO.
+        repeat_window (float, optional): seconds a repeated message is suppressed for, 0 to log every one. Defaults to 5.0.
+        compress (bool, optional): gzip rotated log files in the background. Defaults to True.
 
-def setup_logging(log_level: int = logging.INFO) -> None:
-    """Setup the global logger"""
+    Returns:
+        logqueue.QueueLogging: stop it on exit to write out anything still queued
+    """
     directory = "logs"
     filename = "log"
     pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
@@ -29,20 +60,21 @@ def setup_logging(log_level: int = logging.INFO) -> None:
                 interval=30,
                 backupCount=10
             )
-    h.namer = lambda name: name.replace(".log", "") + ".log"
-
-    logging.root.handlers = []
-    logging.basicConfig(
-        level=log_level,
-        format="%(asctime)s %(levelname)s:%(message)s",
-        datefmt="%y%m%d %H:%M:%S",
-        handlers=[
-            h,
-            logging.StreamHandler()
-        ]
-    )
-    sourceFilename = __file__.rsplit('\\', 1)[1]
+    rotator = logqueue.GzipRotator(keep=h.backupCount) if compress else None
+    if rotator:
+        h.namer, h.rotator = rotator.namer, rotator
+    else:
+        h.namer = lambda name: name.replace(".log", "") + ".log"
+
+    formatter = logging.Formatter("%(asctime)s %(levelname)s:%(message)s", datefmt="%y%m%d %H:%M:%S")
+    handlers = [h, logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue_logging = logqueue.start(handlers, log_level, repeat_window, rotator)
+
+    sourceFilename = pathlib.Path(__file__).name
     logging.log(logging.root.getEffectiveLevel(), f"Logging initialised for {sourceFilename} at level {logging.getLevelName(log_level)}")
+    return queue_logging
 
 def print_preamble(start_key: str, mykeymap: keymap.Keymap) -> None:
     """Function to print programme start text to the console.
@@ -69,33 +101,105 @@ def print_preamble(start_key: str, mykeymap: keymap.Keymap) -> None:
 
     print("\n")
 
-def message_filter(message: tuple[str, str], key_to_function_map: keymap.Keymap, dev_users: list=None) -> Optional[keymap.Command]:
+def message_filter(message: tuple[str, str], key_to_function_map: keymap.Keymap | keymap.KeymapTrie, dev_users: Container[str]=frozenset()) -> Optional[keymap.Command]:
     username, payload = message
-    for command in key_to_function_map:
-        for key in command.keys:
-            if payload.lower().strip().startswith(key):
-                if not command.is_dev_command:
-                    return command
-                else:
-                    if username.lower() in dev_users:
-                        return command
-    return None
+    if not isinstance(key_to_function_map, keymap.KeymapTrie):
+        key_to_function_map = keymap.KeymapTrie(key_to_function_map) # Slow path, compile once up front instead
+    return key_to_function_map.match(payload, username, dev_users or frozenset())
+
+def start_hotkey_listener(hotkeys: dict[str, Callable[[], None]]):
+    """Import pynput and listen for the hotkeys, meant for a background thread as pynput is slow to import
+
+    Args:
+        hotkeys (dict[str, Callable[[], None]]): function to call for each key combination, in pynput's format e.g. "<shift>+<backspace>"
+
+    Returns:
+        pynput.keyboard.Listener: running listener, stop it when done
+    """
+    import pynput.keyboard
+    handlers = [pynput.keyboard.HotKey(pynput.keyboard.HotKey.parse(keys), fn) for keys, fn in hotkeys.items()]
+
+    def on_press(key) -> None:
+        for handler in handlers:
+            handler.press(key)
+
+    def on_release(key) -> None:
+        for handler in handlers:
+            handler.release(key)
+
+    listener = pynput.keyboard.Listener(on_press=on_press, on_release=on_release)
+    listener.start()
+    return listener
+
+def log_listener_failure(listener: Future) -> None:
+    '''Say straight away if the hotkeys could not be set up, rather than only when exiting'''
+    if (e := listener.exception()) is not None:
+        logging.error("Hotkeys are not available: %s", e, exc_info=e)
 
 def main() -> None:
     #mp.freeze_support()
+    startup_timer = startup.StartupTimer(LAUNCHED)
+    startup_timer.mark("imports")
 
-    config = default_config.get_from_file()
+    config = default_config.get_from_file(CONFIG_FILE)
 
-    channel   = config[default_config.ConfigKeys.twitch]['TwitchChannelName'].lower()
+    twitch_config = config[default_config.ConfigKeys.twitch]
+    channels  = keymap_cache.get_channels(config)
     start_key = config[default_config.ConfigKeys.broadcaster]['OutputToggleOnOff']
     log_level = logging.getLevelName(config[default_config.ConfigKeys.logging]['DebugLevel'])
-    dev_users = [user.lower() for user in keymap.split_csv(config['dev.users']['users'])]
-
-    setup_logging(log_level)
-    mykeymap = keymap.make_keymap_entry(config)
+    dev_users = frozenset(user.lower() for user in keymap.split_csv(config['dev.users']['users']))
+    startup_timer.mark("config")
+
+    logging_config = config[default_config.ConfigKeys.logging]
+    queue_logging = setup_logging(log_level, logging_config.getfloat('RepeatWindowSeconds', fallback=5.0),
+                                  logging_config.getboolean('CompressRotated', fallback=True))
+    atexit.register(queue_logging.stop) # Last, after anything logged on the way out
+    startup_timer.mark("logging")
+
+    background = ThreadPoolExecutor(1, thread_name_prefix="startup") # Loads pynput while the IRC connection is set up
+    backend = outputs.DeferredBackend(background.submit(outputs.make_backend, config))
+    wheel = timers.make_wheel(config)
+    timers.set_default(wheel)
+    engine = motion.make_engine(config)
+    motion.set_default(engine)
+
+    cache_dir = config.get(default_config.ConfigKeys.keymap, 'CacheDir', fallback=".keymap_cache") or None
+    _, compiled = keymap_cache.load(CONFIG_FILE, cache_dir)
+    mykeymap = compiled.commands
     keymap.log_keymap(mykeymap)
+    matchers = dict(compiled.matchers) # Updated in place on a reload, so is_command below sees the new keymap too
+    dispatcher = dispatch.make_dispatcher(config, mykeymap)
+    limiter    = ratelimit.make_limiter(config)
+    reloader = None
+    if config.getboolean(default_config.ConfigKeys.keymap, 'HotReload', fallback=False):
+        reloader = keymap_cache.KeymapReloader(CONFIG_FILE, compiled, cache_dir,
+                                               config.getfloat(default_config.ConfigKeys.keymap, 'ReloadCheckSeconds', fallback=1.0))
+
+    def is_command(msg: twitch.TwitchIrc.Message) -> bool:
+        channel, message_text = msg.payload_as_tuple()
+        return channel in matchers and message_filter((msg.username, message_text), matchers[channel], dev_users) is not None
+
+    collapser = spam.make_collapser(config)
+    connection_kwargs = {
+        "chunk_size":   twitch_config.getint('ReceiveChunkSize', fallback=4096),
+        "request_tags": twitch_config.getboolean('RequestTags', fallback=False),
+        "channels_per_connection": twitch_config.getint('ChannelsPerConnection', fallback=20),
+        "store":        twitch.MessageStore(
+                            twitch_config.getint('MaxMessages', fallback=50),
+                            twitch.OverloadPolicy(twitch_config.get('OverloadPolicy', fallback="drop-oldest").lower()),
+                            is_command=is_command
+                        ),
+        "collapser":    collapser,
+        "reconnect":    twitch_config.getboolean('Reconnect', fallback=True),
+        "standby":      twitch_config.getboolean('Standby', fallback=False),
+        "backoff":      twitch.Backoff(twitch_config.getfloat('ReconnectBackoffSeconds', fallback=1.0),
+                                       twitch_config.getfloat('ReconnectBackoffMaxSeconds', fallback=60.0)),
+        "ping_interval": twitch_config.getfloat('PingSeconds', fallback=60.0) or None,
+        "ping_timeout": twitch_config.getfloat('PingTimeoutSeconds', fallback=10.0),
+    }
 
     print_preamble(start_key, mykeymap)
+    startup_timer.mark("keymap")
 
     @dataclass(slots=True)
     class OnOffSwitch:
@@ -107,33 +211,138 @@ def main() -> None:
 
     is_active    = OnOffSwitch()
 
-    onOffHandler = pynput.keyboard.HotKey(
-        pynput.keyboard.HotKey.parse('<shift>+<backspace>'),
-        lambda is_active=is_active: is_active.toggle()
-        )
-
-    with (twitch.ChannelConnection(channel) as tw,
-            pynput.keyboard.Listener(
-                    on_press=onOffHandler.press,
-                    on_release=onOffHandler.release
-                )):#,
-            #mp.Pool(processes=4) as pool):
-        logging.info(f"Connected to #{channel}")
-
-        while True:
-            tw.run()
-            msgs = tw.get_chat_messages()
+    tracer = latency.make_tracer(config)
+    latency.set_default(tracer)
+    latency_config = config[default_config.ConfigKeys.latency] if config.has_section(default_config.ConfigKeys.latency) else {}
+    latency_file = latency_config.get('DumpFile', "")
+
+    def dump_latency() -> None:
+        tracer.log_percentiles()
+        if latency_file:
+            tracer.dump(latency_file)
+
+    hotkeys = {'<shift>+<backspace>': lambda is_active=is_active: is_active.toggle()}
+    if tracer.enabled and (dump_key := latency_config.get('DumpHotkey', "")):
+        hotkeys[dump_key] = dump_latency
+    listener = background.submit(start_hotkey_listener, hotkeys)
+    listener.add_done_callback(log_listener_failure)
+    background.shutdown(wait=False)
+
+    capture_file = twitch_config.get('CaptureFile', fallback="")
+
+    metrics_server = metrics.make_server(config)
+    metrics_config = config[default_config.ConfigKeys.metrics] if config.has_section(default_config.ConfigKeys.metrics) else {}
+    metrics_file = metrics_config.get('File', "") if metrics.is_enabled(config) else ""
+
+    with (backend,
+            executor.make_executor(config) as pool,
+            (replay.CaptureWriter(capture_file) if capture_file else contextlib.nullcontext()) as capture):
+        outputs.set_default(backend)
+        executor.set_default(pool)
+        metrics.gauge("executor_queue_depth", lambda: pool.stats()["queue_depth"])
+        metrics.gauge("threads", threading.active_count)
+        if metrics_server:
+            metrics_server.start()
+        metrics.gauge("actions_running", lambda: (counters := metrics.get_default().counters()).get("commands_executed", 0) - counters.get("commands_finished", 0))
+        if capture:
+            logging.info(f"Recording raw chat traffic to {capture_file}")
+            connection_kwargs["tee"] = capture.write
+        try:
+            asyncio.run(run_chat_loop(channels, matchers, dev_users, dispatcher, startup_timer=startup_timer, reloader=reloader,
+                                      limiter=limiter, metrics_file=metrics_file,
+                                      metrics_every=float(metrics_config.get('WriteEverySeconds', 10)), **connection_kwargs))
+        finally:
+            holds.get_default().close() # Let go of any key still held, first whatever else fails
+            if listener.exception() is None:
+                listener.result().stop()
+            engine.close()
+            wheel.close()
+            logging.info(f"Timers {wheel.stats()}")
+            if limiter:
+                logging.info(f"Rate limiter {limiter.stats()}")
+            if collapser:
+                logging.info(f"Spam collapser {collapser.stats()}")
+            if metrics_server:
+                metrics_server.stop()
+            if metrics_file:
+                metrics.write_file(metrics.get_default(), metrics_file)
+            if tracer.enabled:
+                dump_latency()
+
+async def run_chat_loop(channels: str | list[str], matcher: keymap.KeymapTrie | dict[str, keymap.KeymapTrie], dev_users: Container[str],
+                        dispatcher: dispatch.Dispatcher = None, startup_timer: startup.StartupTimer = None,
+                        reloader: keymap_cache.KeymapReloader = None, limiter: ratelimit.UserRateLimiter = None,
+                        metrics_file: str = None, metrics_every: float = 10.0, **connection_kwargs) -> None:
+    """Dispatch chat commands as soon as each message arrives, from one or many channels
 
-            for msg in msgs:
-                channel, message_text = msg.payload_as_tuple()
-                logging.debug(f"From {msg.username} in {channel}: {message_text}")
-
-                action = message_filter((msg.username, message_text), mykeymap, dev_users=dev_users) #TODO re-enable this or quit.... | keymap.easter_eggs)
-
-                if action:
-                    action.run()
-
-            sleep(0.01)
+    Args:
+        channels (str | list[str]): Twitch channel(s) to join
+        matcher (keymap.KeymapTrie | dict[str, keymap.KeymapTrie]): compiled commands to match chat messages against, or those for each channel
+        dev_users (Container[str]): lower case usernames allowed to run dev commands
+        dispatcher (dispatch.Dispatcher, optional): what to do with matched commands. Defaults to None which runs them straight away.
+        startup_timer (startup.StartupTimer, optional): marks connecting, joining and the first command, and reports once joined. Defaults to None.
+        reloader (keymap_cache.KeymapReloader, optional): swaps in the new commands whenever the config changes, `matcher` must then be a dict. Defaults to None.
+        limiter (ratelimit.UserRateLimiter, optional): drops commands from chatters going too fast. Defaults to None which lets everything through.
+        metrics_file (str, optional): write the metrics to this file as JSON every `metrics_every` seconds. Defaults to None which writes none.
+        metrics_every (float, optional): seconds between writing `metrics_file`. Defaults to 10.0.
+        **connection_kwargs: passed on to `twitch_async.AsyncChannelPool`, e.g. channels_per_connection, chunk_size, request_tags or store
+    """
+    channels   = [channels] if isinstance(channels, str) else channels
+    matchers   = matcher if isinstance(matcher, dict) else {channel.lower().lstrip("#"): matcher for channel in channels}
+    dispatcher = dispatcher if dispatcher else dispatch.AnarchyDispatcher()
+
+    async with twitch_async.AsyncChannelPool(channels, **connection_kwargs) as tw:
+        logging.info(f"Connected to {', '.join('#' + channel for channel in tw.channels)}")
+        if startup_timer:
+            startup_timer.mark("connect", tw.connected_at)
+            startup_timer.mark("join", tw.joined_at)
+            startup_timer.report()
+        ticker = asyncio.create_task(dispatch.tick_forever(dispatcher))
+        reporter = asyncio.create_task(latency.get_default().log_forever())
+
+        def reload(compiled: keymap_cache.CompiledKeymap) -> None:
+            matchers.clear()
+            matchers.update(compiled.matchers)
+            dispatcher.set_keymap(compiled.commands)
+        watcher = asyncio.create_task(reloader.watch_forever(reload)) if reloader else None
+        writer = asyncio.create_task(metrics.write_forever(metrics.get_default(), metrics_file, metrics_every)) if metrics_file else None
+        metrics.gauge("buffer_depth", lambda: len(tw.store))
+        metrics.total("messages_dropped", lambda: sum(tw.store.dropped.values()))
+        metrics.gauge("seconds_since_ping", tw.seconds_since_ping)
+        metrics.gauge("ping_rtt_seconds", tw.ping_rtt)
+
+        async for msg in tw:
+            filter_start = latency.now()
+            votes = msg.take_repeats() # Before anything else, so copies arriving from here on go on as a new message
+            if msg.received_at is not None:
+                latency.record("receive", filter_start - msg.received_at)
+            channel, message_text = msg.payload_as_tuple()
+            logging.debug("From %s in %s: %s", msg.username, channel, message_text)
+
+            if (matcher := matchers.get(channel)) is None:
+                continue
+            action = message_filter((msg.username, message_text), matcher, dev_users=dev_users) #TODO re-enable this or quit.... | keymap.easter_eggs)
+            latency.record("filter", latency.now() - filter_start)
+
+            if action is None:
+                continue
+            metrics.inc("messages_matched")
+            if limiter and not limiter.allow(msg.username, action):
+                metrics.inc("commands_rate_limited")
+                logging.debug("Rate limited %s running %s", msg.username, action.keys)
+            else:
+                dispatcher.submit(action, received_at=msg.received_at, votes=votes)
+                if startup_timer:
+                    logging.info(f"First command processed {startup_timer.mark('first command') * 1000:.1f}ms after joining,"
+                                 f" {(startup_timer.elapsed()):.2f}s after launch")
+                    startup_timer = None
+
+        ticker.cancel()
+        reporter.cancel()
+        if watcher:
+            watcher.cancel()
+        if writer:
+            writer.cancel()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
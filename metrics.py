@@ -0,0 +1,193 @@
+import logging
+
+import asyncio, json, threading, time
+
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+class Registry:
+    """Counters and gauges for the running instance
+
+    Counters are kept per thread, so counting on the hot path is a dict update with no lock, and only
+    added up across threads when scraped.  A thread's counts are folded into `retired` once it has finished,
+    so a thread per task doesn't leave a dict behind for every task.  Gauges, and totals kept elsewhere, are
+    functions called when scraped.
+    """
+    def __init__(self) -> None:
+        self.local     = threading.local()
+        self.per_thread: list[tuple[threading.Thread, dict[str, int]]] = [] # Counters of each thread that may still be counting
+        self.retired: dict[str, int] = {} # Counts of threads that have finished
+        self.prune_at  = 64
+        self.gauges: dict[str, Callable[[], Optional[float]]] = {}
+        self.totals: dict[str, Callable[[], int]] = {}
+        self.lock      = threading.Lock() # Only taken the first time a thread counts, and to scrape
+        self.started   = time.monotonic()
+
+    def _counters(self) -> dict[str, int]:
+        counters = self.local.counters = {}
+        with self.lock:
+            self.per_thread.append((threading.current_thread(), counters))
+            if len(self.per_thread) > self.prune_at:
+                self._prune()
+                self.prune_at = max(64, 2 * len(self.per_thread))
+        return counters
+
+    def _prune(self) -> None:
+        '''Fold the counts of finished threads into `retired`, with the lock held'''
+        alive = []
+        for thread, counters in self.per_thread:
+            if thread.is_alive():
+                alive.append((thread, counters))
+                continue
+            for name, n in counters.items(): # Nothing writes to it any more
+                self.retired[name] = self.retired.get(name, 0) + n
+        self.per_thread = alive
+
+    def inc(self, name: str, n: int = 1) -> None:
+        try:
+            counters = self.local.counters
+        except AttributeError:
+            counters = self._counters()
+        counters[name] = counters.get(name, 0) + n
+
+    def gauge(self, name: str, fn: Callable[[], Optional[float]]) -> None:
+        '''Export what `fn` returns as `name` when scraped, None to leave it out'''
+        self.gauges[name] = fn
+
+    def total(self, name: str, fn: Callable[[], int]) -> None:
+        '''Export what `fn` returns as the counter `name` when scraped, for a count that only goes up kept elsewhere'''
+        self.totals[name] = fn
+
+    def counters(self) -> dict[str, int]:
+        with self.lock:
+            self._prune()
+            totals = dict(self.retired)
+            per_thread = [counters for _, counters in self.per_thread]
+        for counters in per_thread:
+            for _ in range(3): # Another thread adding a counter as we read is rare, just read it again
+                try:
+                    items = list(counters.items())
+                    break
+                except RuntimeError:
+                    items = []
+            for name, n in items:
+                totals[name] = totals.get(name, 0) + n
+        for name, fn in list(self.totals.items()):
+            try:
+                totals[name] = totals.get(name, 0) + fn()
+            except Exception as e:
+                logging.debug("Total %s failed: %s", name, e)
+        return dict(sorted(totals.items()))
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        gauges = {"uptime_seconds": time.monotonic() - self.started}
+        for name, fn in list(self.gauges.items()):
+            try:
+                if (value := fn()) is not None:
+                    gauges[name] = value
+            except Exception as e:
+                logging.debug("Gauge %s failed: %s", name, e)
+        return {"counters": self.counters(), "gauges": dict(sorted(gauges.items()))}
+
+    def prometheus(self, prefix: str = "twitchplays_") -> str:
+        '''Snapshot in the Prometheus text format'''
+        snapshot = self.snapshot()
+        lines = []
+        for kind, values in (("counter", snapshot["counters"]), ("gauge", snapshot["gauges"])):
+            for name, value in values.items():
+                name = prefix + name + ("_total" if kind == "counter" else "")
+                lines += [f"# TYPE {name} {kind}", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves the registry over HTTP on localhost, /metrics for Prometheus and /metrics.json for anything else
+
+    Runs on its own thread, so a scrape never waits on or holds up the chat loop.
+    """
+    def __init__(self, registry: Registry, port: int = 9108, host: str = "127.0.0.1") -> None:
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                match self.path:
+                    case "/metrics":
+                        body, content_type = registry.prometheus().encode(), "text/plain; version=0.0.4"
+                    case "/metrics.json":
+                        body, content_type = json.dumps(registry.snapshot()).encode(), "application/json"
+                    case _:
+                        self.send_error(404)
+                        return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass # Every scrape would be logged otherwise
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name="MetricsServer", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        logging.info(f"Metrics at http://{self.server.server_address[0]}:{self.port}/metrics")
+        return self
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+def write_file(registry: Registry, filename: str) -> None:
+    '''Write the snapshot as JSON'''
+    with open(filename, "w") as f:
+        json.dump(registry.snapshot(), f, indent=2)
+
+async def write_forever(registry: Registry, filename: str, interval: float) -> None:
+    """Write the snapshot to a file every `interval` seconds, for running alongside the chat loop"""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(write_file, registry, filename)
+
+_default = Registry()
+
+def get_default() -> Registry:
+    return _default
+
+def set_default(registry: Registry) -> None:
+    global _default
+    _default = registry
+
+def inc(name: str, n: int = 1) -> None:
+    _default.inc(name, n)
+
+def gauge(name: str, fn: Callable[[], Optional[float]]) -> None:
+    _default.gauge(name, fn)
+
+def total(name: str, fn: Callable[[], int]) -> None:
+    _default.total(name, fn)
+
+def is_enabled(config: ConfigParser) -> bool:
+    return config.has_section("metrics") and config["metrics"].getboolean("Enabled", fallback=False)
+
+def make_server(config: ConfigParser) -> Optional[MetricsServer]:
+    """Make the metrics server set up in the config, not started
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        Optional[MetricsServer]: server, None if metrics are off, there is no port, or the section is missing
+    """
+    if not is_enabled(config):
+        return None
+    if not (port := config["metrics"].getint("Port", fallback=0)):
+        return None
+    try:
+        return MetricsServer(_default, port)
+    except OSError as e:
+        logging.warning(f"Could not serve metrics on port {port}: {e}")
+        return None
@@ -0,0 +1,262 @@
+import logging
+
+import functools, math, random, threading, time
+
+from configparser import ConfigParser
+from typing import Callable, Iterator, Optional
+
+Path = tuple[tuple[int, int], ...] # Relative moves, one per step
+Sink = tuple[Callable[[int, int], None], Callable[[], None]] # (move, flush) of the backend a motion goes to
+
+EASINGS: dict[str, Callable[[float], float]] = {
+    "linear":      lambda t: t,
+    "ease_in_out": lambda t: (1 - math.cos(math.pi * t)) / 2,
+    "ease_out":    lambda t: math.sin(math.pi * t / 2),
+}
+
+BEND_LEVELS = 4 # Random bends are rounded to this many levels either way so repeated moves still hit the path cache
+
+@functools.lru_cache(maxsize=1024)
+def plan_path(dx: int, dy: int, steps: int, easing: str = "ease_in_out", bend: float = 0.0) -> Path:
+    """Split a relative move into steps along an eased, optionally curved, path
+
+    Each step is the difference between consecutive points rounded to whole pixels, so the steps always add
+    up to exactly (dx, dy) however the move is split.  Cached, as chat tends to repeat the same few moves.
+
+    Args:
+        dx (int): pixels right
+        dy (int): pixels down
+        steps (int): number of moves to split it into, at least one
+        easing (str, optional): one of EASINGS, how progress along the path speeds up and slows down. Defaults to "ease_in_out".
+        bend (float, optional): how far the path arcs to one side at its middle, as a fraction of its length. Defaults to 0.0.
+
+    Returns:
+        Path: (dx, dy) of each step
+    """
+    if steps < 1:
+        raise ValueError("A path needs at least one step")
+    ease = EASINGS[easing]
+    px, py = -dy * bend, dx * bend # Perpendicular, scaled to the length of the move
+    path = []
+    last_x, last_y = 0, 0
+    for i in range(1, steps + 1):
+        t = i / steps
+        s, arc = ease(t), math.sin(math.pi * t)
+        x, y = (dx, dy) if i == steps else (round(dx * s + px * arc), round(dy * s + py * arc))
+        path.append((x - last_x, y - last_y))
+        last_x, last_y = x, y
+    return tuple(path)
+
+class _Motion:
+    __slots__ = ("steps", "sink", "done")
+
+    def __init__(self, path: Path, sink: Sink) -> None:
+        self.steps: Iterator[tuple[int, int]] = iter(path)
+        self.sink = sink
+        self.done = threading.Event()
+
+class MotionMixer:
+    """One mouse output loop at a fixed frame rate, summing every motion in progress into one move per frame
+
+    However many moves overlap, the mouse gets at most one call a frame, and as every motion's steps are whole
+    pixels that are only ever added together, none of the requested displacement is lost.  The loop runs on its
+    own thread, started with the first motion, and waits while there is nothing to play.
+    """
+    def __init__(self, rate: float = 100.0, clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep) -> None:
+        if rate <= 0:
+            raise ValueError("Rate must be more than zero")
+        self.interval  = 1 / rate
+        self.clock     = clock
+        self.sleep     = sleep
+        self.motions: list[_Motion] = []
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.closed    = False
+        self.n_frames  = 0 # Frames in which anything moved
+        self.n_moves   = 0 # Calls to move, at most one per sink per frame
+        self.n_late    = 0
+
+    def add(self, path: Path, move: Callable[[int, int], None], flush: Callable[[], None] = lambda: None) -> threading.Event:
+        """Start playing a path, one step a frame from the next frame
+
+        Args:
+            path (Path): steps planned at this mixer's rate
+            move (Callable[[int, int], None]): sends one relative move, motions with the same move are summed together
+            flush (Callable[[], None], optional): called after each frame's move. Defaults to doing nothing.
+
+        Returns:
+            threading.Event: set once the whole path has played, a frame after its last step
+        """
+        motion = _Motion(path, (move, flush))
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Motion mixer is closed")
+            self.motions.append(motion)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="MotionMixer", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return motion.done
+
+    def frame(self) -> None:
+        '''Take the next step of every motion and send their sum, letting go of motions that have finished'''
+        with self.condition:
+            motions = list(self.motions)
+        net: dict[Sink, list[int]] = {}
+        finished = []
+        for motion in motions:
+            if (step := next(motion.steps, None)) is None:
+                finished.append(motion)
+                continue
+            total = net.setdefault(motion.sink, [0, 0])
+            total[0] += step[0]
+            total[1] += step[1]
+        moved = False
+        for (move, flush), (dx, dy) in net.items():
+            if dx or dy:
+                try:
+                    move(dx, dy)
+                    flush()
+                except Exception:
+                    logging.exception("Failed to move the mouse by %d, %d", dx, dy)
+                self.n_moves += 1
+                moved = True
+        self.n_frames += moved
+        if finished:
+            with self.condition:
+                self.motions = [motion for motion in self.motions if motion not in finished]
+            for motion in finished:
+                motion.done.set()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self.condition:
+                    while not self.motions and not self.closed:
+                        self.condition.wait()
+                    if self.closed:
+                        return
+                deadline = self.clock()
+                while self.motions:
+                    self.frame()
+                    deadline += self.interval
+                    remaining = deadline - self.clock()
+                    if remaining > 0:
+                        self.sleep(remaining)
+                    elif -remaining > self.interval:
+                        self.n_late += 1
+                        deadline = self.clock() # Too far behind to catch up without bunching frames together
+        except Exception:
+            logging.exception("Motion mixer stopped")
+        finally:
+            with self.condition: # Nobody is left waiting on a motion, and the next one starts a new thread
+                for motion in self.motions:
+                    motion.done.set()
+                self.motions = []
+                self.thread = None
+
+    def close(self) -> None:
+        '''Stop the loop, motions still playing are dropped'''
+        with self.condition:
+            self.closed = True
+            for motion in self.motions:
+                motion.done.set()
+            self.motions = []
+            self.condition.notify()
+
+class MotionEngine:
+    """Plays mouse moves as precomputed paths on a fixed output rate
+
+    With `mix` on, every move goes through one `MotionMixer` so moves that overlap share its frames.
+    Otherwise every step has an absolute deadline from when the move started, rather than sleeping a fixed
+    time after each step, so time spent moving the mouse or oversleeping never adds up and a 0.5s move
+    really takes 0.5s.  Steps that are late go out straight away to catch up.
+    """
+    def __init__(self, rate: float = 100.0, easing: str = "ease_in_out", bend: float = 0.0, mix: bool = False,
+                 clock: Callable[[], float] = time.perf_counter, sleep: Callable[[float], None] = time.sleep) -> None:
+        if rate <= 0:
+            raise ValueError("Rate must be more than zero")
+        if easing not in EASINGS:
+            raise ValueError(f"Unknown easing {easing}, use one of {', '.join(EASINGS)}")
+        self.rate    = rate
+        self.easing  = easing
+        self.bend    = bend
+        self.clock   = clock
+        self.sleep   = sleep
+        self.n_late  = 0 # Steps that missed their deadline by more than a step
+        self.mixer   = MotionMixer(rate, clock, sleep) if mix else None
+
+    def plan(self, dx: int, dy: int, duration: float) -> Path:
+        '''Path for a move, with a random bend of up to `bend` either way'''
+        steps = max(1, round(duration * self.rate))
+        bend = round(random.uniform(-BEND_LEVELS, BEND_LEVELS)) * self.bend / BEND_LEVELS if self.bend else 0.0
+        return plan_path(dx, dy, steps, self.easing, bend)
+
+    def move(self, dx: int, dy: int, duration: float, move: Callable[[int, int], None], flush: Callable[[], None] = lambda: None) -> None:
+        """Move the mouse by (dx, dy) over `duration` seconds, returning once it has
+
+        Args:
+            dx (int): pixels right
+            dy (int): pixels down
+            duration (float): seconds the move takes
+            move (Callable[[int, int], None]): sends one relative move
+            flush (Callable[[], None], optional): called whenever the moves so far must go out. Defaults to doing nothing.
+        """
+        path = self.plan(dx, dy, duration)
+        if self.mixer:
+            self.mixer.add(path, move, flush).wait()
+        else:
+            self.play(path, duration, move, flush)
+
+    def play(self, path: Path, duration: float, move: Callable[[int, int], None], flush: Callable[[], None] = lambda: None) -> None:
+        """Send each step of a path on its deadline, on this thread, then wait out the rest of the duration
+
+        Args:
+            path (Path): steps from `plan`
+            duration (float): seconds the whole move takes, the steps are spread evenly over it with the first going out now
+            move (Callable[[int, int], None]): sends one relative move
+            flush (Callable[[], None], optional): called before every wait, so nothing is held back past its deadline. Defaults to doing nothing.
+        """
+        start = self.clock()
+        interval = duration / len(path)
+        for i, (dx, dy) in enumerate(path):
+            self._wait_until(start + i * interval, interval, flush)
+            if dx or dy:
+                move(dx, dy)
+        self._wait_until(start + duration, interval, flush)
+
+    def _wait_until(self, deadline: float, interval: float, flush: Callable[[], None]) -> None:
+        remaining = deadline - self.clock()
+        if remaining > 0:
+            flush()
+            self.sleep(remaining)
+        elif -remaining > interval:
+            self.n_late += 1
+
+    def close(self) -> None:
+        if self.mixer:
+            self.mixer.close()
+
+_default = MotionEngine()
+
+def get_default() -> MotionEngine:
+    return _default
+
+def set_default(engine: MotionEngine) -> None:
+    global _default
+    _default = engine
+
+def make_engine(config: ConfigParser) -> MotionEngine:
+    """Make the motion engine set up in the config, with the defaults if the settings are missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        MotionEngine: engine to pass to `set_default`
+    """
+    section = config["outputs"] if config.has_section("outputs") else {}
+    engine = MotionEngine(float(section.get("MouseRate", 100)), section.get("MouseEasing", "ease_in_out").lower(),
+                          float(section.get("MouseBend", 0)), section.get("MouseMixing", "yes").lower() in ("yes", "on", "true", "1"))
+    logging.debug(f"Mouse moves at {engine.rate:.0f} steps/s, {engine.easing}, bend up to {engine.bend:.0%}, {'mixed' if engine.mixer else 'each on its own'}")
+    return engine
@@ -1,39 +1,252 @@
 import logging
-import random, math
+import json, random, threading, time
 
-from time import sleep
-from threading import Thread
-from typing import Union
+from concurrent.futures import Future
+from configparser import ConfigParser
+from dataclasses import dataclass
+from enum import Enum, unique
+from typing import Callable, Hashable, Optional
 
-from pynput.keyboard import Key
-from pynput.keyboard import Controller as Keyboard
+import holds
+import latency
+import motion
+import timers
 
-from pynput.mouse._win32 import Button
-from pynput.mouse._win32 import Controller as Mouse
+@unique
+class OutputEventType(Enum):
+    KEY_PRESS     = "key_press"
+    KEY_RELEASE   = "key_release"
+    MOUSE_PRESS   = "mouse_press"
+    MOUSE_RELEASE = "mouse_release"
+    MOUSE_MOVE    = "mouse_move"
 
-keyboard = Keyboard()
-mouse    = Mouse()
+@dataclass(frozen=True, slots=True)
+class OutputEvent:
+    type: OutputEventType
+    args: tuple # (key,), (button,) e.g. ("left",), or (dx, dy)
 
-def str_to_button(button: str) -> Button:
-    match button:
-        case "left":
-            return Button.left
-        case "middle":
-            return Button.middle
-        case "right":
-            return Button.right
+class OutputBackend:
+    """Where the key presses and mouse events from the routines below go
+
+    Subclasses implement `send`, and `flush` if they hold events back.  The routines flush after every press,
+    release or step of a move, so nothing is held back past the point it was meant to happen.
+    """
+    def press(self, key: str) -> None:
+        self.send([OutputEvent(OutputEventType.KEY_PRESS, (key,))])
+
+    def release(self, key: str) -> None:
+        self.send([OutputEvent(OutputEventType.KEY_RELEASE, (key,))])
+
+    def mouse_press(self, button: str) -> None:
+        self.send([OutputEvent(OutputEventType.MOUSE_PRESS, (button,))])
+
+    def mouse_release(self, button: str) -> None:
+        self.send([OutputEvent(OutputEventType.MOUSE_RELEASE, (button,))])
+
+    def mouse_move(self, dx: int, dy: int) -> None:
+        self.send([OutputEvent(OutputEventType.MOUSE_MOVE, (dx, dy))])
+
+    def send(self, events: list[OutputEvent]) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class PynputBackend(OutputBackend):
+    '''The real keyboard and mouse, pynput is only imported when this is made so everything else runs headless'''
+    def __init__(self) -> None:
+        from pynput.keyboard import Controller as Keyboard
+        from pynput.mouse import Button, Controller as Mouse
+        self.keyboard = Keyboard()
+        self.mouse    = Mouse()
+        self.buttons  = {"left": Button.left, "middle": Button.middle, "right": Button.right}
+
+    def str_to_button(self, button: str):
+        try:
+            return self.buttons[button]
+        except KeyError:
+            raise KeyError(f"Unknown mouse button {button}")
+
+    def send(self, events: list[OutputEvent]) -> None:
+        for event in events:
+            match event.type:
+                case OutputEventType.KEY_PRESS:
+                    self.keyboard.press(*event.args)
+                case OutputEventType.KEY_RELEASE:
+                    self.keyboard.release(*event.args)
+                case OutputEventType.MOUSE_PRESS:
+                    self.mouse.press(self.str_to_button(*event.args))
+                case OutputEventType.MOUSE_RELEASE:
+                    self.mouse.release(self.str_to_button(*event.args))
+                case OutputEventType.MOUSE_MOVE:
+                    self.mouse.move(*event.args)
+
+class NullBackend(OutputBackend):
+    '''Counts events and does nothing else, for throughput testing'''
+    def __init__(self) -> None:
+        self.n_events = 0
+
+    def send(self, events: list[OutputEvent]) -> None:
+        self.n_events += len(events)
+
+class RecordingBackend(OutputBackend):
+    """Keeps every event with the time it was sent, and writes them to a file as JSON lines if given one
+
+    For asserting on what chat would have done without touching the keyboard or mouse.
+    """
+    def __init__(self, filename: str = None, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock  = clock
+        self.events: list[tuple[float, OutputEvent]] = []
+        self.file   = open(filename, "w") if filename else None
+        self.lock   = threading.Lock() # Actions run on several executor workers
+
+    def send(self, events: list[OutputEvent]) -> None:
+        t = self.clock()
+        with self.lock:
+            for event in events:
+                self.events.append((t, event))
+                if self.file:
+                    self.file.write(json.dumps({"t": t, "type": event.type.value, "args": event.args}) + "\n")
+
+    def close(self) -> None:
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class BatchingBackend(OutputBackend):
+    """Holds events back and hands them to another backend several at a time
+
+    Events go on in one `send` call when `max_batch` have built up or at the next flush, which the routines
+    do after every press, release or step of a move.  A flush always sends, so timing is no worse than sending one event per call.
+    """
+    def __init__(self, backend: OutputBackend, max_batch: int = 32) -> None:
+        self.backend   = backend
+        self.max_batch = max_batch
+        self.pending: list[OutputEvent] = []
+        self.n_batches = 0
+        self.lock      = threading.Lock()
+
+    def send(self, events: list[OutputEvent]) -> None:
+        with self.lock:
+            self.pending.extend(events)
+            full = len(self.pending) >= self.max_batch
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        with self.lock:
+            batch, self.pending = self.pending, []
+        if batch:
+            self.n_batches += 1
+            self.backend.send(batch)
+
+    def close(self) -> None:
+        self.flush()
+        self.backend.close()
+
+class DeferredBackend(OutputBackend):
+    """Stands in for a backend still being made in the background, e.g. while pynput loads during the IRC connect
+
+    The first event waits for it, after that events go straight through.
+    """
+    def __init__(self, future: "Future[OutputBackend]") -> None:
+        self.future = future
+        self.backend: Optional[OutputBackend] = None
+
+    def _resolve(self) -> OutputBackend:
+        if self.backend is None:
+            self.backend = self.future.result()
+        return self.backend
+
+    def send(self, events: list[OutputEvent]) -> None:
+        self._resolve().send(events)
+
+    def flush(self) -> None:
+        self._resolve().flush()
+
+    def close(self) -> None:
+        self._resolve().close()
+
+_default: Optional[OutputBackend] = None
+
+def get_default() -> OutputBackend:
+    """Backend the routines below send to, the real keyboard and mouse unless `set_default` was called"""
+    global _default
+    if _default is None:
+        _default = PynputBackend()
+    return _default
+
+def set_default(backend: OutputBackend) -> None:
+    global _default
+    _default = backend
+
+def make_backend(config: ConfigParser) -> OutputBackend:
+    """Make the output backend chosen in the config, defaulting to the real keyboard and mouse if the section is missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        OutputBackend: backend to pass to `set_default`
+    """
+    section = config["outputs"] if config.has_section("outputs") else {}
+    match section.get("Backend", "pynput").lower():
+        case "null":
+            backend = NullBackend()
+        case "recording":
+            backend = RecordingBackend(section.get("RecordingFile", "outputs.jsonl"))
         case _:
-            raise KeyError
+            backend = PynputBackend()
+    if section.get("Batch", "no").lower() in ("yes", "on", "true", "1"):
+        backend = BatchingBackend(backend, int(section.get("BatchSize", 32)))
+    logging.info(f"Outputs go to {type(backend).__name__}")
+    return backend
+
+def hold_repeatedly(key: Hashable, hold_for: float, gap: float, repeats: int, press: Callable[[], None], release: Callable[[], None],
+                    flush: Callable[[], None], message: str, *args) -> None:
+    """Hold a key `repeats` times with a gap between, timed on the timer wheel so no thread waits in between
+
+    Args:
+        key (Hashable): what to hold, as in `holds.KeyHolder.hold`
+        hold_for (float): seconds to hold it each time
+        gap (float): seconds between letting go and pressing it again
+        repeats (int): how many times
+        press (Callable[[], None]): presses it
+        release (Callable[[], None]): lets go of it
+        flush (Callable[[], None]): sends anything the backend held back
+        message (str): logged each time it is pressed, formatted with `args` only if it is logged
+    """
+    holder, wheel = holds.get_default(), timers.get_default()
+
+    def press_again(remaining: int) -> None:
+        logging.info(message, *args)
+        latency.mark_output()
+        if remaining <= 1:
+            then = None
+        elif gap > 0:
+            then = lambda: wheel.call_later(gap, lambda: press_again(remaining - 1))
+        else:
+            then = lambda: press_again(remaining - 1)
+        holder.hold(key, hold_for, press, release, flush, on_release=then)
+
+    if repeats > 0:
+        press_again(repeats)
 
 class KeyboardOutputs:
     @staticmethod
     def press_release_routine(key: str, duration: float, repeats: int) -> None:
-        for _ in range(repeats):
-            logging.info(f"Press keyboard {key} then wait {duration:.2f}s") # TODO tidy n repeats
-            keyboard.press(key)
-            sleep(duration / 2)
-            keyboard.release(key)
-            sleep(duration / 2)
+        backend = get_default()
+        hold_repeatedly(("keyboard", key), duration / 2, duration / 2, repeats, lambda: backend.press(key), lambda: backend.release(key),
+                        backend.flush, "Press keyboard %s then wait %.2fs", key, duration) # TODO tidy n repeats
 
     # @staticmethod
     # def press_key_for(key: str, seconds: float = None) -> None:
@@ -68,11 +281,9 @@ class MouseOutputs:
     @staticmethod
     def press_release_routine(button: list[str], duration: float = 0.01, repeats: int = 1) -> None:
         if 1 == len(button):
-            for _ in range(repeats):
-                logging.info(f"Press mouse {button[0]} for {duration:.2f}s")
-                mouse.press(str_to_button(button[0]))
-                sleep(duration)
-                mouse.release(str_to_button(button[0]))
+            backend = get_default()
+            hold_repeatedly(("mouse", button[0]), duration, 0, repeats, lambda: backend.mouse_press(button[0]),
+                            lambda: backend.mouse_release(button[0]), backend.flush, "Press mouse %s for %.2fs", button[0], duration)
         else:
             coords = (int(button[1]), int(button[2])) # TODO sanitise cast
             MouseOutputs.move_routine(coords, duration)
@@ -83,21 +294,21 @@ class MouseOutputs:
         if x:
             x = random.randint(x//2 - abs(x//2), x + abs(x//2))
         if y:
-            y = random.randint(y//2 - abs(x//2), y + abs(y//2))
-
-        print(f"{x=} {y=}")
+            y = random.randint(y//2 - abs(y//2), y + abs(y//2))
 
-        steps = max(abs(x/100), abs(y/100))
-        timestep = duration / steps
-        logging.info(f"Move mouse by x={x}, y={y} in {duration}s ({steps} steps {timestep}s apart)")
-        for _ in range(int(steps)):
-            mouse.move(int(x / steps), int(y / steps))
-            sleep(timestep)
+        logging.info("Move mouse by x=%d, y=%d in %ss", x, y, duration)
+        backend = get_default()
+        latency.mark_output()
+        motion.get_default().move(x, y, duration, backend.mouse_move, backend.flush)
+        backend.flush()
 
     @staticmethod
     def move(x: int, y: int) -> None:
-        logging.info(f"Move mouse by x={x}, y={y}")
-        mouse.move(x, y)
+        logging.info("Move mouse by x=%d, y=%d", x, y)
+        latency.mark_output()
+        backend = get_default()
+        backend.mouse_move(x, y)
+        backend.flush()
 
     # @staticmethod
     # def _release_later(button: str, seconds: float = None) -> None:
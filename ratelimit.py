@@ -0,0 +1,97 @@
+import logging
+
+import time
+
+from collections import OrderedDict
+from configparser import ConfigParser
+from typing import Callable, Hashable, Optional
+
+from keymap import Command
+
+class UserRateLimiter:
+    """Token bucket per chatter, so one fast typist or bot cannot take over the game
+
+    Every chatter has a bucket of up to `burst` commands, refilled at `rate` commands a second.  A command
+    with its own `user_rate` (the "ur" tag) also has a bucket per chatter for just that command, holding a
+    single token so e.g. ur:0.2 really is once every 5s, and a command only goes through if every bucket it
+    needs has a token.
+
+    Buckets live in one LRU ordered dict, so memory is fixed at `max_users` buckets however big the chat, and
+    buckets idle for `idle_seconds` are let go; by then they would have refilled anyway.  Each message is a
+    couple of dict operations, and eviction only ever looks at the least recently used end.
+    """
+    def __init__(self, rate: float = 1.0, burst: float = 5.0, max_users: int = 50000, idle_seconds: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        if burst < 1 or max_users < 1:
+            raise ValueError("Need a burst of at least one command and room for at least one user")
+        self.rate         = rate # 0 for no limit across commands, only per command ones
+        self.burst        = burst
+        self.max_users    = max_users
+        self.idle_seconds = idle_seconds
+        self.clock        = clock
+        self.buckets: OrderedDict[Hashable, list[float]] = OrderedDict() # key -> [tokens, last refilled], least recently used first
+        self.allowed      = 0
+        self.dropped      = 0
+        self.evicted      = 0
+
+    def _refill(self, key: Hashable, rate: float, capacity: float, now: float) -> list[float]:
+        if (bucket := self.buckets.get(key)) is None:
+            bucket = self.buckets[key] = [capacity, now]
+        else:
+            self.buckets.move_to_end(key)
+            bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        return bucket
+
+    def _evict(self, now: float) -> None:
+        while self.buckets:
+            _, (_, last) = next(iter(self.buckets.items()))
+            if len(self.buckets) <= self.max_users and now - last < self.idle_seconds:
+                break
+            self.buckets.popitem(last=False)
+            self.evicted += 1
+
+    def allow(self, username: str, command: Optional[Command] = None) -> bool:
+        """Take a token for a chatter running a command, if they have one
+
+        Args:
+            username (str): chatter
+            command (Optional[Command], optional): what they are running, for its own per chatter rate. Defaults to None.
+
+        Returns:
+            bool: true if it may run, false if rate limited
+        """
+        now = self.clock()
+        buckets = []
+        if self.rate > 0:
+            buckets.append(self._refill(username, self.rate, self.burst, now))
+        if command is not None and command.user_rate:
+            buckets.append(self._refill((username, id(command)), command.user_rate, 1, now))
+        self._evict(now)
+        if all(bucket[0] >= 1 for bucket in buckets):
+            for bucket in buckets:
+                bucket[0] -= 1
+            self.allowed += 1
+            return True
+        self.dropped += 1
+        return False
+
+    def stats(self) -> dict[str, int]:
+        return {"allowed": self.allowed, "dropped": self.dropped, "evicted": self.evicted, "buckets": len(self.buckets)}
+
+def make_limiter(config: ConfigParser) -> Optional[UserRateLimiter]:
+    """Make the per chatter rate limiter set up in the config
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        Optional[UserRateLimiter]: limiter, None if turned off or the section is missing
+    """
+    if not config.has_section("ratelimit") or not config["ratelimit"].getboolean("Enabled", fallback=False):
+        return None
+    section = config["ratelimit"]
+    limiter = UserRateLimiter(section.getfloat("UserRate", fallback=1.0), section.getfloat("UserBurst", fallback=5.0),
+                              section.getint("MaxUsers", fallback=50000), section.getfloat("IdleSeconds", fallback=300.0))
+    logging.info(f"Rate limiting each chatter to {limiter.rate:g} commands/s, bursts of {limiter.burst:g}")
+    return limiter
@@ -0,0 +1,182 @@
+"""Record raw Twitch IRC traffic and replay it offline
+
+Record by setting CaptureFile in the twitch.tv section of config.ini, then replay with e.g.
+    python replay.py logs/capture.bin --speed 10
+"""
+import logging
+
+import argparse, struct, time
+
+from dataclasses import dataclass
+from typing import Callable, Iterator, Optional
+
+import default_config
+import dispatch
+import executor
+import keymap
+import main
+import outputs
+from twitch import BufferedSocket, IrcConnection, MessageStore, TwitchMessageEnum
+
+CAPTURE_MAGIC  = b"TPCAP1\n"
+CAPTURE_RECORD = struct.Struct("<dI") # Seconds since the capture started, number of bytes that follow
+
+class CaptureWriter:
+    '''Appends timestamped chunks of raw received bytes to a capture file'''
+    def __init__(self, filename: str, clock: Callable[[], float] = time.monotonic) -> None:
+        self.file  = open(filename, "wb")
+        self.clock = clock
+        self.start = clock()
+        self.file.write(CAPTURE_MAGIC)
+
+    def write(self, data: bytes) -> None:
+        """Record one chunk exactly as it came off the socket, pass this as the connection's `tee`"""
+        self.file.write(CAPTURE_RECORD.pack(self.clock() - self.start, len(data)))
+        self.file.write(data)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def read_capture(filename: str) -> Iterator[tuple[float, bytes]]:
+    """Read back a capture file
+
+    Args:
+        filename (str): file written by CaptureWriter
+
+    Yields:
+        Iterator[tuple[float, bytes]]: seconds since the capture started and the chunk received then
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{filename} is not a capture file")
+        while (header := f.read(CAPTURE_RECORD.size)):
+            timestamp, length = CAPTURE_RECORD.unpack(header)
+            yield (timestamp, f.read(length))
+
+class ReplayConnection:
+    """Stands in for `twitch.TwitchConnection`, serving a capture instead of a socket
+
+    Chunks are served at their recorded times scaled by `speed`, or as fast as possible if `speed` is None.
+    Like a socket read timing out, every chunk is followed by a None so each `BufferedSocket.receive` gets one chunk.
+    """
+    def __init__(self, chunks: Iterator[tuple[float, bytes]], speed: Optional[float] = 1.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self.chunks   = iter(chunks)
+        self.speed    = speed
+        self.clock    = clock
+        self.start    = None
+        self.pending  = b""
+        self.paused   = False
+        self.finished = False
+        self.sent: list[bytes] = []
+
+    def connect(self) -> bool:
+        self.start = self.clock()
+        return True
+
+    def receive_into(self, buffer: memoryview) -> Optional[int]:
+        if self.paused:
+            self.paused = False
+            return None
+        if not self.pending:
+            try:
+                timestamp, self.pending = next(self.chunks)
+            except StopIteration:
+                self.finished = True
+                return None
+            if self.speed:
+                delay = self.start + timestamp / self.speed - self.clock()
+                if delay > 0:
+                    time.sleep(delay)
+        n = min(len(buffer), len(self.pending))
+        buffer[:n] = self.pending[:n]
+        self.pending = self.pending[n:]
+        self.paused = not self.pending
+        return n
+
+    def send(self, data: bytes) -> None:
+        self.sent.append(data)
+
+    def disconnect(self) -> None:
+        pass
+
+@dataclass(slots=True)
+class ReplayStats:
+    n_bytes:    int   = 0
+    n_messages: int   = 0
+    n_chat:     int   = 0
+    n_matched:  int   = 0
+    n_output_events: int = 0
+    elapsed:    float = 0.0
+
+    def messages_per_second(self) -> float:
+        return self.n_messages / self.elapsed if self.elapsed else 0.0
+
+def replay(filename: str, matcher: keymap.KeymapTrie, dev_users: frozenset[str] = frozenset(), speed: Optional[float] = 1.0,
+           dispatcher: dispatch.Dispatcher = None, on_match: Callable[[keymap.Command], None] = None) -> ReplayStats:
+    """Feed a capture through BufferedSocket, IrcConnection, `main.message_filter` and the dispatcher, with outputs going nowhere
+
+    Matched commands run as they would live, on an executor, but send to an `outputs.NullBackend` which only counts them.
+
+    Args:
+        filename (str): capture file
+        matcher (keymap.KeymapTrie): compiled keymap
+        dev_users (frozenset[str], optional): lower case dev usernames. Defaults to frozenset().
+        speed (Optional[float], optional): 1 for real time, N for N times faster, None for as fast as possible. Defaults to 1.0.
+        dispatcher (dispatch.Dispatcher, optional): what to do with matched commands. Defaults to None which runs them straight away.
+        on_match (Callable[[keymap.Command], None], optional): called with each matched command before it is dispatched. Defaults to None.
+
+    Returns:
+        ReplayStats: what went through the pipeline and how long it took
+    """
+    chunks = list(read_capture(filename))
+    stats = ReplayStats(n_bytes=sum(len(chunk) for _, chunk in chunks))
+    connection = ReplayConnection(chunks, speed)
+    irc = IrcConnection(incomingSocket=BufferedSocket(connection=connection), store=MessageStore())
+    dispatcher = dispatcher if dispatcher else dispatch.AnarchyDispatcher()
+    backend = outputs.NullBackend()
+    outputs.set_default(backend)
+
+    start = time.perf_counter()
+    try:
+        with executor.LaneExecutor() as pool:
+            executor.set_default(pool)
+            while not connection.finished or len(irc.store):
+                stats.n_messages += irc.poll()
+                irc.remove_all(TwitchMessageEnum.PING) # Replies would go nowhere
+                for msg in irc.get(TwitchMessageEnum.PRIVMSG):
+                    stats.n_chat += 1
+                    if (command := main.message_filter((msg.username, msg.payload_as_tuple()[1]), matcher, dev_users)):
+                        stats.n_matched += 1
+                        if on_match:
+                            on_match(command)
+                        dispatcher.submit(command, received_at=msg.received_at)
+                irc.remove_all()
+                dispatcher.tick()
+    finally:
+        executor.set_default(None)
+        outputs.set_default(None)
+    stats.elapsed = time.perf_counter() - start
+    stats.n_output_events = backend.n_events
+    return stats
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Replay a capture of Twitch IRC traffic through the parser and keymap")
+    argparser.add_argument("capture", help="capture file recorded with CaptureFile in config.ini")
+    argparser.add_argument("--speed", type=float, default=1.0, help="1 for real time, N for N times faster, 0 for as fast as possible")
+    argparser.add_argument("--config", default="config.ini", help="config file to take the keymap from")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config = default_config.get_from_file(args.config)
+    dev_users = frozenset(user.lower() for user in keymap.split_csv(config['dev.users']['users']))
+    commands = keymap.make_keymap_entry(config)
+    stats = replay(args.capture, keymap.KeymapTrie(commands), dev_users, args.speed or None, dispatch.make_dispatcher(config, commands))
+    print(f"{stats.n_bytes} bytes, {stats.n_messages} messages, {stats.n_chat} chat, {stats.n_matched} matched,"
+          f" {stats.n_output_events} output events in {stats.elapsed:.3f}s"
+          f" ({stats.messages_per_second():.0f} messages/s)")
@@ -0,0 +1,69 @@
+"""Run the benchmark suite and write the results as JSON, to compare between commits
+
+    python run_benchmarks.py --output before.json
+    git checkout my-branch
+    python run_benchmarks.py --output after.json --compare before.json
+"""
+import logging
+
+import argparse, datetime, json, platform, subprocess, sys
+
+from benchmarks import bench_end_to_end, bench_keymap, bench_parser
+
+SUITES = {
+    "parser":     lambda quick: bench_parser.run(200 if quick else 2000),
+    "keymap":     lambda quick: bench_keymap.run(bench_keymap.SIZES[:3] if quick else bench_keymap.SIZES),
+    "end_to_end": lambda quick: bench_end_to_end.run(quick),
+}
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    '''{"a": {"b": 1}} to {"a.b": 1}, numbers only'''
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat |= flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+def compare(old: dict, new: dict) -> None:
+    '''Print every timing (names ending _us or _s) in both runs with the ratio new/old, above 1 is slower'''
+    old, new = flatten(old["results"]), flatten(new["results"])
+    for name in new:
+        if name in old and name.endswith(("_us", "_s")) and old[name]:
+            print(f"{name:70} {old[name]:14.2f} {new[name]:14.2f} {new[name] / old[name]:8.2f}x")
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser(description="Run the benchmark suite and write the results as JSON")
+    argparser.add_argument("--output", default="-", help="JSON file to write, - for stdout")
+    argparser.add_argument("--only", nargs="*", choices=SUITES, default=list(SUITES), help="suites to run")
+    argparser.add_argument("--quick", action="store_true", help="fewer, shorter runs for a quick look")
+    argparser.add_argument("--compare", default=None, help="earlier JSON output to compare against")
+    args = argparser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR) # Overload warnings are expected, the drop counts are in the results
+    report = {
+        "commit":    git_commit(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python":    platform.python_version(),
+        "platform":  platform.platform(),
+        "quick":     args.quick,
+        "results":   {name: SUITES[name](args.quick) for name in args.only},
+    }
+
+    if args.output == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
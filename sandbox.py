@@ -1,5 +1,4 @@
 from time import sleep, time
-from tkinter import W
 from typing import Any, Optional, Callable
 import multiprocessing as mp
 import concurrent.futures
@@ -7,7 +6,6 @@ from threading import Thread
 from dataclasses import dataclass, field
 import random
 
-from pyparsing import Forward
 @dataclass
 class Command:
     keys: list[str]
@@ -0,0 +1,117 @@
+import re
+
+from configparser import ConfigParser
+from typing import Callable, Hashable, Optional
+
+import latency
+import metrics
+from twitch import TwitchIrc, TwitchMessageEnum
+
+_WHITESPACE = re.compile(r"\s+")
+_COLLAPSED  = {"user": "messages_collapsed_user", "text": "messages_collapsed_text"}
+_INVISIBLE  = str.maketrans("", "", "\U000e0000​‌‍⁠﻿") # Chat clients append these to get round Twitch's own duplicate check
+
+def normalize(text: str) -> str:
+    '''Lower case, without invisible characters and with runs of whitespace as one space'''
+    return _WHITESPACE.sub(" ", text.translate(_INVISIBLE)).strip().lower()
+
+class TimeBuckets:
+    """Hash set of what has been seen in roughly the last `window` seconds, in fixed memory
+
+    Keys go in the current bucket, and when it is `window` old it becomes the previous bucket and the one
+    before that is dropped whole, so a key is remembered for between one and two windows.  A bucket that
+    fills up to `max_keys` is rotated early, which only ever makes things be forgotten sooner.
+    """
+    def __init__(self, window: float, max_keys: int = 100000) -> None:
+        self.window   = window
+        self.max_keys = max_keys
+        self.current: dict[Hashable, TwitchIrc.Message] = {}
+        self.previous: dict[Hashable, TwitchIrc.Message] = {}
+        self.started  = float("-inf")
+
+    def _rotate(self, now: float) -> None:
+        self.previous = self.current if now - self.started < 2 * self.window else {}
+        self.current = {}
+        self.started = now
+
+    def get_or_add(self, key: Hashable, msg: TwitchIrc.Message, now: float) -> Optional[TwitchIrc.Message]:
+        """The message already seen for a key, or None having remembered this one for it"""
+        if now - self.started >= self.window or len(self.current) >= self.max_keys:
+            self._rotate(now)
+        if (first := self.current.get(key)) is not None or (first := self.previous.get(key)) is not None:
+            return first
+        self.current[key] = msg
+        return None
+
+    def replace(self, key: Hashable, msg: TwitchIrc.Message) -> None:
+        '''Remember this message for a key in place of the one already seen'''
+        self.current[key] = msg
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous)
+
+class SpamCollapser:
+    """Collapses repeated chat lines straight after parsing, so a burst is filtered and dispatched once
+
+    A chatter repeating the same line within `user_window` seconds is dropped as spam.  Anyone else repeating
+    a line seen within `text_window` seconds is folded into the copy still waiting to be read, as one more
+    in its `repeats`, so downstream gets one message with a multiplicity rather than N copies, e.g. N votes
+    in democracy mode.  The first copy always goes straight through, so nothing waits for the window to
+    close, and once it has been taken with `take_repeats` the next copy goes on as a new message carrying
+    any more.  Both are counted, in `collapsed` and as metrics counters.  A window of 0 turns that check off.
+    """
+    def __init__(self, user_window: float = 1.0, text_window: float = 0.25, max_keys: int = 100000,
+                 clock: Callable[[], float] = latency.now) -> None:
+        self.by_user   = TimeBuckets(user_window, max_keys) if user_window > 0 else None
+        self.by_text   = TimeBuckets(text_window, max_keys) if text_window > 0 else None
+        self.clock     = clock
+        self.collapsed = {"user": 0, "text": 0}
+
+    def collapse(self, msg: TwitchIrc.Message) -> bool:
+        """Check a message against those seen recently
+
+        Args:
+            msg (TwitchIrc.Message): freshly parsed message
+
+        Returns:
+            bool: true if it repeats one seen recently, and so has been dropped or folded into it and should go no further
+        """
+        if msg.id != TwitchMessageEnum.PRIVMSG:
+            return False
+        channel, text = msg.payload_as_tuple()
+        text = normalize(text)
+        now = msg.received_at if msg.received_at is not None else self.clock()
+        if self.by_user is not None and self.by_user.get_or_add((channel, msg.username, text), msg, now) is not None:
+            self._count("user")
+            return True
+        if self.by_text is not None and (first := self.by_text.get_or_add((channel, text), msg, now)) is not None:
+            if not first.repeats: # Already read, so this one carries the copies from here on
+                self.by_text.replace((channel, text), msg)
+                return False
+            first.repeats += 1
+            self._count("text")
+            return True
+        return False
+
+    def _count(self, kind: str) -> None:
+        self.collapsed[kind] += 1
+        metrics.inc(_COLLAPSED[kind])
+
+    def stats(self) -> dict[str, int]:
+        return {"collapsed_user": self.collapsed["user"], "collapsed_text": self.collapsed["text"],
+                "keys": (len(self.by_user) if self.by_user else 0) + (len(self.by_text) if self.by_text else 0)}
+
+def make_collapser(config: ConfigParser) -> Optional[SpamCollapser]:
+    """Make the spam collapser set up in the config
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        Optional[SpamCollapser]: collapser, None if turned off or the section is missing
+    """
+    if not config.has_section("spam") or not config["spam"].getboolean("Enabled", fallback=False):
+        return None
+    section = config["spam"]
+    return SpamCollapser(section.getfloat("UserWindowSeconds", fallback=1.0), section.getfloat("TextWindowSeconds", fallback=0.25),
+                         section.getint("MaxKeys", fallback=100000))
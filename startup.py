@@ -0,0 +1,44 @@
+import logging
+
+import time
+
+from typing import Callable
+
+class StartupTimer:
+    """Time each phase of startup, from launch until the first chat command has been processed
+
+    Phases are marked as they end, each one lasting from the end of the one before.
+    """
+    def __init__(self, start: float = None, clock: Callable[[], float] = time.perf_counter) -> None:
+        self.clock  = clock
+        self.start  = start if start is not None else clock()
+        self.last   = self.start
+        self.phases: list[tuple[str, float]] = []
+
+    def mark(self, phase: str, at: float = None) -> float:
+        """End a phase
+
+        Args:
+            phase (str): name of the phase just finished
+            at (float, optional): when it finished, from the same clock. Defaults to None which is now.
+
+        Returns:
+            float: how long the phase took in seconds
+        """
+        at = self.clock() if at is None else at
+        seconds = max(0.0, at - self.last)
+        self.phases.append((phase, seconds))
+        self.last = max(self.last, at)
+        return seconds
+
+    def elapsed(self) -> float:
+        '''Seconds since launch, up to the last phase'''
+        return self.last - self.start
+
+    def report(self, level: int = logging.INFO) -> str:
+        '''Log every phase so far and the total'''
+        lines = [f"Startup {phase:14} {seconds * 1000:8.1f}ms" for phase, seconds in self.phases]
+        lines.append(f"Startup {'total':14} {self.elapsed() * 1000:8.1f}ms")
+        for line in lines:
+            logging.log(level, line)
+        return "\n".join(lines)
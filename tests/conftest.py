@@ -0,0 +1,16 @@
+import pytest
+
+class FakeClock:
+    '''Stands in for time.monotonic, only moving when a test sets `t` or sleeps'''
+    def __init__(self) -> None:
+        self.t = 0.0
+
+    def __call__(self) -> float:
+        return self.t
+
+    def sleep(self, seconds: float) -> None:
+        self.t += seconds
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
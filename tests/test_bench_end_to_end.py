@@ -0,0 +1,11 @@
+import threading
+
+from benchmarks import bench_end_to_end
+
+def test_chat_loop_ends_with_the_server() -> None:
+    results = {}
+    thread = threading.Thread(target=lambda: results.update(bench_end_to_end.run_throughput(200, 10)), daemon=True)
+    thread.start()
+    thread.join(30)
+    assert not thread.is_alive(), "The chat loop should end once the local server stops, not reconnect forever"
+    assert results["n_messages"] == 200, "Every message sent should be read before the loop ends"
@@ -0,0 +1,72 @@
+import dispatch
+import pytest
+
+class FakeCommand:
+    def __init__(self, name: str) -> None:
+        self.keys = [name]
+        self.n_runs = 0
+
+    def run(self) -> bool:
+        self.n_runs += 1
+        return True
+
+@pytest.fixture
+def commands() -> list[FakeCommand]:
+    return [FakeCommand("forward"), FakeCommand("back"), FakeCommand("left")]
+
+def test_fixed_window_runs_winner(commands: list[FakeCommand]) -> None:
+    forward, back, left = commands
+    d = dispatch.DemocracyDispatcher(window=1.0, clock=lambda: 0.0)
+
+    for command in [back, forward, forward, left, forward, back]:
+        d.submit(command)
+    assert d.tick(0.5) == [], "Window closed early"
+    assert d.tick(1.0) == [forward], "Wrong winner"
+    assert (forward.n_runs, back.n_runs, left.n_runs) == (1, 0, 0), "Only the winner should run"
+
+    assert d.tick(2.0) == [], "Votes leaked into the next fixed window"
+
+def test_tie_breaks(commands: list[FakeCommand]) -> None:
+    forward, back, left = commands
+    for tie_break, expected in [(dispatch.TieBreak.FIRST, back), (dispatch.TieBreak.KEYMAP, forward)]:
+        d = dispatch.DemocracyDispatcher(window=1.0, tie_break=tie_break, keymap=commands, clock=lambda: 0.0)
+        for command in [back, forward, left]:
+            d.submit(command)
+        assert d.tick(1.0) == [expected], f"Tie break {tie_break} chose wrongly"
+
+def test_top_n(commands: list[FakeCommand]) -> None:
+    forward, back, left = commands
+    d = dispatch.DemocracyDispatcher(window=1.0, n_winners=2, clock=lambda: 0.0)
+    for command in [left, forward, back, back, left, back]:
+        d.submit(command)
+    assert d.tick(1.0) == [back, left], "Wrong top 2"
+
+def test_sliding_window_expires_old_votes(commands: list[FakeCommand]) -> None:
+    forward, back, _ = commands
+    d = dispatch.DemocracyDispatcher(window=1.0, n_buckets=2, clock=lambda: 0.0)
+
+    d.submit(forward)
+    d.submit(forward)
+    assert d.tick(0.5) == [forward]
+    d.submit(back)
+    assert d.tick(1.0) == [forward], "Sliding window forgot votes too early"
+    assert d.tick(1.5) == [back], "Sliding window kept votes too long"
+    assert d.tick(2.0) == [], "Sliding window did not empty"
+    assert d.totals == {}, "Tally state not released"
+    assert len(d.buckets) <= 2, "Bucket count not bounded"
+
+def test_idle_gap_expires_every_step(commands: list[FakeCommand]) -> None:
+    forward, back, _ = commands
+    d = dispatch.DemocracyDispatcher(window=1.0, n_buckets=4, clock=lambda: 0.0)
+
+    d.submit(forward)
+    d.submit(forward)
+    assert d.tick(0.25) == [forward]
+    assert d.tick(1.6) == [forward], "Votes cast before the gap should still count at the first tick after it"
+    d.submit(back)
+    assert d.tick(1.75) == [back], "Votes from before the gap are older than the window and should be gone"
+    assert id(forward) not in d.totals
+
+def test_bad_window() -> None:
+    with pytest.raises(ValueError):
+        dispatch.DemocracyDispatcher(window=0)
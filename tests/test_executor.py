@@ -0,0 +1,55 @@
+import threading
+import executor
+import pytest
+
+def test_lane_executor_keeps_lane_order() -> None:
+    results = []
+    with executor.LaneExecutor(n_workers=3, max_queue=100) as pool:
+        for i in range(50):
+            assert pool.submit(lambda i=i: results.append(("w", i)), lane="w"), "Task rejected"
+    assert [i for _, i in results] == list(range(50)), "Lane ran out of order"
+    assert pool.stats()["completed"] == 50, "Completed count wrong"
+
+def test_lane_executor_rejects_when_full() -> None:
+    release = threading.Event()
+    with executor.LaneExecutor(n_workers=1, max_queue=2) as pool:
+        accepted = [pool.submit(release.wait, lane="w") for _ in range(10)]
+        assert pool.queue_depth() <= 2, "Queue grew past its bound"
+        release.set()
+
+    assert accepted[:2] == [True, True], "Tasks rejected before the queue was full"
+    assert not all(accepted), "No tasks rejected"
+    stats = pool.stats()
+    assert stats["rejected"] == accepted.count(False), "Rejections not counted"
+    assert stats["submitted"] == stats["completed"], "Accepted tasks did not all run"
+
+def test_shutdown_with_a_full_queue() -> None:
+    release = threading.Event()
+    pool = executor.LaneExecutor(n_workers=1, max_queue=2)
+    ran = []
+    pool.submit(release.wait)
+    while pool.queue_depth(): # The worker has taken it
+        pass
+    assert pool.submit(lambda: ran.append(1)) and pool.submit(lambda: ran.append(2)), "Should fill the queue"
+    shutdown = threading.Thread(target=pool.shutdown, args=(False,), daemon=True)
+    shutdown.start()
+    try:
+        shutdown.join(1)
+        assert not shutdown.is_alive(), "Shutdown should not block on a full queue"
+        assert not pool.submit(lambda: ran.append(3)), "Nothing should be queued once shutting down"
+    finally:
+        release.set()
+    pool.shutdown()
+    assert ran == [1, 2], "Everything already queued should still run"
+    assert not any(worker.is_alive() for worker in pool.workers)
+
+def test_lane_executor_survives_failing_task() -> None:
+    with executor.LaneExecutor(n_workers=1) as pool:
+        pool.submit(lambda: 1 / 0)
+        done = threading.Event()
+        pool.submit(done.set)
+    assert done.is_set(), "Worker died after a failing task"
+
+def test_bad_pool() -> None:
+    with pytest.raises(ValueError):
+        executor.LaneExecutor(n_workers=0)
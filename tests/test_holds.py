@@ -0,0 +1,120 @@
+import time
+
+import holds
+import outputs
+import pytest
+import timers
+
+@pytest.fixture
+def holder(clock) -> tuple:
+    holder = holds.KeyHolder(timers.TimerWheel(clock=clock, threaded=False)) # Released by calling run_due
+    events = []
+    def hold(key: str, seconds: float):
+        return holder.hold(key, seconds, lambda: events.append(("press", key)), lambda: events.append(("release", key)))
+    return holder, clock, events, hold
+
+def test_overlapping_holds_extend(holder) -> None:
+    holder, clock, events, hold = holder
+    released = hold("w", 1.0)
+    clock.t = 0.5
+    assert hold("w", 1.0) is released, "Holding a held key should join its hold"
+    clock.t = 1.2
+    holder.wheel.run_due()
+    assert holder.is_held("w"), "First hold running out should not cut the second short"
+    clock.t = 1.5
+    assert holder.wheel.run_due() == 1 and holder.wheel.pending == 0, "Nothing left to release"
+    assert events == [("press", "w"), ("release", "w")], "One press and one release for overlapping holds"
+    assert released.is_set() and holder.n_extended == 1
+
+def test_shorter_hold_does_not_shorten(holder) -> None:
+    holder, clock, events, hold = holder
+    hold("w", 2.0)
+    hold("w", 0.5)
+    clock.t = 1.0
+    holder.wheel.run_due()
+    assert holder.is_held("w"), "Should wait for the longer hold"
+    clock.t = 2.0
+    holder.wheel.run_due()
+    assert not holder.is_held("w")
+
+def test_spam_keeps_calls_constant(holder) -> None:
+    holder, clock, events, hold = holder
+    for i in range(1000):
+        clock.t = i / 1000
+        hold("w", 0.5)
+        hold("a", 0.5)
+    clock.t = 2.0
+    holder.wheel.run_due()
+    assert len(events) == 4, "Spam should still be one press and one release per key"
+
+def test_taps_and_release_all(holder) -> None:
+    holder, clock, events, hold = holder
+    assert hold("space", 0).is_set(), "A zero length hold is a tap"
+    hold("w", 10.0)
+    holder.close()
+    assert events == [("press", "space"), ("release", "space"), ("press", "w"), ("release", "w")], "Closing should let go of everything held"
+    with pytest.raises(RuntimeError):
+        hold("w", 1.0)
+
+class FailingBackend(outputs.RecordingBackend):
+    '''Rejects every key press while `failing`, as pynput does a key it does not know'''
+    failing = True
+
+    def press(self, key: str) -> None:
+        if self.failing:
+            raise ValueError(f"Unknown key {key}")
+        super().press(key)
+
+def test_failed_press_not_held(holder) -> None:
+    holder, clock, _, _ = holder
+    backend = FailingBackend(clock=clock)
+    def hold(seconds: float):
+        return holder.hold("w", seconds, lambda: backend.press("w"), lambda: backend.release("w"), backend.flush)
+    with pytest.raises(ValueError):
+        hold(1.0)
+    assert not holder.is_held("w"), "A key that failed to press should not be held"
+    backend.failing = False
+    released = hold(2.0)
+    clock.t = 2.0
+    holder.wheel.run_due()
+    assert released.is_set(), "The next hold should press and release as usual"
+    assert [e.type for _, e in backend.events] == [outputs.OutputEventType.KEY_PRESS, outputs.OutputEventType.KEY_RELEASE]
+
+def test_holder_thread_releases() -> None:
+    holder = holds.KeyHolder(timers.TimerWheel())
+    events = []
+    released = holder.hold("w", 0.01, lambda: events.append("press"), lambda: events.append("release"))
+    assert released.wait(1), "Scheduler should release when the hold runs out"
+    assert events == ["press", "release"]
+    holder.close()
+
+def test_keyboard_routines_share_holds() -> None:
+    backend = outputs.RecordingBackend()
+    outputs.set_default(backend)
+    holds.set_default(holder := holds.KeyHolder())
+    try:
+        outputs.KeyboardOutputs.press_release_routine("w", 10, 1)
+        outputs.KeyboardOutputs.press_release_routine("w", 10, 1) # Another command for the same key
+        assert [e.type for _, e in backend.events] == [outputs.OutputEventType.KEY_PRESS], "Second command should extend the hold"
+        holder.close()
+        assert [e.type for _, e in backend.events][-1] == outputs.OutputEventType.KEY_RELEASE, "Closing should release the key"
+    finally:
+        outputs.set_default(None)
+        holds.set_default(holds.KeyHolder())
+
+def test_repeats_run_on_the_wheel() -> None:
+    backend = outputs.RecordingBackend()
+    outputs.set_default(backend)
+    holds.set_default(holds.KeyHolder(wheel := timers.TimerWheel()))
+    try:
+        start = time.perf_counter()
+        outputs.KeyboardOutputs.press_release_routine("w", 0.02, 3)
+        assert time.perf_counter() - start < 0.01, "Routine should return without waiting out the repeats"
+        deadline = time.perf_counter() + 1
+        while len(backend.events) < 6 and time.perf_counter() < deadline:
+            time.sleep(0.005)
+        assert [e.type for _, e in backend.events] == [outputs.OutputEventType.KEY_PRESS, outputs.OutputEventType.KEY_RELEASE] * 3
+    finally:
+        wheel.close()
+        outputs.set_default(None)
+        holds.set_default(holds.KeyHolder())
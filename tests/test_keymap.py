@@ -1,4 +1,4 @@
-import keymap, default_config
+import keymap, default_config, executor
 from configparser import ConfigParser
 import pytest
 
@@ -56,4 +56,64 @@ def test_make_keymap_entry_bad_mouse(bad_mouse_keymap: dict[str, dict[str, str]]
             try:
                 keymap.make_keymap_entry(bad_mouse_keymap)
             except ConnectionResetError as e:
-                pass
\ No newline at end of file
+                pass
+@pytest.fixture
+def overlapping_keymap() -> keymap.Keymap:
+    return [
+        keymap.Command(["look"], None, "a"),
+        keymap.Command(["look left", "ll"], None, "b"),
+        keymap.Command(["secret"], None, "c", is_dev_command=True),
+        keymap.Command(["sec"], None, "d"),
+    ]
+
+def test_keymap_trie_first_match(overlapping_keymap: keymap.Keymap) -> None:
+    trie = keymap.KeymapTrie(overlapping_keymap)
+
+    assert trie.match("  LOOK left please").button == "a", "Trie did not keep keymap order"
+    assert trie.match("ll").button == "b", "Trie missed an alias"
+    assert trie.match("lo") is None, "Trie matched a partial alias"
+    assert trie.match("secret", "viewer", frozenset({"dev"})).button == "d", "Dev command ran for a viewer"
+    assert trie.match("secret", "Dev", frozenset({"dev"})).button == "c", "Dev user could not run dev command"
+
+def test_keymap_trie_longest_match(overlapping_keymap: keymap.Keymap) -> None:
+    trie = keymap.KeymapTrie(overlapping_keymap, prefer_longest=True)
+
+    assert trie.match("look left").button == "b", "Trie did not prefer the longest alias"
+    assert trie.match("secret", "Dev", frozenset({"dev"})).button == "c", "Dev user could not run dev command"
+    assert trie.match("secret", "viewer", frozenset({"dev"})).button == "d", "Dev command ran for a viewer"
+
+def test_keymap_trie_matches_linear_search(overlapping_keymap: keymap.Keymap) -> None:
+    def linear(payload: str, username: str, dev_users: set[str]):
+        for command in overlapping_keymap:
+            for key in command.keys:
+                if payload.lower().strip().startswith(key):
+                    if not command.is_dev_command or username.lower() in dev_users:
+                        return command
+        return None
+
+    trie = keymap.KeymapTrie(overlapping_keymap)
+    for payload in ["look", "look left", "ll", "l", "secret", "sec", "nothing", " Look Up", ""]:
+        for username in ["dev", "viewer"]:
+            assert trie.match(payload, username, {"dev"}) is linear(payload, username, {"dev"}), f"Trie disagrees with linear search for {payload!r}"
+
+def test_command_run_on_executor() -> None:
+    ran = []
+    command = keymap.Command(["forward"], lambda *args: ran.append(args), "w", duration=1, cooldown=10)
+    with executor.LaneExecutor(n_workers=1, max_queue=1) as pool:
+        assert command.run(pool), "Command not accepted"
+        assert not command.run(pool), "Command ran twice while on cooldown"
+    assert ran == [("w", 1, 1)], "Command did not run on the executor"
+    assert not command.is_running, "Command still marked as running"
+
+def test_make_channel_keymaps() -> None:
+    config = ConfigParser()
+    config.read_dict({
+        default_config.ConfigKeys.keyboard:                 {"forward": "w"},
+        default_config.ConfigKeys.mouse:                    {"lmb": "lmb"},
+        f"{default_config.ConfigKeys.keyboard}.otherchannel": {"jump": "space"},
+    })
+    keymaps = keymap.make_channel_keymaps(config, ["mychannel", "otherchannel", "thirdchannel"])
+
+    assert [c.keys for c in keymaps["otherchannel"]] == [["jump"], ["lmb"]], "Channel section should replace only the keyboard commands"
+    assert all(a is b for a, b in zip(keymaps["mychannel"], keymaps["thirdchannel"])), "Channels without a section should share commands"
+    assert keymaps["mychannel"][1] is keymaps["otherchannel"][1], "Default mouse commands should be shared"
@@ -0,0 +1,59 @@
+import asyncio, os
+
+import pytest
+
+import keymap_cache
+
+CONFIG = """[twitch.tv]
+TwitchChannelName = some_channel
+
+[keyboard.chat.commands]
+forward = w, d:2, cd:5
+back = s, d:0.5
+
+[mouse.chat.commands]
+"""
+
+@pytest.fixture
+def config_file(tmp_path):
+    filename = tmp_path / "config.ini"
+    filename.write_text(CONFIG)
+    return filename
+
+def test_load_uses_cache(config_file, tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    _, compiled = keymap_cache.load(config_file, cache_dir)
+    assert len(list(cache_dir.glob("keymap-*.pickle"))) == 1, "First load should write a cache"
+    assert compiled.matchers["some_channel"].match("forward") is not None, "Compiled keymap should match its commands"
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Should not compile when cached")
+    monkeypatch.setattr(keymap_cache, "compile_keymap", fail)
+    _, cached = keymap_cache.load(config_file, cache_dir)
+    assert cached.digest == compiled.digest, "Second load should come from the cache"
+    assert [c.keys for c in cached.commands] == [c.keys for c in compiled.commands], "Cached keymap should be the same"
+
+def test_carry_over_state(config_file):
+    _, old = keymap_cache.load(config_file, None)
+    forward = old.matchers["some_channel"].match("forward")
+    forward.last_run = 123.0
+
+    config_file.write_text(CONFIG.replace("cd:5", "cd:9").replace("back = s", "left = a"))
+    _, new = keymap_cache.load(config_file, None)
+    assert keymap_cache.carry_over_state(old, new) == 1, "Only the unchanged command should carry over"
+    assert new.matchers["some_channel"].match("forward") is forward, "Live command should be reused"
+    assert forward.last_run == 123.0, "Live command should keep its last run"
+    assert forward.cooldown == 9.0, "Live command should take on its new settings"
+    assert new.matchers["some_channel"].match("left") is not None, "New command should be added"
+    assert new.matchers["some_channel"].match("back") is None, "Removed command should be gone"
+
+def test_reloader_picks_up_changes(config_file):
+    _, compiled = keymap_cache.load(config_file, None)
+    reloader = keymap_cache.KeymapReloader(config_file, compiled, None)
+    assert asyncio.run(reloader.check()) is None, "Unchanged file should not reload"
+
+    config_file.write_text(CONFIG.replace("[mouse.chat.commands]", "jump = space\n\n[mouse.chat.commands]"))
+    os.utime(config_file, ns=(0, 10**9)) # Make sure the stat differs on coarse clocks
+    reloaded = asyncio.run(reloader.check())
+    assert reloaded is not None and reloaded.matchers["some_channel"].match("jump") is not None, "Changed file should reload"
+    assert reloader.current is reloaded, "Reloader should keep the new keymap"
@@ -0,0 +1,41 @@
+import latency
+import pytest
+import twitch
+from executor import LaneExecutor
+
+def test_histogram_percentiles() -> None:
+    h = latency.Histogram()
+    for us in range(1, 10001):
+        h.record(us / 1e6)
+    assert h.count == 10000
+    for p in (50, 90, 99):
+        assert h.percentile(p) == pytest.approx(p * 100, rel=0.04), f"p{p} out by more than the bucket width"
+    assert h.max == 10000
+    assert latency.Histogram().percentile(50) == 0.0, "Empty histogram should report zero"
+
+def test_histogram_buckets_are_contiguous() -> None:
+    for index in range(1, latency.Histogram.N_BUCKETS - 1):
+        assert latency.Histogram.bucket_range(index)[0] == latency.Histogram.bucket_range(index - 1)[1], f"Gap before bucket {index}"
+        low, high = latency.Histogram.bucket_range(index)
+        assert latency.Histogram.bucket(low) == index and latency.Histogram.bucket(high - 1) == index
+
+def test_parser_stamps_messages() -> None:
+    msgs = twitch.IrcParser().parse([b":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #channel :forward"], received_at=12.5)
+    assert msgs[0].received_at == 12.5
+
+def test_traced_action_records_stages() -> None:
+    tracer = latency.LatencyTracer()
+    latency.set_default(tracer)
+    try:
+        received_at = latency.now()
+        with LaneExecutor(n_workers=1) as pool:
+            pool.submit(latency.traced(lambda: latency.mark_output() or latency.mark_output(), received_at))
+        snapshot = tracer.snapshot()
+    finally:
+        latency.set_default(latency.LatencyTracer(enabled=False))
+    for stage in ("executor", "output", "end_to_end"):
+        assert snapshot[stage]["count"] == 1, f"{stage} should be recorded once, for the first output only"
+
+def test_disabled_tracer_does_not_wrap() -> None:
+    fn = lambda: None
+    assert latency.traced(fn, latency.now()) is fn, "Tracing is off by default and should cost nothing"
@@ -0,0 +1,56 @@
+import gzip, logging, threading
+
+import pytest
+
+import logqueue
+
+class ListHandler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages = []
+        self.threads  = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+@pytest.fixture
+def root_logger():
+    handlers, level = logging.root.handlers, logging.root.level
+    yield
+    logging.root.handlers = handlers
+    logging.root.setLevel(level)
+
+def test_repeats_suppressed() -> None:
+    t = [0.0]
+    repeat_filter = logqueue.RepeatFilter(window=5.0, clock=lambda: t[0])
+    def record(*args) -> logging.LogRecord:
+        return logging.LogRecord("root", logging.INFO, __file__, 1, "%s is on cooldown", args, None)
+
+    assert repeat_filter.filter(record(["forward"])), "First should go through"
+    assert not any(repeat_filter.filter(record(["forward"])) for _ in range(99)), "Repeats within the window should not"
+    assert repeat_filter.filter(record(["back"])), "Different arguments are a different message"
+    t[0] = 6.0
+    summary = record(["forward"])
+    assert repeat_filter.filter(summary) and summary.getMessage() == "['forward'] is on cooldown (repeated 99 more times)"
+
+def test_logging_goes_through_listener(root_logger) -> None:
+    handler = ListHandler()
+    queue_logging = logqueue.start([handler], logging.INFO, repeat_window=60)
+    for _ in range(1000):
+        logging.info("%s is on cooldown", ["forward"])
+    logging.info("done")
+    queue_logging.stop()
+    assert handler.messages == ["['forward'] is on cooldown", "done"], "Flood should be one line"
+    assert threading.current_thread().name not in handler.threads, "Handlers should only run on the listener thread"
+
+def test_gzip_rotator(tmp_path) -> None:
+    source = tmp_path / "log"
+    source.write_text("hello\n")
+    rotator = logqueue.GzipRotator(keep=1)
+    dest = rotator.namer(str(tmp_path / "log.2024-01-01_00-00"))
+    rotator(str(source), dest)
+    rotator.shutdown()
+    assert not source.exists() and not (tmp_path / "log.2024-01-01_00-00").exists(), "Only the compressed file should be left"
+    with gzip.open(dest, "rt") as f:
+        assert f.read() == "hello\n"
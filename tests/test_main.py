@@ -1,2 +1,12 @@
+import logging
+
+from concurrent.futures import Future
+
 import main
 
+def test_listener_failure_logged(caplog) -> None:
+    listener = Future()
+    listener.add_done_callback(main.log_listener_failure)
+    with caplog.at_level(logging.ERROR):
+        listener.set_exception(ValueError("bad hotkey <shift>+<nope>"))
+    assert "bad hotkey" in caplog.text, "A failed hotkey listener should be reported when it fails"
@@ -0,0 +1,101 @@
+import asyncio, configparser, json, threading, urllib.request
+
+import local_irc_server
+import metrics
+import twitch
+import twitch_async
+
+def test_counters_summed_across_threads() -> None:
+    registry = metrics.Registry()
+
+    def count() -> None:
+        for _ in range(10000):
+            registry.inc("messages")
+        registry.inc("bytes", 5)
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert registry.counters() == {"bytes": 20, "messages": 40000}, "Every thread's counts should be added up, finished threads included"
+
+def test_finished_threads_retired() -> None:
+    registry = metrics.Registry()
+    for _ in range(500):
+        thread = threading.Thread(target=registry.inc, args=("tasks",))
+        thread.start()
+        thread.join()
+    assert len(registry.per_thread) <= 64, "Finished threads' counters should not pile up"
+    assert registry.counters() == {"tasks": 500}, "Finished threads' counts should still be added up"
+    assert registry.per_thread == [], "A scrape should retire every finished thread"
+
+def test_totals_are_counters() -> None:
+    registry = metrics.Registry()
+    registry.inc("messages_dropped", 1)
+    registry.total("messages_dropped", lambda: 4)
+    registry.total("broken", lambda: 1 / 0)
+    assert registry.counters() == {"messages_dropped": 5}, "Totals should be added to the counters, and left out if they fail"
+    assert "# TYPE twitchplays_messages_dropped_total counter" in registry.prometheus()
+
+def test_gauges() -> None:
+    registry = metrics.Registry()
+    registry.gauge("depth", lambda: 3)
+    registry.gauge("not_yet", lambda: None)
+    registry.gauge("broken", lambda: 1 / 0)
+    gauges = registry.snapshot()["gauges"]
+    assert gauges["depth"] == 3
+    assert "not_yet" not in gauges and "broken" not in gauges, "Gauges with no value, or that fail, should be left out"
+    assert "uptime_seconds" in gauges
+
+def test_prometheus_format() -> None:
+    registry = metrics.Registry()
+    registry.inc("messages_matched", 2)
+    text = registry.prometheus()
+    assert "# TYPE twitchplays_messages_matched_total counter\ntwitchplays_messages_matched_total 2\n" in text
+    assert "# TYPE twitchplays_uptime_seconds gauge" in text
+
+def test_server() -> None:
+    registry = metrics.Registry()
+    registry.inc("frames_received", 7)
+    server = metrics.MetricsServer(registry, port=0).start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics.json") as response:
+            assert json.load(response)["counters"] == {"frames_received": 7}
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert b"twitchplays_frames_received_total 7" in response.read()
+    finally:
+        server.stop()
+
+def test_write_file(tmp_path) -> None:
+    registry = metrics.Registry()
+    registry.inc("commands_executed")
+    metrics.write_file(registry, tmp_path / "metrics.json")
+    assert json.loads((tmp_path / "metrics.json").read_text())["counters"] == {"commands_executed": 1}
+
+def test_make_server_off_by_default() -> None:
+    config = configparser.ConfigParser()
+    assert metrics.make_server(config) is None, "No section should mean no server"
+    config.read_string("[metrics]\nEnabled = yes\nPort = 0\n")
+    assert metrics.make_server(config) is None, "Port 0 should mean no server"
+
+async def receive_chat(n_messages: int) -> None:
+    chat = b"".join(f":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #test :hello {i}\r\n".encode() for i in range(n_messages))
+    async with local_irc_server.LocalTwitchServer() as server:
+        async with twitch_async.AsyncChannelConnection("test", twitchIrc=server.twitch_irc(), store=twitch.MessageStore()) as tw:
+            await server.broadcast(chat, joined_only=True)
+            for _ in range(n_messages):
+                await asyncio.wait_for(tw.get_chat_message(), 5)
+
+def test_protocol_counts() -> None:
+    registry = metrics.Registry()
+    default = metrics.get_default()
+    metrics.set_default(registry)
+    try:
+        asyncio.run(receive_chat(100))
+    finally:
+        metrics.set_default(default)
+    counters = registry.counters()
+    assert counters["messages_parsed_privmsg"] == 100, "Each chat message should be counted by type"
+    assert counters["frames_received"] >= 100
+    assert counters["bytes_received"] > 100 * len("PRIVMSG #test :hello")
@@ -0,0 +1,96 @@
+import time
+
+import motion
+import pytest
+
+@pytest.mark.parametrize("easing", list(motion.EASINGS))
+@pytest.mark.parametrize("dx,dy,steps", [(500, 0, 50), (-333, 77, 7), (3, -1, 10), (0, 0, 1)])
+def test_path_adds_up_exactly(easing, dx, dy, steps) -> None:
+    for bend in (0.0, 0.2):
+        path = motion.plan_path(dx, dy, steps, easing, bend)
+        assert len(path) == steps, "One move per step"
+        assert (sum(x for x, _ in path), sum(y for _, y in path)) == (dx, dy), "Steps should add up to the whole move without losing pixels"
+
+def test_path_is_cached() -> None:
+    assert motion.plan_path(500, 0, 50) is motion.plan_path(500, 0, 50), "Repeated moves should reuse the path"
+
+def test_ease_in_out_is_slow_at_the_ends() -> None:
+    path = motion.plan_path(1000, 0, 20, "ease_in_out")
+    assert path[0][0] < path[10][0] and path[-1][0] < path[10][0], "Eased path should be fastest in the middle"
+
+def test_play_keeps_to_deadlines(clock) -> None:
+    engine = motion.MotionEngine(rate=100, clock=clock, sleep=clock.sleep)
+    sent = []
+    path = engine.plan(500, 0, 0.5)
+    engine.play(path, 0.5, lambda dx, dy: sent.append((clock.t, dx, dy)))
+    assert len(path) == 50, "Half a second at 100 steps a second"
+    assert clock.t == pytest.approx(0.5), "Move should take its whole duration and no longer"
+    assert all(t * 100 == pytest.approx(round(t * 100)) for t, *_ in sent), "Steps should go out on their deadlines"
+    assert sum(dx for _, dx, _ in sent) == 500, "Every pixel should be sent"
+
+def test_late_steps_catch_up(clock) -> None:
+    def slow_move(dx: int, dy: int) -> None:
+        clock.t += 0.03 # Each move takes three steps' worth of time
+    engine = motion.MotionEngine(rate=100, clock=clock, sleep=clock.sleep)
+    engine.play(engine.plan(100, 0, 0.1), 0.1, slow_move)
+    assert engine.n_late > 0, "Late steps should be counted"
+    assert clock.t == pytest.approx(0.3), "Late steps go out straight away rather than adding their own wait"
+
+def test_bad_arguments() -> None:
+    with pytest.raises(ValueError):
+        motion.MotionEngine(rate=0)
+    with pytest.raises(ValueError):
+        motion.MotionEngine(easing="bouncy")
+    with pytest.raises(ValueError):
+        motion.plan_path(1, 1, 0)
+
+def test_mixer_sums_overlapping_moves(clock) -> None:
+    mixer = motion.MotionMixer(rate=100, clock=clock, sleep=clock.sleep)
+    sent = []
+    paths = [motion.plan_path(dx, dy, 20) for dx, dy in [(-500, 0), (0, -120), (333, 7)] * 10]
+    sink = (lambda dx, dy: sent.append((dx, dy)), lambda: None)
+    done = [motion._Motion(path, sink) for path in paths]
+    mixer.motions = done # Drive frames by hand rather than on the mixer's thread
+    for _ in range(21):
+        mixer.frame()
+    assert mixer.n_moves == len(sent) <= 20, "At most one move a frame however many motions overlap"
+    assert (sum(x for x, _ in sent), sum(y for _, y in sent)) == (-1670, -1130), "Every pixel of every motion should be sent"
+    assert all(m.done.is_set() for m in done) and not mixer.motions, "Finished motions should be let go"
+
+def test_mixer_thread() -> None:
+    mixer = motion.MotionMixer(rate=1000)
+    sent = []
+    events = [mixer.add(motion.plan_path(10, 0, 5), lambda dx, dy: sent.append(dx)) for _ in range(3)]
+    assert all(event.wait(1) for event in events), "Motions should finish"
+    mixer.close()
+    assert sum(sent) == 30, "Every pixel should be sent"
+    with pytest.raises(RuntimeError):
+        mixer.add(((1, 1),), print)
+
+def test_mixer_survives_failing_sink() -> None:
+    mixer = motion.MotionMixer(rate=1000)
+
+    def broken(dx: int, dy: int) -> None:
+        raise RuntimeError("Backend failed to load")
+
+    assert mixer.add(motion.plan_path(10, 0, 5), broken).wait(1), "A failing sink should not leave the motion waiting"
+    sent = []
+    assert mixer.add(motion.plan_path(10, 0, 5), lambda dx, dy: sent.append(dx)).wait(1), "Later motions should still play"
+    mixer.close()
+    assert sum(sent) == 10
+
+def test_mixer_restarts_after_loop_fails() -> None:
+    calls = []
+
+    def sleep(seconds: float) -> None:
+        calls.append(seconds)
+        if len(calls) == 1:
+            raise RuntimeError("Clock went wrong")
+        time.sleep(seconds)
+
+    mixer = motion.MotionMixer(rate=1000, sleep=sleep)
+    assert mixer.add(motion.plan_path(10, 0, 5), lambda dx, dy: None).wait(1), "Waiters should be let go when the loop dies"
+    sent = []
+    assert mixer.add(motion.plan_path(10, 0, 5), lambda dx, dy: sent.append(dx)).wait(1), "The next motion should start a new loop"
+    mixer.close()
+    assert sum(sent) == 10
@@ -0,0 +1,70 @@
+import json
+import outputs
+import pytest
+from outputs import OutputEvent, OutputEventType
+
+@pytest.fixture
+def recording() -> outputs.RecordingBackend:
+    backend = outputs.RecordingBackend()
+    outputs.set_default(backend)
+    yield backend
+    outputs.set_default(None)
+
+def test_keyboard_routine_targets_backend(recording: outputs.RecordingBackend) -> None:
+    outputs.KeyboardOutputs.press_release_routine("w", 0, 2)
+    assert [e.type for _, e in recording.events] == [OutputEventType.KEY_PRESS, OutputEventType.KEY_RELEASE] * 2
+    assert all(e.args == ("w",) for _, e in recording.events)
+
+def test_mouse_routines_target_backend(recording: outputs.RecordingBackend) -> None:
+    outputs.MouseOutputs.press_release_routine(["left"], 0)
+    outputs.MouseOutputs.move(10, -5)
+    assert [e for _, e in recording.events] == [
+        OutputEvent(OutputEventType.MOUSE_PRESS, ("left",)),
+        OutputEvent(OutputEventType.MOUSE_RELEASE, ("left",)),
+        OutputEvent(OutputEventType.MOUSE_MOVE, (10, -5)),
+    ]
+
+def test_recording_file(tmp_path) -> None:
+    filename = tmp_path / "outputs.jsonl"
+    with outputs.RecordingBackend(str(filename), clock=lambda: 1.5) as backend:
+        backend.press("a")
+    assert json.loads(filename.read_text()) == {"t": 1.5, "type": "key_press", "args": ["a"]}
+
+def test_batching_sends_several_events_per_call() -> None:
+    calls = []
+    class Spy(outputs.NullBackend):
+        def send(self, events):
+            calls.append(list(events))
+
+    backend = outputs.BatchingBackend(Spy(), max_batch=3)
+    for i in range(4):
+        backend.mouse_move(i, 0)
+    assert [len(batch) for batch in calls] == [3], "Should send as soon as a batch is full"
+    backend.flush()
+    assert [len(batch) for batch in calls] == [3, 1], "Flush should send the remainder"
+    backend.flush()
+    assert len(calls) == 2, "Nothing to flush"
+
+def test_routine_flushes_before_sleeping() -> None:
+    inner = outputs.RecordingBackend()
+    outputs.set_default(outputs.BatchingBackend(inner, max_batch=100))
+    try:
+        outputs.KeyboardOutputs.press_release_routine("w", 0, 1)
+    finally:
+        outputs.set_default(None)
+    assert len(inner.events) == 2, "Nothing should be left held back after a routine"
+
+def test_null_backend_counts() -> None:
+    backend = outputs.NullBackend()
+    backend.press("w")
+    backend.release("w")
+    assert backend.n_events == 2
+
+def test_deferred_backend_waits_for_the_real_one() -> None:
+    from concurrent.futures import Future
+    future = Future()
+    backend = outputs.DeferredBackend(future)
+    inner = outputs.NullBackend()
+    future.set_result(inner)
+    backend.press("w")
+    assert inner.n_events == 1, "Events should go to the backend once it is ready"
@@ -0,0 +1,52 @@
+import configparser
+
+import pytest
+
+import default_config
+import ratelimit
+from keymap import Command
+
+def test_burst_then_rate(clock) -> None:
+    limiter = ratelimit.UserRateLimiter(rate=1.0, burst=3, clock=clock)
+    assert [limiter.allow("spammer") for _ in range(5)] == [True] * 3 + [False] * 2, "Burst should run out"
+    assert limiter.allow("someone_else"), "Other chatters have their own bucket"
+    clock.t = 1.0
+    assert limiter.allow("spammer") and not limiter.allow("spammer"), "One token back after a second"
+    assert limiter.dropped == 3 and limiter.allowed == 5
+
+def test_per_command_rate(clock) -> None:
+    limiter = ratelimit.UserRateLimiter(rate=0, burst=1, clock=clock)
+    slow = Command(["jump"], print, "space", user_rate=0.1)
+    fast = Command(["forward"], print, "w")
+    assert limiter.allow("user", slow) and not limiter.allow("user", slow), "Command's own rate should apply"
+    assert all(limiter.allow("user", fast) for _ in range(10)), "No global rate and no command rate is no limit"
+    clock.t = 10.0
+    assert limiter.allow("user", slow), "Refilled at the command's rate"
+
+def test_per_command_rate_has_no_burst(clock) -> None:
+    limiter = ratelimit.UserRateLimiter(rate=100, burst=5, clock=clock)
+    slow = Command(["jump"], print, "space", user_rate=0.2)
+    assert [limiter.allow("user", slow) for _ in range(7)] == [True] + [False] * 6, "ur:0.2 should be once every 5s, not the global burst"
+    clock.t = 1000.0
+    assert [limiter.allow("user", slow) for _ in range(3)] == [True, False, False], "Refills should stop at one"
+
+def test_bounded_memory(clock) -> None:
+    limiter = ratelimit.UserRateLimiter(max_users=100, idle_seconds=60, clock=clock)
+    for i in range(10000):
+        limiter.allow(f"user{i}")
+    assert len(limiter.buckets) == 100, "Memory should stay fixed however many chatters"
+    assert "user9999" in limiter.buckets and "user0" not in limiter.buckets, "Least recently seen should go first"
+    clock.t = 61.0
+    limiter.allow("late")
+    assert list(limiter.buckets) == ["late"], "Idle chatters should be forgotten"
+    assert limiter.evicted == 10000, "Every other chatter should have been evicted"
+
+def test_make_limiter() -> None:
+    config = configparser.ConfigParser()
+    assert ratelimit.make_limiter(config) is None, "No section is no limiter"
+    assert ratelimit.make_limiter(default_config.generate_default_config()) is None, "Should be off unless turned on"
+    config.read_string("[ratelimit]\nEnabled = yes\nUserRate = 2\nUserBurst = 4\n")
+    limiter = ratelimit.make_limiter(config)
+    assert (limiter.rate, limiter.burst) == (2.0, 4.0)
+    with pytest.raises(ValueError):
+        ratelimit.UserRateLimiter(burst=0)
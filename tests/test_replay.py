@@ -0,0 +1,65 @@
+import keymap, main, outputs, replay
+import pytest
+
+def write_capture(filename: str, chunks: list[bytes]) -> None:
+    now = [0.0]
+    with replay.CaptureWriter(filename, clock=lambda: now[0]) as capture:
+        for chunk in chunks:
+            now[0] += 0.01
+            capture.write(chunk)
+
+def test_capture_round_trip(tmp_path) -> None:
+    filename = str(tmp_path / "capture.bin")
+    chunks = [b"PING :tmi.twitch.tv\r\n:a!a@a.tmi.twitch.tv PRIVMSG #c :for", b"ward\r\n", memoryview(b"x" * 10)]
+    write_capture(filename, chunks)
+
+    read = list(replay.read_capture(filename))
+    assert [chunk for _, chunk in read] == [bytes(chunk) for chunk in chunks], "Chunks changed"
+    assert [t for t, _ in read] == pytest.approx([0.01, 0.02, 0.03]), "Timestamps changed"
+
+def test_replay_through_pipeline(tmp_path) -> None:
+    filename = str(tmp_path / "capture.bin")
+    write_capture(filename, [
+        b":a!a@a.tmi.twitch.tv JOIN #c\r\nPING :tmi.twitch.tv\r\n:a!a@a.tmi.twitch.tv PRIVMSG #c :for",
+        b"ward\r\n" + b":b!b@b.tmi.twitch.tv PRIVMSG #c :hello\r\n" * 3,
+        b":c!c@c.tmi.twitch.tv PRIVMSG #c :look left\r\n",
+    ])
+    tap = outputs.KeyboardOutputs.press_release_routine
+    matcher = keymap.KeymapTrie([keymap.Command(["forward"], tap, "w"), keymap.Command(["look left"], tap, "q")])
+    matched = []
+
+    stats = replay.replay(filename, matcher, speed=None, on_match=matched.append)
+
+    assert (stats.n_messages, stats.n_chat, stats.n_matched) == (7, 5, 2), "Replay lost or invented messages"
+    assert [command.keys for command in matched] == [["forward"], ["look left"]], "Wrong commands matched"
+    assert stats.n_output_events > 0, "Matched commands should be run, into the null backend"
+
+class RecordingDispatcher:
+    def __init__(self) -> None:
+        self.submitted = []
+
+    def submit(self, command: keymap.Command, now: float = None, received_at: float = None, votes: int = 1) -> None:
+        self.submitted.append(command.keys)
+
+    def tick(self, now: float = None) -> list[keymap.Command]:
+        return []
+
+def test_replay_filters_and_dispatches(tmp_path, monkeypatch) -> None:
+    filename = str(tmp_path / "capture.bin")
+    write_capture(filename, [b":a!a@a.tmi.twitch.tv PRIVMSG #c :reset\r\n:dev!dev@dev.tmi.twitch.tv PRIVMSG #c :reset\r\n"])
+    matcher = keymap.KeymapTrie([keymap.Command(["reset"], None, "r", is_dev_command=True)])
+    filtered = []
+    message_filter = main.message_filter
+    monkeypatch.setattr(main, "message_filter", lambda *args, **kwargs: filtered.append(args[0]) or message_filter(*args, **kwargs))
+    dispatcher = RecordingDispatcher()
+
+    stats = replay.replay(filename, matcher, frozenset({"dev"}), speed=None, dispatcher=dispatcher)
+
+    assert filtered == [("a", "reset"), ("dev", "reset")], "Every chat message should go through main.message_filter"
+    assert stats.n_matched == 1 and dispatcher.submitted == [["reset"]], "Only the dev user should run a dev command"
+
+def test_not_a_capture(tmp_path) -> None:
+    filename = tmp_path / "capture.bin"
+    filename.write_bytes(b"nope")
+    with pytest.raises(ValueError):
+        list(replay.read_capture(str(filename)))
@@ -0,0 +1,93 @@
+import asyncio, configparser
+
+import default_config
+import dispatch
+import local_irc_server
+import metrics
+import spam
+import twitch
+import twitch_async
+
+def chat(username: str, text: str, at: float) -> twitch.TwitchIrc.Message:
+    msg = twitch.TwitchIrc.Message.from_bytes(f":{username}!{username}@{username}.tmi.twitch.tv PRIVMSG #channel :{text}".encode())
+    msg.received_at = at
+    return msg
+
+def test_normalize() -> None:
+    assert spam.normalize("  Forward \U000e0000 ") == "forward", "Case, invisible characters and spacing should not matter"
+    assert spam.normalize("go   LEFT\tnow") == "go left now"
+
+def test_collapses_into_first_copy() -> None:
+    collapser = spam.SpamCollapser(user_window=1.0, text_window=0.25)
+    first = chat("alice", "forward", 0.0)
+    assert not collapser.collapse(first), "First copy should go through"
+    assert collapser.collapse(chat("alice", "FORWARD", 0.5)), "Same chatter repeating within the window"
+    assert collapser.collapse(chat("bob", "forward", 0.1)), "Anyone repeating within the text window"
+    assert not collapser.collapse(chat("bob", "back", 0.1)), "Different text should go through"
+    assert collapser.collapsed == {"user": 1, "text": 1}, "Repeats should be counted by kind"
+    assert first.repeats == 2, "Only another chatter's copy should add to the first copy's multiplicity"
+
+def test_taken_copy_starts_a_new_message() -> None:
+    collapser = spam.SpamCollapser(user_window=0, text_window=1.0)
+    first = chat("alice", "forward", 0.0)
+    collapser.collapse(first)
+    collapser.collapse(chat("bob", "forward", 0.1))
+    assert first.take_repeats() == 2 and first.repeats == 0
+    second = chat("carol", "forward", 0.2)
+    assert not collapser.collapse(second), "A copy after the first was read should go on by itself"
+    assert collapser.collapse(chat("dave", "forward", 0.3)) and second.take_repeats() == 2, "Later copies should fold into the new one"
+
+def test_window_expires() -> None:
+    collapser = spam.SpamCollapser(user_window=1.0, text_window=0)
+    assert not collapser.collapse(chat("alice", "forward", 0.0))
+    assert not collapser.collapse(chat("bob", "forward", 0.1)), "Text window of 0 should not collapse other chatters"
+    assert not collapser.collapse(chat("alice", "forward", 2.5)), "Should be forgotten after the window"
+
+def test_bounded_memory() -> None:
+    buckets = spam.TimeBuckets(window=60, max_keys=100)
+    for i in range(10000):
+        buckets.get_or_add(i, None, 0.0)
+    assert len(buckets) <= 200, "At most two buckets of keys"
+
+def test_off_by_default() -> None:
+    assert spam.make_collapser(default_config.generate_default_config()) is None, "Should be off unless turned on"
+
+def test_burst_is_one_message_of_many_votes() -> None:
+    config = configparser.ConfigParser()
+    config.read_string("[spam]\nEnabled = yes\nTextWindowSeconds = 1\n[dispatch]\nMode = democracy\n")
+    collapser = spam.make_collapser(config)
+    burst = [chat(f"viewer{i}", "forward", i / 1000) for i in range(50)]
+    delivered = [msg for msg in burst if not collapser.collapse(msg)]
+    assert len(delivered) == 1 and delivered[0].repeats == 50, "A burst of N copies should be one message with a multiplicity of N"
+
+    forward, back = object(), object() # Only ever counted here, not run
+    democracy = dispatch.DemocracyDispatcher(keymap=[forward, back], clock=lambda: 0.0)
+    democracy.submit(forward, votes=delivered[0].take_repeats())
+    for _ in range(10):
+        democracy.submit(back)
+    assert democracy.totals[id(forward)][1] == 50 and democracy.winners() == [forward], "Every copy should count as a vote"
+
+async def run_raid(n_messages: int) -> list[twitch.TwitchIrc.Message]:
+    raid = b"".join(f":viewer{i % 3}!viewer{i % 3}@viewer{i % 3}.tmi.twitch.tv PRIVMSG #test :forward\r\n".encode() for i in range(n_messages))
+    async with local_irc_server.LocalTwitchServer() as server:
+        async with twitch_async.AsyncChannelConnection("test", twitchIrc=server.twitch_irc(), store=twitch.MessageStore(),
+                                                       collapser=spam.SpamCollapser(user_window=60, text_window=0)) as tw:
+            await server.broadcast(raid, joined_only=True)
+            msgs = []
+            try:
+                while True:
+                    msgs.append(await asyncio.wait_for(tw.get_chat_message(), 0.5))
+            except asyncio.TimeoutError:
+                pass
+    return msgs
+
+def test_raid_collapses_before_store() -> None:
+    registry = metrics.Registry()
+    default = metrics.get_default()
+    metrics.set_default(registry)
+    try:
+        msgs = asyncio.run(run_raid(1000))
+    finally:
+        metrics.set_default(default)
+    assert len(msgs) == 3, "One message per chatter should reach the store"
+    assert registry.counters()["messages_collapsed_user"] == 997, "Every other copy should be counted"
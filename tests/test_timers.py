@@ -0,0 +1,69 @@
+import threading, time
+
+import pytest
+
+import timers
+
+def test_timers_run_when_due(clock) -> None:
+    wheel = timers.TimerWheel(tick=0.001, clock=clock, threaded=False)
+    fired = []
+    deadlines = [0.0005, 0.003, 0.07, 5.0, 300.0, 0.003] # Level 0, 1, 2 and 3 of the wheel, and a tie
+    for i, deadline in enumerate(deadlines):
+        wheel.call_at(deadline, lambda i=i: fired.append((i, clock.t)))
+
+    for t in (0.0004, 0.0006, 0.0029, 0.003, 0.069, 0.0701, 4.9999, 5.0, 299.0, 300.5):
+        clock.t = t
+        wheel.run_due()
+    assert [i for i, _ in fired] == [0, 1, 5, 2, 3, 4], "Timers should run in deadline order, ties in the order added"
+    assert all(t >= deadlines[i] for i, t in fired), "No timer should run early"
+    assert [t for _, t in fired] == [0.0006, 0.003, 0.003, 0.0701, 5.0, 300.5], "Every timer should run as soon as it is due"
+    assert wheel.pending == 0
+
+def test_cancel(clock) -> None:
+    wheel = timers.TimerWheel(clock=clock, threaded=False)
+    fired = []
+    timer = wheel.call_later(1.0, lambda: fired.append("cancelled"))
+    wheel.call_later(2.0, lambda: fired.append("kept"))
+    timer.cancel()
+    timer.cancel()
+    assert wheel.pending == 1, "Cancelling twice should only count once"
+    clock.t = 3.0
+    wheel.run_due()
+    assert fired == ["kept"]
+
+def test_after_idling(clock) -> None:
+    wheel = timers.TimerWheel(clock=clock, threaded=False)
+    wheel.call_later(0.001, lambda: None)
+    clock.t = 0.002
+    wheel.run_due()
+    clock.t = 6 * 3600.0 # Hours with nothing pending
+    fired = []
+    wheel.call_later(0.5, lambda: fired.append(clock.t))
+    assert wheel.current == wheel._tick_of(clock.t), "Scheduling after idling should skip straight to now"
+    clock.t += 0.5
+    started = time.perf_counter()
+    wheel.run_due()
+    assert fired == [clock.t], "Should run as soon as it is due"
+    assert time.perf_counter() - started < 0.1, "Should not walk the idle ticks"
+
+def test_thread_runs_timers() -> None:
+    wheel = timers.TimerWheel(spin=0.0005)
+    fired = []
+    done = threading.Event()
+    start = wheel.clock()
+    for i in range(20):
+        wheel.call_at(start + 0.005 + i * 0.002, lambda i=i: fired.append(i))
+    wheel.call_at(start + 0.05, done.set)
+    assert done.wait(2), "Every timer should run"
+    wheel.close()
+    assert fired == list(range(20)), "In deadline order"
+    stats = wheel.stats()
+    assert stats["fired"] == 21 and stats["jitter_max_us"] < 50000, "Lateness should be measured and small"
+
+def test_bad_arguments() -> None:
+    with pytest.raises(ValueError):
+        timers.TimerWheel(tick=0)
+    wheel = timers.TimerWheel(threaded=False)
+    wheel.close()
+    with pytest.raises(RuntimeError):
+        wheel.call_later(1, print)
@@ -1,9 +1,16 @@
 import logging
 import time
-import twitch
+import twitch, local_irc_server
 import pytest
 import socket
 
+@pytest.fixture
+def local_server(monkeypatch):
+    with local_irc_server.LocalTwitchServer() as server:
+        monkeypatch.setattr(twitch.TwitchIrc, "url", server.host)
+        monkeypatch.setattr(twitch.TwitchIrc, "port", server.port)
+        yield server
+
 def channel_connection(channel: str):
     with twitch.ChannelConnection(channel) as tw:
         pass
@@ -17,13 +24,14 @@ def channel_connection_with_retries(channel: str) -> bool:
             channel_connection(channel)
             ret = True
             break
-        except [TimeoutError, ConnectionError] as e:
+        except (TimeoutError, ConnectionError) as e:
             time.sleep(1)
 
     return ret
 
-def test_channel_connection(n_retries: int = 4) -> None:
+def test_channel_connection(local_server: local_irc_server.LocalTwitchServer) -> None:
     assert channel_connection_with_retries("katatouille93"), "test_channel_connection failed"
+    assert "JOIN #katatouille93" in local_server.received, "JOIN not sent to the server"
 
     with pytest.raises(TimeoutError):
         channel_connection("")
@@ -35,4 +43,135 @@ def test_message_builder() -> bool:
     assert x.buffer == test_data, "Message Builder append buffer failed"
     y = x.get_and_clear()
     assert y == test_data, "Message Builder get buffer failed"
-    assert 0 ==len(x.buffer), "Message Builder clear buffer failed"
\ No newline at end of file
+    assert 0 ==len(x.buffer), "Message Builder clear buffer failed"
+
+def test_message_builder_frames() -> None:
+    x = twitch.MessageBuilderDefault()
+    x.append(b"PING :tmi.twitch.tv\r")
+    assert [bytes(f) for f in x.frames()] == [], "Frame returned before its terminator arrived"
+    x.append(b"\nPRIVMSG #a :one\r\nPRIVMSG #a :tw")
+    assert [bytes(f) for f in x.frames()] == [b"PING :tmi.twitch.tv", b"PRIVMSG #a :one"], "Frames split incorrectly"
+    x.append(b"o\r\n")
+    assert [bytes(f) for f in x.frames()] == [b"PRIVMSG #a :two"], "Partial frame not reassembled"
+    assert 0 == len(x.buffer), "Consumed frames left in the buffer"
+
+def test_message_builder_compacts_and_grows() -> None:
+    x = twitch.MessageBuilder(capacity=16)
+    frames = []
+    for _ in range(10):
+        x.append(b"abcdefghij\r\nkl")
+        frames += [bytes(f) for f in x.frames()]
+        x.append(b"m\r\n")
+        frames += [bytes(f) for f in x.frames()]
+    assert frames == [b"abcdefghij", b"klm"] * 10, "Frames corrupted by compaction"
+    assert len(x.data) == 16, "Buffer grew when compaction was enough"
+
+    x.append(b"x" * 40)
+    x.append(b"\r\n")
+    assert [bytes(f) for f in x.frames()] == [b"x" * 40], "Frame larger than the capacity was lost"
+
+def test_parse_privmsg() -> None:
+    msg = twitch.TwitchIrc.Message.from_bytes(b":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #test :look left :)")
+    assert (msg.username, msg.id, msg.command) == ("viewer", twitch.TwitchMessageEnum.PRIVMSG, "PRIVMSG"), "Header parsed wrongly"
+    assert (msg.params, msg.trailing) == (("#test",), "look left :)"), "Params parsed wrongly"
+    assert msg.payload_as_tuple() == ("test", "look left :)"), "Payload split wrongly"
+    assert twitch.TwitchIrc.split_command_and_packet(b"PING :tmi.twitch.tv") == ("", twitch.TwitchMessageEnum.PING, ":tmi.twitch.tv"), "Legacy interface broken"
+
+def test_parse_numeric_and_unknown() -> None:
+    msg = twitch.TwitchIrc.Message.from_bytes(b":tmi.twitch.tv 001 justinfan1 :Welcome, GLHF!")
+    assert msg.id == twitch.TwitchMessageEnum.NUMERIC, "Numeric not recognised"
+    assert msg.params == ("justinfan1",), "Numeric params parsed wrongly"
+    assert twitch.TwitchIrc.Message.from_bytes(b":tmi.twitch.tv WHATEVER x").id is None, "Unknown command accepted"
+    assert [m.id for m in twitch.IrcParser().parse([b"", memoryview(b"PING :x"), b"@bad"])] == [twitch.TwitchMessageEnum.PING], "Parser kept bad packets"
+
+def test_parse_tags() -> None:
+    packet = (b"@badges=broadcaster/1,subscriber/12;display-name=Some\\sOne;mod=0;subscriber=1;user-id=1234;emotes= "
+              b":someone!someone@someone.tmi.twitch.tv PRIVMSG #test :forward")
+    msg = twitch.TwitchIrc.Message.from_bytes(packet)
+    assert msg.user_id == "1234", "user-id tag not parsed"
+    assert msg.display_name == "Some One", "Tag value not unescaped"
+    assert msg.badges == {"broadcaster": "1", "subscriber": "12"}, "Badges not parsed"
+    assert msg.is_mod and msg.is_subscriber, "Mod or sub status wrong"
+    assert msg.payload_as_tuple() == ("test", "forward"), "Tags leaked into the payload"
+
+    skipped = twitch.TwitchIrc.Message.from_bytes(packet, parse_tags=False)
+    assert skipped.tags is None and skipped.trailing == "forward", "Tags not skipped"
+
+class FakeSocket:
+    def __init__(self, batches: list[list[bytes]]) -> None:
+        self.batches = batches
+        self.sent = []
+        self.n_receives = 0
+
+    def receive(self) -> list[bytes]:
+        self.n_receives += 1
+        return self.batches.pop(0) if self.batches else []
+
+    def send(self, data: bytes) -> None:
+        self.sent.append(data)
+
+def test_irc_connection_indexes_by_type() -> None:
+    sock = FakeSocket([[
+        b":a!a@a.tmi.twitch.tv PRIVMSG #c :one",
+        b"PING :tmi.twitch.tv",
+        b":tmi.twitch.tv 001 a :hello",
+        b":a!a@a.tmi.twitch.tv PRIVMSG #c :two",
+        b":a!a@a.tmi.twitch.tv JOIN #c",
+    ]])
+    irc = twitch.IrcConnection(incomingSocket=sock)
+    irc.run()
+
+    assert sock.n_receives == 1, "Socket read more than once per tick"
+    assert sock.sent == [twitch.TwitchIrc.pong_message()], "PING not answered"
+    assert irc.joined_at is not None, "JOIN not handled"
+    assert [m.payload for m in irc.peek(twitch.TwitchMessageEnum.PRIVMSG)] == ["#c :one", "#c :two"], "Peek wrong"
+    assert [m.id for m in irc.peek_all()] == [twitch.TwitchMessageEnum.PRIVMSG, twitch.TwitchMessageEnum.NUMERIC, twitch.TwitchMessageEnum.PRIVMSG], "Arrival order lost"
+    assert sock.n_receives == 1, "Peek read the socket"
+    assert len(irc.get(twitch.TwitchMessageEnum.PRIVMSG)) == 2, "Get wrong"
+    assert [m.id for m in irc.get()] == [twitch.TwitchMessageEnum.NUMERIC], "Get all wrong"
+    assert len(irc.store) == 0, "Store not drained"
+
+def chat(text: str) -> twitch.TwitchIrc.Message:
+    return twitch.TwitchIrc.Message.from_bytes(b":a!a@a.tmi.twitch.tv PRIVMSG #c :" + text.encode())
+
+def test_store_drop_oldest() -> None:
+    store = twitch.MessageStore(3, twitch.OverloadPolicy.DROP_OLDEST)
+    for i in range(5):
+        assert store.append(chat(str(i))), "New message refused"
+    assert store.append(twitch.TwitchIrc.Message.from_bytes(b"PING :x")), "PING dropped"
+    assert [m.trailing for m in store.peek(twitch.TwitchMessageEnum.PRIVMSG)] == ["2", "3", "4"], "Kept the wrong messages"
+    assert store.dropped[twitch.TwitchMessageEnum.PRIVMSG] == 2, "Drops not counted"
+    assert store.pop_oldest().trailing == "2", "pop_oldest out of order"
+
+def test_store_drop_newest() -> None:
+    store = twitch.MessageStore(3, twitch.OverloadPolicy.DROP_NEWEST)
+    accepted = [store.append(chat(str(i))) for i in range(5)]
+    assert accepted == [True, True, True, False, False], "Wrong messages refused"
+    assert [m.trailing for m in store.get_all()] == ["0", "1", "2"], "Kept the wrong messages"
+
+def test_store_sample_is_bounded() -> None:
+    store = twitch.MessageStore(10, twitch.OverloadPolicy.SAMPLE)
+    for i in range(1000):
+        store.append(chat(str(i)))
+    assert len(store) == 10, "Sample grew past the cap"
+    assert store.dropped[twitch.TwitchMessageEnum.PRIVMSG] == 990, "Drops not counted"
+    assert any(int(m.trailing) >= 10 for m in store.peek_all()), "Sample never replaced anything"
+
+def test_store_commands_only() -> None:
+    store = twitch.MessageStore(10, twitch.OverloadPolicy.COMMANDS_ONLY, is_command=lambda msg: msg.trailing == "forward")
+    for text in ["hello", "forward", "lol", "forward"]:
+        store.append(chat(text))
+    assert [m.trailing for m in store.get_all()] == ["forward", "forward"], "Non commands kept"
+    assert store.dropped[twitch.TwitchMessageEnum.PRIVMSG] == 2, "Drops not counted"
+
+def test_backoff() -> None:
+    backoff = twitch.Backoff(base=1.0, cap=8.0)
+    delays = [backoff.next() for _ in range(10)]
+    assert all(0 <= delay <= min(8.0, 2 ** i) for i, delay in enumerate(delays)), "Each delay should be jittered up to the doubled base, capped"
+    assert len(set(delays)) > 1, "Delays should be jittered"
+    backoff.reset()
+    assert backoff.next() <= 1.0, "Should start again from the base once reset"
+
+def test_parse_pong() -> None:
+    msg = twitch.TwitchIrc.Message.from_bytes(b":tmi.twitch.tv PONG tmi.twitch.tv :tmi.twitch.tv")
+    assert msg.id == twitch.TwitchMessageEnum.PONG
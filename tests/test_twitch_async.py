@@ -0,0 +1,218 @@
+import asyncio, re
+
+from collections import deque
+from typing import Optional
+
+import twitch, twitch_async, local_irc_server
+import pytest
+
+async def serve_once(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, received: list[bytes]) -> None:
+    while (line := await reader.readline()):
+        received.append(line)
+        if line.startswith(b"JOIN"):
+            writer.write(b":justinfan1!justinfan1@justinfan1.tmi.twitch.tv JOIN #test\r\n")
+            writer.write(b"PING :tmi.twitch.tv\r\n")
+            # Split a chat message across two writes to exercise partial frames
+            writer.write(b":viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #test :forw")
+            await writer.drain()
+            await asyncio.sleep(0.01)
+            writer.write(b"ard\r\n:viewer!viewer@viewer.tmi.twitch.tv PRIVMSG #test :look left\r\n")
+            await writer.drain()
+        elif line.startswith(b"PONG"):
+            writer.close()
+            return
+
+async def run_channel_connection() -> tuple[list[twitch.TwitchIrc.Message], list[bytes], list[bytes]]:
+    received = []
+    teed = []
+    server = await asyncio.start_server(lambda r, w: serve_once(r, w, received), "127.0.0.1", 0)
+    irc = twitch.TwitchIrc("127.0.0.1", server.sockets[0].getsockname()[1])
+
+    async with server:
+        async with twitch_async.AsyncChannelConnection("test", twitchIrc=irc, timeout=1.0, tee=lambda data: teed.append(bytes(data))) as tw:
+            msgs = [msg async for msg in tw]
+    return msgs, received, teed
+
+def test_async_channel_connection() -> None:
+    msgs, received, teed = asyncio.run(run_channel_connection())
+
+    assert [m.payload_as_tuple() for m in msgs] == [("test", "forward"), ("test", "look left")], "Chat messages not framed correctly"
+    assert all(m.username == "viewer" for m in msgs), "Username not parsed"
+    assert any(line.startswith(b"PONG") for line in received), "PING was not answered"
+    assert b"".join(teed).endswith(b"PRIVMSG #test :look left\r\n"), "Raw bytes not teed"
+
+def test_async_channel_connection_refused() -> None:
+    async def connect() -> None:
+        irc = twitch.TwitchIrc("127.0.0.1", 1)
+        async with twitch_async.AsyncChannelConnection("test", twitchIrc=irc, timeout=0.1):
+            pass
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(connect())
+
+async def run_against_load(load: local_irc_server.ChatLoad, n_messages: int) -> list[twitch.TwitchIrc.Message]:
+    async with local_irc_server.LocalTwitchServer(load=load, ping_interval=0.01) as server:
+        async with twitch_async.AsyncChannelConnection("test", twitchIrc=server.twitch_irc(), request_tags=True,
+                                                       store=twitch.MessageStore()) as tw:
+            msgs = [await tw.get_chat_message() for _ in range(n_messages)]
+            await server.send_reconnect()
+            while (msg := await tw.receive()).id != twitch.TwitchMessageEnum.RECONNECT:
+                pass
+        assert any(line.startswith("PONG") for line in server.received), "PING not answered"
+    return msgs
+
+def test_async_channel_connection_under_load() -> None:
+    load = local_irc_server.ChatLoad(rate=2000, n_users=5, mix={"forward": 1}, burst_every=0.02, burst_size=50, split_probability=0.5)
+    msgs = asyncio.run(run_against_load(load, 500))
+
+    assert all(m.payload_as_tuple() == ("test", "forward") for m in msgs), "Frames corrupted under load"
+    assert all(m.user_id is not None for m in msgs), "Tags not sent after CAP REQ"
+
+async def run_pool(channels: list[str], n_messages: int) -> tuple[list[twitch.TwitchIrc.Message], int]:
+    load = local_irc_server.ChatLoad(rate=500, mix={"forward": 1})
+    async with local_irc_server.LocalTwitchServer(load=load) as server:
+        async with twitch_async.AsyncChannelPool(channels, channels_per_connection=2, twitchIrc=server.twitch_irc(),
+                                                 store=twitch.MessageStore()) as pool:
+            n_clients = len(server.clients)
+            assert pool.joined == {channel.lower().lstrip("#") for channel in channels}, "Not every channel joined"
+            msgs = [await pool.get_chat_message() for _ in range(n_messages)]
+    return msgs, n_clients
+
+def test_channel_pool_spreads_channels() -> None:
+    msgs, n_clients = asyncio.run(run_pool(["a", "B", "#c", "d", "e", "a"], 200))
+
+    assert n_clients == 3, "Five channels at two per connection should need three connections"
+    assert {m.payload_as_tuple()[0] for m in msgs} == {"a", "b", "c", "d", "e"}, "Chat from every channel should come through the one loop"
+
+def test_channel_pool_bad_arguments() -> None:
+    with pytest.raises(ValueError):
+        twitch_async.AsyncChannelPool([])
+
+async def serve_without_pongs(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    while (line := await reader.readline()):
+        pass # Logs in and then never says anything, like a peer that has gone away
+    writer.close()
+
+async def run_watchdog(server: asyncio.AbstractServer | local_irc_server.LocalTwitchServer) -> tuple[list[str], Optional[float]]:
+    reasons = []
+    irc = server.twitch_irc() if isinstance(server, local_irc_server.LocalTwitchServer) else twitch.TwitchIrc("127.0.0.1", server.sockets[0].getsockname()[1])
+    connection = twitch_async.AsyncTwitchConnection(twitchIrc=irc, ping_interval=0.05, ping_timeout=0.1)
+    connection.on_lost = lambda _, reason: reasons.append(reason)
+    await connection.connect()
+    await asyncio.sleep(0.5)
+    rtt = connection.protocol.rtt
+    connection.disconnect()
+    return reasons, rtt
+
+def test_watchdog_drops_silent_connection() -> None:
+    async def run() -> tuple[list[str], Optional[float]]:
+        async with await asyncio.start_server(serve_without_pongs, "127.0.0.1", 0) as server:
+            return await run_watchdog(server)
+
+    reasons, rtt = asyncio.run(run())
+    assert reasons == ["timeout"], "A server that stops answering PINGs should be dropped"
+    assert rtt is None
+
+def test_watchdog_times_pongs() -> None:
+    async def run() -> tuple[list[str], Optional[float]]:
+        async with local_irc_server.LocalTwitchServer() as server:
+            return await run_watchdog(server)
+
+    reasons, rtt = asyncio.run(run())
+    assert reasons == [], "A server answering PINGs should be kept"
+    assert rtt is not None and rtt < 0.1, "Round trip of our PING should be timed"
+
+async def run_failover(standby: bool, drop) -> tuple[list[twitch.TwitchIrc.Message], twitch_async.AsyncChannelPool, float]:
+    load = local_irc_server.ChatLoad(rate=500, mix={"forward": 1})
+    async with local_irc_server.LocalTwitchServer(load=load) as server:
+        async with twitch_async.AsyncChannelPool(["test"], twitchIrc=server.twitch_irc(), store=twitch.MessageStore(), standby=standby,
+                                                 backoff=twitch.Backoff(0.01, 0.05)) as pool:
+            while standby and pool.spares[0] is None:
+                await asyncio.sleep(0.01)
+            first = pool.connections[0]
+            msgs = [await pool.get_chat_message() for _ in range(10)]
+            await drop(server)
+            dropped_at = asyncio.get_running_loop().time()
+            while pool.connections[0] is first:
+                msgs.append(await asyncio.wait_for(pool.get_chat_message(), 5))
+            switched_in = asyncio.get_running_loop().time() - dropped_at
+            msgs += [await asyncio.wait_for(pool.get_chat_message(), 5) for _ in range(10)]
+    return msgs, pool, switched_in
+
+async def close_first_client(server: local_irc_server.LocalTwitchServer) -> None:
+    server.clients[0].writer.close()
+
+async def reconnect_first_client(server: local_irc_server.LocalTwitchServer) -> None:
+    await server.clients[0].write(b":tmi.twitch.tv RECONNECT\r\n")
+
+def test_pool_reconnects_when_lost() -> None:
+    msgs, pool, _ = asyncio.run(run_failover(standby=False, drop=close_first_client))
+    assert pool.n_failovers == 1, "Lost connection should have been replaced"
+    assert len(msgs) >= 20 and all(m.payload_as_tuple() == ("test", "forward") for m in msgs), "Chat should carry on after reconnecting"
+
+def test_pool_fails_over_to_standby() -> None:
+    msgs, pool, switched_in = asyncio.run(run_failover(standby=True, drop=reconnect_first_client))
+    assert pool.n_failovers == 1, "RECONNECT should switch to the standby"
+    assert switched_in < 0.5, "Switching to a standby should not wait for a new connection"
+    assert len(msgs) >= 20
+
+def test_pool_without_reconnect_ends() -> None:
+    async def run() -> Optional[twitch.TwitchIrc.Message]:
+        async with local_irc_server.LocalTwitchServer() as server:
+            async with twitch_async.AsyncChannelPool(["test"], twitchIrc=server.twitch_irc(), reconnect=False) as pool:
+                await close_first_client(server)
+                return await asyncio.wait_for(pool.get_chat_message(), 5)
+
+    assert asyncio.run(run()) is None, "Without reconnect a lost connection should end the stream as before"
+
+class RecordingLoad(local_irc_server.ChatLoad):
+    '''Chat load that remembers the id of every message it makes'''
+    sent_ids: list[str] = []
+
+    def messages(self, channel: str, n: int) -> tuple[bytes, bytes]:
+        plain, tagged = super().messages(channel, n)
+        self.sent_ids.extend(re.findall(r";id=([^;]+);", tagged.decode()))
+        return plain, tagged
+
+def test_standby_carries_over_missed_chat() -> None:
+    async def run() -> tuple[list[str], list[str]]:
+        load = RecordingLoad(rate=500, mix={"forward": 1})
+        load.sent_ids = []
+        async with local_irc_server.LocalTwitchServer(load=load) as server:
+            async with twitch_async.AsyncChannelPool(["test"], twitchIrc=server.twitch_irc(), store=twitch.MessageStore(), standby=True) as pool:
+                while pool.spares[0] is None:
+                    await asyncio.sleep(0.01)
+                first = pool.connections[0]
+                msgs = [await pool.get_chat_message() for _ in range(10)]
+                primary = next(client for client in server.clients if client.nick == first.username)
+                primary.channels.clear() # Its chat stops, as if the socket had died...
+                await asyncio.sleep(0.2)
+                await primary.write(b":tmi.twitch.tv RECONNECT\r\n") # ...and then the server notices
+                while pool.connections[0] is first:
+                    msgs.append(await asyncio.wait_for(pool.get_chat_message(), 5))
+                msgs += [await asyncio.wait_for(pool.get_chat_message(), 5) for _ in range(50)]
+        return [msg.tag("id") for msg in msgs], load.sent_ids
+
+    received, sent = asyncio.run(run())
+    assert len(received) == len(set(received)), "No line should be delivered twice"
+    expected = sent[sent.index(received[0]):sent.index(received[-1]) + 1]
+    assert sorted(received) == sorted(expected), "Chat the old connection missed should be carried over from the standby"
+
+def test_join_rate_limit_holds_under_concurrency() -> None:
+    async def run() -> list[float]:
+        pool = twitch_async.AsyncChannelPool(["test"])
+        pool.JOINS_PER_WINDOW, pool.JOIN_WINDOW = 5, 0.2
+        pool.join_times = deque(maxlen=5)
+        sent = []
+
+        async def join(n: int) -> None:
+            for _ in range(n):
+                await pool._join_slot()
+                sent.append(asyncio.get_running_loop().time())
+
+        await asyncio.gather(*(join(4) for _ in range(5))) # Every connection rejoining at once
+        return sent
+
+    sent = asyncio.run(run())
+    assert len(sent) == 20
+    assert all(later - earlier >= 0.2 - 0.01 for earlier, later in zip(sent, sent[5:])), "No more than 5 JOINs in any 0.2s"
@@ -0,0 +1,215 @@
+import logging
+
+import math, threading, time
+
+from configparser import ConfigParser
+from typing import Callable, Optional
+
+import latency
+
+class Timer:
+    '''A callback due at `deadline`, from `TimerWheel.call_at`'''
+    __slots__ = ("deadline", "tick", "fn", "cancelled", "wheel")
+
+    def __init__(self, deadline: float, tick: int, fn: Callable[[], None], wheel: "TimerWheel") -> None:
+        self.deadline  = deadline
+        self.tick      = tick
+        self.fn        = fn
+        self.cancelled = False
+        self.wheel     = wheel
+
+    def cancel(self) -> None:
+        self.wheel._cancel(self)
+
+class TimerWheel:
+    """Hierarchical timer wheel, one thread running every timed event on a monotonic clock
+
+    Timers go in one of LEVELS wheels of SLOTS slots, the first a slot per tick, each one after a slot per
+    whole turn of the wheel below, so adding or cancelling a timer is O(1) however many are pending.  As
+    time moves into a slot of a higher wheel its timers cascade down, until they reach the first wheel and run.
+
+    The thread sleeps until the next timer, or the next cascade, is due.  With `spin` set it wakes that many
+    seconds early and spins for the rest, trading a little CPU for sub-millisecond precision where the OS
+    sleep is coarse.  How late each timer ran is kept in `jitter`.
+    """
+    SLOT_BITS = 6
+    SLOTS     = 1 << SLOT_BITS
+    LEVELS    = 4 # With 1ms ticks the top wheel turns every 4.6 hours, anything later is parked and re-cascaded
+
+    def __init__(self, tick: float = 0.001, spin: float = 0.0, clock: Callable[[], float] = time.perf_counter, threaded: bool = True) -> None:
+        if tick <= 0 or spin < 0:
+            raise ValueError("Tick must be more than zero and spin not negative")
+        self.tick      = tick
+        self.spin      = spin
+        self.clock     = clock
+        self.threaded  = threaded # False to run timers only when run_due is called, e.g. in tests
+        self.current   = self._tick_of(clock()) # Tick being run, every tick before it has been
+        self.wheels: list[list[list[Timer]]] = [[[] for _ in range(self.SLOTS)] for _ in range(self.LEVELS)]
+        self.pending   = 0
+        self.condition = threading.Condition()
+        self.thread: Optional[threading.Thread] = None
+        self.closed    = False
+        self.jitter    = latency.Histogram() # How late each timer ran
+        self.n_fired   = 0
+
+    def _tick_of(self, t: float) -> int:
+        return math.floor(t / self.tick)
+
+    def _insert(self, timer: Timer) -> None:
+        tick = max(timer.tick, self.current)
+        delta = tick - self.current
+        for level in range(self.LEVELS):
+            if delta < 1 << (self.SLOT_BITS * (level + 1)):
+                self.wheels[level][(tick >> (self.SLOT_BITS * level)) & (self.SLOTS - 1)].append(timer)
+                return
+        level = self.LEVELS - 1 # Beyond the top wheel, park it in the slot to cascade last
+        self.wheels[level][((self.current >> (self.SLOT_BITS * level)) - 1) & (self.SLOTS - 1)].append(timer)
+
+    def _cascade(self) -> None:
+        for level in range(1, self.LEVELS):
+            if self.current & ((1 << (self.SLOT_BITS * level)) - 1):
+                break
+            slot = self.wheels[level][(self.current >> (self.SLOT_BITS * level)) & (self.SLOTS - 1)]
+            timers, slot[:] = list(slot), []
+            for timer in timers:
+                if not timer.cancelled:
+                    self._insert(timer)
+
+    def call_at(self, deadline: float, fn: Callable[[], None]) -> Timer:
+        """Run `fn` on the timer thread once `clock()` reaches `deadline`
+
+        Args:
+            deadline (float): when, from the same clock
+            fn (Callable[[], None]): what to run, it should be quick as every other timer waits for it
+
+        Returns:
+            Timer: to cancel it with
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Timer wheel is closed")
+            if not self.pending: # Idle, so skip the ticks missed rather than walking them one by one on the next run
+                self.current = max(self.current, self._tick_of(self.clock()))
+            timer = Timer(deadline, self._tick_of(deadline), fn, self)
+            self._insert(timer)
+            self.pending += 1
+            if self.threaded and self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="TimerWheel", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+        return timer
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> Timer:
+        return self.call_at(self.clock() + delay, fn)
+
+    def _cancel(self, timer: Timer) -> None:
+        with self.condition:
+            if not timer.cancelled:
+                timer.cancelled = True
+                self.pending -= 1
+
+    def _take_due(self, now: float) -> list[Timer]:
+        '''Move up to now, taking every timer due by then'''
+        due = []
+        now_tick = self._tick_of(now)
+        if not self.pending: # Nothing to cascade, jump straight there
+            self.current = max(self.current, now_tick)
+        while True:
+            slot = self.wheels[0][self.current & (self.SLOTS - 1)]
+            if slot:
+                kept = []
+                for timer in slot:
+                    if timer.cancelled:
+                        continue
+                    (due if timer.deadline <= now else kept).append(timer)
+                slot[:] = kept
+            if self.current >= now_tick:
+                break
+            self.current += 1
+            self._cascade()
+        for timer in due:
+            timer.cancelled = True # Ran, so cancelling it now does nothing
+        self.pending -= len(due)
+        return due
+
+    def _next_wake(self) -> Optional[float]:
+        '''When the next timer or cascade is due, None if nothing is pending'''
+        if not self.pending:
+            return None
+        for i in range(self.SLOTS):
+            tick = self.current + i
+            if i and not tick & (self.SLOTS - 1):
+                return tick * self.tick
+            slot = self.wheels[0][tick & (self.SLOTS - 1)]
+            if live := [timer for timer in slot if not timer.cancelled]:
+                return min(timer.deadline for timer in live)
+        return (self.current + self.SLOTS) * self.tick
+
+    def _fire(self, due: list[Timer]) -> None:
+        for timer in due:
+            self.jitter.record(self.clock() - timer.deadline)
+            self.n_fired += 1
+            try:
+                timer.fn()
+            except Exception:
+                logging.exception("Timer callback failed")
+
+    def run_due(self) -> int:
+        """Run every timer due by now, on this thread
+
+        Returns:
+            int: number run
+        """
+        with self.condition:
+            due = self._take_due(self.clock())
+        self._fire(due)
+        return len(due)
+
+    def _run(self) -> None:
+        while True:
+            with self.condition:
+                while True:
+                    if self.closed:
+                        return
+                    if (wake := self._next_wake()) is not None and (remaining := wake - self.clock()) <= self.spin:
+                        break
+                    self.condition.wait(None if wake is None else remaining - self.spin)
+            while self.clock() < wake: # Spin out the last moment, only ever up to `spin` seconds
+                pass
+            self.run_due()
+
+    def stats(self) -> dict[str, float]:
+        return {"pending": self.pending, "fired": self.n_fired} | {f"jitter_{k}": v for k, v in self.jitter.summary().items() if k != "count"}
+
+    def close(self) -> None:
+        '''Stop the thread, timers still pending never run'''
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+_default: Optional[TimerWheel] = None
+
+def get_default() -> TimerWheel:
+    """Wheel everything is timed on, made with the defaults unless `set_default` was called"""
+    global _default
+    if _default is None:
+        _default = TimerWheel()
+    return _default
+
+def set_default(wheel: Optional[TimerWheel]) -> None:
+    global _default
+    _default = wheel
+
+def make_wheel(config: ConfigParser) -> TimerWheel:
+    """Make the timer wheel set up in the config, with the defaults if the section is missing
+
+    Args:
+        config (ConfigParser): parsed config.ini
+
+    Returns:
+        TimerWheel: wheel to pass to `set_default`
+    """
+    section = config["timers"] if config.has_section("timers") else {}
+    wheel = TimerWheel(float(section.get("TickMilliseconds", 1)) / 1000, float(section.get("SpinMicroseconds", 0)) / 1e6)
+    logging.debug(f"Timers tick every {wheel.tick * 1000:g}ms, spinning for the last {wheel.spin * 1e6:g}us")
+    return wheel
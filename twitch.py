@@ -1,36 +1,96 @@
 import logging
 
-import socket, re, random, time
+import socket, random, time, heapq
 
-from dataclasses import dataclass
+from collections import Counter, deque
+from dataclasses import dataclass, field
 from enum        import Enum, auto, unique
-from typing      import Tuple
+from typing      import Callable, Iterable, Iterator, Optional, Tuple
+
+import latency
 
 @dataclass(slots=True)
 class MessageBuilder:
-    '''Dataclass to hold a raw incoming bytes and output complete packets defined by the regex pattern'''
+    '''Dataclass to hold a raw incoming bytes and output complete packets, each ending in \\r\\n'''
     '''Basically a way of assembling partial packets incrementally and knowing when a complete packet has been assembled'''
-    parser: re.Pattern[bytes]
-    buffer: bytes = b''
+    '''Bytes live in a preallocated bytearray which is filled in place (see `writable`) and only compacted once the tail is full'''
+    capacity: int       = 65536
+    data:     bytearray = field(init=False, repr=False)
+    start:    int       = field(init=False, default=0) # First byte not yet handed out as a frame
+    end:      int       = field(init=False, default=0) # One past the last byte written
+    scanned:  int       = field(init=False, default=0) # Bytes before here are known not to start a terminator
+
+    def __post_init__(self):
+        self.data = bytearray(self.capacity)
+
+    @property
+    def buffer(self) -> memoryview:
+        '''View of the bytes received but not yet returned as a frame'''
+        return memoryview(self.data)[self.start:self.end]
+
+    def writable(self, size: int) -> memoryview:
+        """Get a view of at least `size` free bytes at the end of the buffer, e.g. for `socket.recv_into`
+
+        Call `commit` afterwards with the number of bytes actually written.
+
+        Args:
+            size (int): number of bytes required
+
+        Returns:
+            memoryview: view of exactly `size` writable bytes
+        """
+        if self.end + size > len(self.data):
+            pending = self.end - self.start
+            if pending + size > len(self.data):
+                grown = bytearray(max(2 * len(self.data), pending + size))
+                grown[:pending] = self.data[self.start:self.end]
+                self.data = grown
+            elif pending:
+                self.data[:pending] = self.data[self.start:self.end]
+            self.scanned -= self.start
+            self.start, self.end = 0, pending
+        return memoryview(self.data)[self.end:self.end + size]
+
+    def commit(self, nbytes: int) -> None:
+        self.end += nbytes
 
     def append(self, new_data: bytes):
-        self.buffer += new_data
+        self.writable(len(new_data))[:] = new_data
+        self.commit(len(new_data))
+
+    def frames(self) -> Iterator[memoryview]:
+        """Yield a view of each complete frame, without the \\r\\n, scanning only bytes that arrived since the last call
+
+        The views are only valid until the next call to `writable` or `append`.
+
+        Yields:
+            Iterator[memoryview]: complete frames in arrival order
+        """
+        view = memoryview(self.data)
+        while (idx := self.data.find(b"\r\n", self.scanned, self.end)) != -1:
+            frame = view[self.start:idx]
+            self.start = self.scanned = idx + 2
+            yield frame
+        # A lone \r at the end may be the first half of a terminator
+        self.scanned = max(self.start, self.end - 1)
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
 
     def clear(self):
-        self.buffer = b''
+        self.start = self.end = self.scanned = 0
 
     def get_and_clear(self):
-        ret = self.buffer
+        ret = bytes(self.buffer)
         self.clear()
         return ret
 
 def MessageBuilderDefault() -> MessageBuilder:
-    """Default message builder and regex pattern match from the orignal author
+    """Default message builder
 
     Returns:
         MessageBuilder
     """
-    return MessageBuilder(re.compile(b'^(?::(?:([^ !\r\n]+)![^ \r\n]*|[^ \r\n]*) )?([^ \r\n]+)(?: ([^:\r\n]*))?(?: :([^\r\n]*))?\r\n', re.MULTILINE))
+    return MessageBuilder()
 
 @unique
 class TwitchMessageEnum(Enum):
@@ -48,16 +108,35 @@ class TwitchMessageEnum(Enum):
     USERSTATE       = auto()
     ROOMSTATE       = auto()
     RECONNECT       = auto()
+    PONG            = auto() # Answer to our own PING, see twitch_async.AsyncTwitchConnection's watchdog
     NUMERIC         = auto() # All numerics lumped in here.  Extend if required
 
+_COMMANDS: dict[str, TwitchMessageEnum] = dict(TwitchMessageEnum.__members__) # __members__ builds a new proxy on every access
+
 class TwitchIrc:
     '''Definition of the Twitch IRC server'''
     url:  str = "irc.chat.twitch.tv"
     port: int = 6667
 
+    def __init__(self, url: str = None, port: int = None) -> None:
+        """Optionally point this instance somewhere else, e.g. at local_irc_server.py
+
+        Args:
+            url (str, optional): server address. Defaults to None which uses the class default.
+            port (int, optional): server port. Defaults to None which uses the class default.
+        """
+        if url is not None:
+            self.url = url
+        if port is not None:
+            self.port = port
+
+    def url_port(self) -> tuple[str, int]:
+        return (self.url, self.port)
+
     @classmethod
-    def url_port(cls) -> tuple[str, int]:
-        return (cls.url, cls.port)
+    def set_default_server(cls, url: str, port: int) -> None:
+        '''Point every instance that wasn't given its own address somewhere else'''
+        cls.url, cls.port = url, port
 
     @staticmethod
     def login_message(username: str, password: str) -> bytes:
@@ -93,54 +172,183 @@ class TwitchIrc:
         """
         return b'PONG :tmi.twitch.tv\r\n'
 
+    @staticmethod
+    def ping_message() -> bytes:
+        """Make a Twitch IRC ping message, the server answers with a PONG
+
+        Returns:
+            bytes: bytestring of the ping message to be sent to the socket
+        """
+        return b'PING :tmi.twitch.tv\r\n'
+
+    @staticmethod
+    def cap_req_message(capabilities: tuple[str, ...] = ("twitch.tv/tags",)) -> bytes:
+        """Make a Twitch IRC capability request, e.g. for IRCv3 tags on every message
+
+        Args:
+            capabilities (tuple[str, ...], optional): capabilities to request. Defaults to ("twitch.tv/tags",).
+
+        Returns:
+            bytes: bytestring of the capability request to be sent to the socket
+        """
+        return ("CAP REQ :%s\r\n" % " ".join(capabilities)).encode()
+
+    TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+    @classmethod
+    def unescape_tag_value(cls, value: str) -> str:
+        if "\\" not in value:
+            return value
+        out, chars = [], iter(value)
+        for char in chars:
+            if char == "\\":
+                escaped = next(chars, "")
+                out.append(cls.TAG_ESCAPES.get(escaped, escaped))
+            else:
+                out.append(char)
+        return "".join(out)
+
     @classmethod
-    def split_command_and_packet(cls, packet: bytes) -> tuple[TwitchMessageEnum, bytes]:
+    def parse_tags(cls, raw: str) -> dict[str, str]:
+        """Parse the IRCv3 tags of a message, without the leading @
+
+        Args:
+            raw (str): tags, e.g. "badges=moderator/1;mod=1;user-id=1234"
+
+        Returns:
+            dict[str, str]: tag names to unescaped values
+        """
+        tags = dict(tag.partition("=")[::2] for tag in raw.split(";"))
+        if "\\" in raw:
+            tags = {k: cls.unescape_tag_value(v) for k, v in tags.items()}
+        return tags
+
+    @classmethod
+    def split_command_and_packet(cls, packet: bytes) -> tuple[str, TwitchMessageEnum, str]:
         """Take some bytes and try to split them into the command:payload format of the IRC Server
 
         Args:
             packet (bytes): complete packet in bytes to parse
 
         Returns:
-            tuple[TwitchMessageEnum, bytes]: Tuple of the message type and the rest of the message as bytes
+            tuple[str, TwitchMessageEnum, str]: Tuple of the username, message type and the rest of the message, all None on failure
         """
-        logging.debug("Splitting: %s", packet)
-        ret_fail = (None, None, None)
-        if not packet or 0 == len(packet):
-            return ret_fail
-        username = b''
-        cmd, payload = packet.split(b' ', maxsplit=1)
-        if cmd.endswith(b'.tmi.twitch.tv'):
-            # Handle stupid case where URL comes first not the command
-            username = cmd.split(b'.tmi.twitch.tv', maxsplit=1)[0]
-            try:
-                username = username.split(b'@', maxsplit=1)[1]
-            except IndexError:
-                pass
-            cmd, payload = payload.split(b' ', maxsplit=1)
-        try:
-            return (username.decode("utf-8"), TwitchMessageEnum[cmd.decode("utf-8")], payload.decode("utf-8"))
-        except KeyError:
-            match cmd:
-                case ["421" | "001" | "002" | "003" | "004" | "353" | "366" | "372" | "375" | "376"]:
-                    return (username.decode("utf-8"), TwitchMessageEnum.NUMERIC, payload.decode("utf-8"))
-                case _:
-                    return ret_fail
+        msg = cls.Message.from_bytes(packet)
+        return (msg.username, msg.id, msg.payload)
 
     @dataclass(slots=True)
     class Message:
         '''Container for a Twitch IRC message'''
         username:   str
         id:         TwitchMessageEnum
-        payload:    str
+        payload:    str                           # Everything after the command, e.g. "#channel :chat text"
+        prefix:     str                   = ""    # e.g. "nick!nick@nick.tmi.twitch.tv"
+        command:    str                   = ""    # e.g. "PRIVMSG" or "001"
+        params:     tuple[str, ...]       = ()    # Middle parameters, e.g. ("#channel",)
+        trailing:   Optional[str]         = None  # Last parameter after " :", e.g. the chat text
+        tags:       Optional[dict[str, str]] = None # IRCv3 tags, only sent after a CAP REQ for twitch.tv/tags
+        received_at: Optional[float]      = None  # latency.now() when its bytes arrived, for latency tracing
+        repeats:    int                   = 1     # Copies of this line it stands for, 0 once taken, see spam.SpamCollapser
 
         @classmethod
-        def from_bytes(cls, data: bytes):
-            return cls(*TwitchIrc.split_command_and_packet(data))
+        def from_bytes(cls, data: bytes, parse_tags: bool = True):
+            """Parse one complete packet, without its \\r\\n, in a single pass
+
+            Args:
+                data (bytes): packet, may be any bytes-like object such as a memoryview
+                parse_tags (bool, optional): parse IRCv3 tags into a dict, else they are skipped. Defaults to True.
+
+            Returns:
+                TwitchIrc.Message: parsed message, with every field None if it could not be parsed or is an unknown type
+            """
+            if not data:
+                return cls(None, None, None)
+            # The only decode, bytes.decode is quicker than str() but views need the latter
+            line = data.decode("utf-8", "replace") if type(data) is bytes else str(data, "utf-8", "replace")
+            tags = None
+            if line[0] == "@":
+                raw_tags, _, line = line.partition(" ")
+                if parse_tags:
+                    tags = TwitchIrc.parse_tags(raw_tags[1:])
+            prefix = ""
+            if line and line[0] == ":":
+                prefix, _, line = line.partition(" ")
+                prefix = prefix[1:]
+            command, _, payload = line.partition(" ")
+
+            id = _COMMANDS.get(command)
+            if id is None:
+                if not command.isdigit():
+                    return cls(None, None, None)
+                id = TwitchMessageEnum.NUMERIC
+
+            if payload[:1] == ":":
+                params, trailing = (), payload[1:]
+            else:
+                middle, sep, trailing = payload.partition(" :")
+                params = tuple(middle.split())
+                trailing = trailing if sep else None
+
+            username, sep, _ = prefix.partition("!")
+            return cls(username if sep else "", id, payload, prefix, command, params, trailing, tags)
 
         def payload_as_tuple(self) -> tuple[str, str]:
+            if self.params and self.trailing is not None:
+                return (self.params[0].lstrip('#'), self.trailing.strip())
             channel, message = self.payload.split(':', maxsplit=1)
             return (channel.rstrip().lstrip('#'), message.lstrip().rstrip())
 
+        def take_repeats(self) -> int:
+            '''Copies of this line it stands for, after which any more copies go on as a new message'''
+            repeats, self.repeats = self.repeats, 0
+            return repeats
+
+        def tag(self, name: str, default: str = None) -> Optional[str]:
+            return self.tags.get(name, default) if self.tags else default
+
+        @property
+        def user_id(self) -> Optional[str]:
+            return self.tag("user-id")
+
+        @property
+        def display_name(self) -> str:
+            return self.tag("display-name") or self.username
+
+        @property
+        def badges(self) -> dict[str, str]:
+            '''Badge names to versions, e.g. {"subscriber": "12"}'''
+            raw = self.tag("badges")
+            return dict(badge.partition("/")[::2] for badge in raw.split(",")) if raw else {}
+
+        @property
+        def is_mod(self) -> bool:
+            return self.tag("mod") == "1" or "broadcaster" in self.badges
+
+        @property
+        def is_subscriber(self) -> bool:
+            return self.tag("subscriber") == "1"
+
+@dataclass(slots=True)
+class Backoff:
+    """Jittered exponential backoff between attempts to connect
+
+    Each delay is picked at random between zero and `base` doubled for every failure so far, up to `cap`,
+    so clients dropped at the same moment don't all come back at the same moment.
+    """
+    base:     float = 1.0
+    cap:      float = 60.0
+    failures: int   = field(init=False, default=0)
+
+    def next(self) -> float:
+        '''Seconds to wait before the next attempt'''
+        delay = random.uniform(0, min(self.cap, self.base * 2 ** min(self.failures, 32)))
+        self.failures += 1
+        return delay
+
+    def reset(self) -> None:
+        '''Connected, so start again from `base`'''
+        self.failures = 0
+
 @dataclass(slots=True)
 class TwitchConnection:
     """Create a connection to Twith IRC and login"""
@@ -148,7 +356,9 @@ class TwitchConnection:
     sock:         socket.socket = None
     last_attempt: float         = None # time.time()
     timeout:      float         = 1.0 #1.0 / 60.0
-    twitchIrc                   = TwitchIrc()
+    request_tags: bool          = False # Ask for IRCv3 tags (user-id, badges, mod, etc.) on every message
+    tee:          Optional[Callable[[bytes], None]] = None # Also given every chunk of raw bytes received, e.g. replay.CaptureWriter.write
+    twitchIrc:    TwitchIrc     = field(default_factory=TwitchIrc)
 
     def is_connected(self) -> bool:
         return True if self.sock else False
@@ -160,21 +370,26 @@ class TwitchConnection:
             bool: true if connected else false or exception
         """
         if not self.is_connected():
-            for _ in range(5):
+            backoff = Backoff(0.05, 1.0)
+            for attempt in range(5):
+                if attempt:
+                    time.sleep(backoff.next())
                 try:
                     self.last_attempt = time.time()
                     addr = self.twitchIrc.url_port()
                     logging.debug("Creating socket to %s", addr)
                     self.sock = socket.create_connection(addr, self.timeout)
                     break
-                except socket.timeout:
-                    pass
+                except OSError as e: # socket.timeout included
+                    logging.debug("Connection attempt failed: %s", e)
 
             if not self.is_connected():
                 return False
 
             logging.debug("Logging into twitch as %s", self.username)
             self.send(self.twitchIrc.login_message(self.username, "asdf"))
+            if self.request_tags:
+                self.send(self.twitchIrc.cap_req_message())
             # todo parse the server response here
         return True
 
@@ -185,12 +400,32 @@ class TwitchConnection:
             len (int, optional): Max number of bytes to get. Defaults to 4096.
 
         Returns:
-            bytes: _description_
+            bytes: bytes received, empty if the socket was closed or None on timeout
+        """
+        try:
+            data = self.sock.recv(len)
+        except socket.timeout:
+            return None
+        if self.tee and data:
+            self.tee(data)
+        return data
+
+    def receive_into(self, buffer: memoryview) -> Optional[int]:
+        """Receive any bytes waiting in the socket directly into a caller owned buffer
+
+        Args:
+            buffer (memoryview): where to write, at most len(buffer) bytes are received
+
+        Returns:
+            Optional[int]: number of bytes written, 0 if the socket was closed or None on timeout
         """
         try:
-            return self.sock.recv(4096)
+            n = self.sock.recv_into(buffer)
         except socket.timeout:
             return None
+        if self.tee and n:
+            self.tee(buffer[:n])
+        return n
 
     def send(self, data: bytes) -> None:
         """Push raw bytes out of the socket
@@ -220,13 +455,13 @@ class TwitchConnection:
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
-        pass
+        self.disconnect()
 
 class SockHandler:
     '''Wrapper to create the socket and login to twitch on construction'''
-    def __init__(self) -> None:
+    def __init__(self, connection: TwitchConnection = None) -> None:
         logging.debug("Init SockHandler")
-        self.sock = TwitchConnection()
+        self.sock = connection if connection else TwitchConnection()
         if not self.sock.connect():
             raise socket.timeout
     def __del__(self) -> None:
@@ -245,56 +480,204 @@ class BufferedSocket:
     """Container around a Twitch connection, a buffer and a message splitter
     """
     # todo I feel the twitch login should be after this layer, not before
-    def __init__(self, splitter: MessageSplitter = None) -> None:
-        self.sock     = SockHandler()
-        self.buffer   = MessageBuilderDefault()
-        self.splitter = splitter if splitter else MessageSplitter()
+    def __init__(self, chunk_size: int = 4096, connection: TwitchConnection = None) -> None:
+        self.sock       = SockHandler(connection)
+        self.buffer     = MessageBuilderDefault()
+        self.chunk_size = chunk_size
 
     def receive(self) -> list[bytes]:
-        while (buf := self.sock.sock.receive()):
-            self.buffer.append(buf)
-        full_packets, rest = self.splitter(self.buffer.buffer)
-        self.buffer.clear()
-        if rest:
-            self.buffer.append(rest)
-        return full_packets
+        while (n := self.sock.sock.receive_into(self.buffer.writable(self.chunk_size))):
+            self.buffer.commit(n)
+        return [bytes(frame) for frame in self.buffer.frames()]
 
     def send(self, data: bytes) -> None:
         self.sock.sock.send(data)
 
 class IrcParser:
-    def parse(self, packets: list[bytes]) -> list[TwitchIrc.Message]:
-        """Take a list of complete packets and parse them into a list of IRC message containers
+    def __init__(self, parse_tags: bool = True) -> None:
+        self.parse_tags = parse_tags
+
+    def parse(self, packets: Iterable[bytes], received_at: float = None) -> list[TwitchIrc.Message]:
+        """Take complete packets and parse them into a list of IRC message containers
 
         Args:
-            packets (list[bytes]): list of complete packets in binary
+            packets (Iterable[bytes]): complete packets in binary, may be memoryviews
+            received_at (float, optional): latency.now() when the packets arrived, stamped on every message. Defaults to None.
 
         Returns:
             list[TwitchIrc.Message]: list of IRC messages
         """
-        parsed = [TwitchIrc.Message.from_bytes(x) for x in packets if len(x)]
+        parsed = [TwitchIrc.Message.from_bytes(x, self.parse_tags) for x in packets if len(x)]
+        if received_at is not None:
+            for x in parsed:
+                x.received_at = received_at
         return [x for x in parsed if x.id is not None]
 
+@unique
+class OverloadPolicy(Enum):
+    '''What a full MessageStore does with more messages'''
+    DROP_OLDEST   = "drop-oldest"   # Evict the oldest message to make room, keeps latency low
+    DROP_NEWEST   = "drop-newest"   # Refuse the new message
+    SAMPLE        = "sample"        # Keep a uniform random sample of everything that arrived while full
+    COMMANDS_ONLY = "commands-only" # Never store chat that isn't a command, then evict the oldest
+
+class MessageStore:
+    """Received messages indexed by type, each type in arrival order
+
+    Getting, peeking or draining one type is O(k) in the number of messages of that type.
+
+    Holds at most `max_messages`, what happens beyond that is chosen by `policy`.  PING, JOIN and RECONNECT
+    are never dropped.  Dropped messages are counted by type in `dropped`.
+    """
+    NEVER_DROPPED = frozenset({TwitchMessageEnum.PING, TwitchMessageEnum.JOIN, TwitchMessageEnum.RECONNECT})
+
+    def __init__(self, max_messages: int = None, policy: OverloadPolicy = OverloadPolicy.DROP_OLDEST,
+                 is_command: Callable[[TwitchIrc.Message], bool] = None) -> None:
+        """
+        Args:
+            max_messages (int, optional): capacity. Defaults to None which is unbounded.
+            policy (OverloadPolicy, optional): what to do when full. Defaults to OverloadPolicy.DROP_OLDEST.
+            is_command (Callable[[TwitchIrc.Message], bool], optional): whether a PRIVMSG is a chat command, for OverloadPolicy.COMMANDS_ONLY. Defaults to None.
+        """
+        self.queues: dict[TwitchMessageEnum, deque[tuple[int, TwitchIrc.Message]]] = {which: deque() for which in TwitchMessageEnum}
+        self.n_received = 0 # Also the arrival sequence number, so get_all can restore the overall order
+        self.size = 0
+        self.max_messages = max_messages
+        self.policy = policy
+        self.is_command = is_command
+        self.dropped: Counter[TwitchMessageEnum] = Counter()
+        self.n_seen_while_full = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, msg: TwitchIrc.Message) -> bool:
+        """Store a message, or drop it or another according to the overload policy
+
+        Returns:
+            bool: true if this message was stored
+        """
+        if (self.policy == OverloadPolicy.COMMANDS_ONLY and self.is_command and msg.id == TwitchMessageEnum.PRIVMSG
+                and not self.is_command(msg)):
+            self.dropped[msg.id] += 1
+            return False
+
+        if self.max_messages is not None and self.size >= self.max_messages and msg.id not in self.NEVER_DROPPED:
+            if not self._make_room(msg):
+                self.dropped[msg.id] += 1
+                return False
+        elif self.n_seen_while_full and self.size < self.max_messages:
+            logging.info("Message buffer recovered, dropped so far: %s", dict(self.dropped))
+            self.n_seen_while_full = 0
+
+        self.queues[msg.id].append((self.n_received, msg))
+        self.n_received += 1
+        self.size += 1
+        return True
+
+    def _make_room(self, msg: TwitchIrc.Message) -> bool:
+        if not self.n_seen_while_full:
+            logging.warning("Message buffer full at %d messages, shedding with policy %s", self.max_messages, self.policy.value)
+        self.n_seen_while_full += 1
+        match self.policy:
+            case OverloadPolicy.DROP_NEWEST:
+                return False
+            case OverloadPolicy.SAMPLE:
+                # Reservoir sampling; the n'th message since filling up is kept with probability capacity / n
+                if random.random() * (self.max_messages + self.n_seen_while_full) >= self.max_messages:
+                    return False
+                q = self.queues[TwitchMessageEnum.PRIVMSG]
+                if not q:
+                    return self._drop_oldest()
+                victim = random.randrange(len(q))
+                del q[victim]
+                self.size -= 1
+                self.dropped[TwitchMessageEnum.PRIVMSG] += 1
+                return True
+            case _:
+                return self._drop_oldest()
+
+    def _drop_oldest(self) -> bool:
+        heads = [q for which, q in self.queues.items() if q and which not in self.NEVER_DROPPED]
+        if not heads:
+            return False
+        _, victim = min(heads, key=lambda q: q[0][0]).popleft()
+        self.size -= 1
+        self.dropped[victim.id] += 1
+        return True
+
+    def count(self, which: TwitchMessageEnum) -> int:
+        return len(self.queues[which])
+
+    def peek(self, which: TwitchMessageEnum) -> list[TwitchIrc.Message]:
+        return [msg for _, msg in self.queues[which]]
+
+    def get(self, which: TwitchMessageEnum) -> list[TwitchIrc.Message]:
+        q = self.queues[which]
+        ret = [msg for _, msg in q]
+        self.size -= len(q)
+        q.clear()
+        return ret
+
+    def pop_oldest(self) -> Optional[TwitchIrc.Message]:
+        """Take the single oldest message of any type, or None if empty"""
+        heads = [q for q in self.queues.values() if q]
+        if not heads:
+            return None
+        self.size -= 1
+        return min(heads, key=lambda q: q[0][0]).popleft()[1]
+
+    def peek_all(self) -> list[TwitchIrc.Message]:
+        return [msg for _, msg in heapq.merge(*(q for q in self.queues.values() if q), key=lambda x: x[0])]
+
+    def get_all(self) -> list[TwitchIrc.Message]:
+        ret = self.peek_all()
+        self.remove_all()
+        return ret
+
+    def remove_all(self, which: TwitchMessageEnum = None) -> None:
+        if which:
+            self.size -= len(self.queues[which])
+            self.queues[which].clear()
+        else:
+            for q in self.queues.values():
+                q.clear()
+            self.size = 0
+
 class IrcConnection:
     """Queue of messages with interface to get more from the socket
+
+    The socket is only read by `poll`, once per call to `run`.  Getting and peeking only look at what has already arrived.
     """
-    def __init__(self, parser: IrcParser = None, incomingSocket: BufferedSocket = None):
+    def __init__(self, parser: IrcParser = None, incomingSocket: BufferedSocket = None, store: MessageStore = None):
         self.parser = parser if parser else IrcParser()
         self.incomingSocket = incomingSocket if incomingSocket else BufferedSocket()
-        self.buf = []
-        self.n_max_messages = 50
+        self.store = store if store is not None else MessageStore(50)
         self.last_ping = None
         self.joined_at = None
 
     def run(self) -> None:
-        if self.peek(TwitchMessageEnum.PING):
+        self.poll()
+        if self.store.get(TwitchMessageEnum.PING):
             self.incomingSocket.send(TwitchIrc.pong_message())
-            self.remove_all(TwitchMessageEnum.PING)
             self.last_ping = time.time()
-        if self.peek(TwitchMessageEnum.JOIN):
-            self.remove_all(TwitchMessageEnum.JOIN)
+        if self.store.get(TwitchMessageEnum.JOIN):
             self.joined_at = time.time()
 
+    def poll(self) -> int:
+        """Read the socket once and index everything that has arrived
+
+        Returns:
+            int: number of messages received
+        """
+        packets = self.incomingSocket.receive()
+        received_at = latency.now()
+        msgs = self.parser.parse(packets, received_at)
+        latency.record("parse", latency.now() - received_at)
+        for msg in msgs:
+            self.store.append(msg)
+        return len(msgs)
+
     def get(self, which: TwitchMessageEnum = None) -> list[TwitchIrc.Message]:
         """Get all messages matching an IRC ID and delete them from the internal buffer.
 
@@ -304,12 +687,7 @@ class IrcConnection:
         Returns:
             list[TwitchIrc.Message]: list of all matching messages received
         """
-        if which:
-            ret = [x for x in self.buf if x.id == which]
-            self.remove_all(which)
-            return ret
-        else:
-            return self.get()
+        return self.store.get(which) if which else self.store.get_all()
 
     def get_all(self) -> list[TwitchIrc.Message]:
         """Get all messages.  Deletes all contained messages from the internal buffer.
@@ -317,9 +695,7 @@ class IrcConnection:
         Returns:
             list[TwitchIrc.Message]: list of all received messages
         """
-        ret = self.peek_all()
-        self.remove_all()
-        return ret
+        return self.store.get_all()
 
     def peek(self, which: TwitchMessageEnum = None) -> list[TwitchIrc.Message]:
         """Get a copy of all messages matching an IRC ID.  Does not delete any messages from the internal buffer.
@@ -330,7 +706,7 @@ class IrcConnection:
         Returns:
             list[TwitchIrc.Message]: list of all matching messages received
         """
-        return [x for x in self.peek_all() if x.id == which]
+        return self.store.peek(which) if which else self.store.peek_all()
 
     def peek_all(self) -> list[TwitchIrc.Message]:
         """Get a copy of all messages.  Does not delete any messages from the internal buffer.
@@ -338,8 +714,7 @@ class IrcConnection:
         Returns:
             list[TwitchIrc.Message]: list of all received messages
         """
-        self._get_all()
-        return self.buf
+        return self.store.peek_all()
 
     def remove_all(self, which: TwitchMessageEnum = None):
         """Delete messages from the internal buffer
@@ -347,24 +722,15 @@ class IrcConnection:
         Args:
             which (TwitchMessageEnum, optional): Message ID's to delete, or ALL if None. Defaults to None.
         """
-        if which:
-            self.buf = [x for x in self.buf if x.id is not which]
-        else:
-            self.buf = []
-
-    def _get_all(self) -> None:
-        self.buf += self.parser.parse(self.incomingSocket.receive())
-        if len(self.buf) > self.n_max_messages:
-            self.buf = self.buf[:-self.n_max_messages] # TODO janky delete the old ones
-            logging.debug(self.buf)
+        self.store.remove_all(which)
 
 class ChannelConnection(IrcConnection):
     """Connection to a Twitch channel's chat
 
     Note; call the run() method periodically so that pingpongs get returned so Twitch doesn't kick us
     """
-    def __init__(self, channel: str, parser: IrcParser = None, incomingSocket: BufferedSocket = None):
-        super().__init__(parser, incomingSocket)
+    def __init__(self, channel: str, parser: IrcParser = None, incomingSocket: BufferedSocket = None, store: MessageStore = None):
+        super().__init__(parser, incomingSocket, store)
         self.channel = channel
         self.connected = False;
 
@@ -378,10 +744,11 @@ class ChannelConnection(IrcConnection):
         self.incomingSocket.send(TwitchIrc.join_message(self.channel))
         waitforsecs = 3
         for i in range(waitforsecs):
-            for x in self.get_all():
-                if x.id == TwitchMessageEnum.JOIN:
-                    self.connected = True
-                    return True
+            self.poll()
+            if self.get(TwitchMessageEnum.JOIN):
+                self.joined_at = time.time()
+                self.connected = True
+                return True
             time.sleep(0.5)
 
         raise socket.timeout
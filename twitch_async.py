@@ -0,0 +1,621 @@
+import logging
+
+import asyncio, math, random, socket, time
+
+from collections import deque
+from typing import AsyncIterator, Callable, Iterable, Optional
+
+import latency
+import metrics
+import spam
+from twitch import Backoff, TwitchIrc, TwitchMessageEnum, MessageBuilderDefault, MessageStore, IrcParser
+
+_PARSED = {which: f"messages_parsed_{which.name.lower()}" for which in TwitchMessageEnum} # Counter names made once, not per message
+
+class TwitchIrcProtocol(asyncio.BufferedProtocol):
+    """asyncio protocol speaking the Twitch IRC dialect
+
+    The transport reads straight into a `twitch.MessageBuilder`, frames are parsed as soon as their
+    terminating \\r\\n arrives and handed to `on_message`.
+    PINGs are answered inline so the consumer never has to poll for them, and PONGs to our own PINGs are
+    used to time the round trip.
+    """
+    def __init__(self, on_message: Callable[[TwitchIrc.Message], None], on_connection_lost: Callable[[Optional[Exception]], None] = None,
+                 parser: IrcParser = None, chunk_size: int = 4096, tee: Callable[[bytes], None] = None) -> None:
+        self.on_message = on_message
+        self.on_connection_lost = on_connection_lost
+        self.parser     = parser if parser else IrcParser()
+        self.buffer     = MessageBuilderDefault()
+        self.chunk_size = chunk_size
+        self.tee        = tee
+        self.transport: Optional[asyncio.Transport] = None
+        self.last_ping: Optional[float] = None
+        self.joined_at: Optional[float] = None
+        self.last_received = latency.now() # When anything last arrived, latency.now()
+        self.ping_sent: Optional[float] = None # When our last PING went, latency.now()...
+        self.rtt:       Optional[float] = None # ...and seconds until its PONG came back
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        logging.debug("Protocol connected to %s", transport.get_extra_info("peername"))
+        self.transport = transport
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self.buffer.writable(self.chunk_size)
+
+    def buffer_updated(self, nbytes: int) -> None:
+        received_at = self.last_received = latency.now()
+        if self.tee:
+            self.tee(self.buffer.writable(nbytes)[:nbytes])
+        self.buffer.commit(nbytes)
+        frames = list(self.buffer.frames())
+        msgs = self.parser.parse(frames, received_at) # Decoded straight from the frame views
+        latency.record("parse", latency.now() - received_at)
+        metrics.inc("bytes_received", nbytes)
+        metrics.inc("frames_received", len(frames))
+        if len(msgs) < len(frames):
+            metrics.inc("messages_parsed_unknown", len(frames) - len(msgs))
+        for msg in msgs:
+            metrics.inc(_PARSED[msg.id])
+            self.message_received(msg)
+
+    def message_received(self, msg: TwitchIrc.Message) -> None:
+        match msg.id:
+            case TwitchMessageEnum.PING:
+                self.send(TwitchIrc.pong_message())
+                self.last_ping = time.time()
+            case TwitchMessageEnum.PONG:
+                if self.ping_sent is not None:
+                    self.rtt = msg.received_at - self.ping_sent
+                    self.ping_sent = None
+            case TwitchMessageEnum.JOIN:
+                self.joined_at = time.time()
+                self.on_message(msg)
+            case _:
+                self.on_message(msg)
+
+    def send(self, data: bytes) -> None:
+        logging.debug("Sending: %s", data)
+        if self.transport and not self.transport.is_closing():
+            self.transport.write(data)
+
+    def send_ping(self) -> None:
+        self.ping_sent = latency.now()
+        self.send(TwitchIrc.ping_message())
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        logging.debug("Protocol connection lost: %s", exc)
+        self.transport = None
+        if self.on_connection_lost:
+            self.on_connection_lost(exc)
+
+class AsyncTwitchConnection:
+    """asyncio equivalent of `twitch.TwitchConnection`, logs in and stores every parsed message
+
+    Messages wait in a `twitch.MessageStore`, so a consumer that falls behind is subject to its overload policy
+    rather than building up an unbounded backlog.
+
+    With `ping_interval` set a watchdog PINGs the server whenever it has been quiet that long, and drops the
+    connection if nothing comes back within `ping_timeout`, so a dead socket is noticed in seconds rather than
+    whenever the OS gives up on it.  `on_lost` is told when that happens, when the connection is lost any other
+    way, and when the server sends RECONNECT.
+    """
+    def __init__(self, username: str = None, timeout: float = 5.0, twitchIrc: TwitchIrc = None, chunk_size: int = 4096,
+                 request_tags: bool = False, store: MessageStore = None, tee: Callable[[bytes], None] = None,
+                 has_messages: asyncio.Event = None, collapser: spam.SpamCollapser = None,
+                 ping_interval: float = None, ping_timeout: float = 10.0) -> None:
+        self.username     = username if username else "justinfan%i" % random.randint(10000, 99999)
+        self.timeout      = timeout
+        self.twitchIrc    = twitchIrc if twitchIrc else TwitchIrc()
+        self.chunk_size   = chunk_size
+        self.request_tags = request_tags
+        self.store        = store if store is not None else MessageStore(50)
+        self.tee          = tee
+        self.shared_has_messages = has_messages # Set when several connections feed one store, see AsyncChannelPool
+        self.collapser    = collapser # Drops repeated chat lines before they take up room in the store
+        self.seen: Optional[spam.TimeBuckets] = None # Ids of chat delivered by any connection sharing it, to drop the same line from another
+        self.ping_interval = ping_interval # Seconds of quiet before the watchdog PINGs, None for no watchdog
+        self.ping_timeout = ping_timeout
+        self.on_lost: Optional[Callable[["AsyncTwitchConnection", str], None]] = None # Given this and "lost", "timeout" or "reconnect"
+        self.protocol: Optional[TwitchIrcProtocol] = None
+        self.has_messages: asyncio.Event = None
+        self.lost         = False
+        self.lost_reason  = "lost"
+        self.watchdog: Optional[asyncio.Task] = None
+
+    def is_connected(self) -> bool:
+        return self.protocol is not None and self.protocol.transport is not None
+
+    def seconds_since_ping(self) -> Optional[float]:
+        '''Seconds since the server last sent a PING, None if it has not yet'''
+        if self.protocol is None or self.protocol.last_ping is None:
+            return None
+        return time.time() - self.protocol.last_ping
+
+    async def connect(self) -> bool:
+        """Open a connection and send the login message to the Twitch IRC
+
+        Returns:
+            bool: true if connected else false
+        """
+        if self.is_connected():
+            return True
+
+        loop = asyncio.get_running_loop()
+        self.has_messages = self.shared_has_messages if self.shared_has_messages else asyncio.Event()
+        self.lost, self.lost_reason = False, "lost"
+        backoff = Backoff(0.05, 1.0)
+        for attempt in range(5):
+            if attempt:
+                await asyncio.sleep(backoff.next())
+            try:
+                addr = self.twitchIrc.url_port()
+                logging.debug("Creating connection to %s", addr)
+                _, self.protocol = await asyncio.wait_for(
+                    loop.create_connection(lambda: TwitchIrcProtocol(self._message_received, self._connection_lost, chunk_size=self.chunk_size, tee=self.tee), *addr),
+                    self.timeout
+                )
+                break
+            except (asyncio.TimeoutError, OSError) as e:
+                logging.debug("Connection attempt failed: %s", e)
+
+        if not self.is_connected():
+            return False
+
+        logging.debug("Logging into twitch as %s", self.username)
+        self.send(self.twitchIrc.login_message(self.username, "asdf"))
+        if self.request_tags:
+            self.send(self.twitchIrc.cap_req_message())
+        if self.ping_interval:
+            self.watchdog = asyncio.create_task(self._watch(self.protocol))
+        return True
+
+    def send(self, data: bytes) -> None:
+        self.protocol.send(data)
+
+    async def _watch(self, protocol: TwitchIrcProtocol) -> None:
+        while protocol.transport is not None:
+            if (quiet := latency.now() - protocol.last_received) < self.ping_interval:
+                await asyncio.sleep(self.ping_interval - quiet)
+                continue
+            protocol.send_ping()
+            sent = protocol.ping_sent
+            await asyncio.sleep(self.ping_timeout)
+            if protocol.last_received < sent and protocol.transport is not None:
+                logging.warning("No answer to PING in %.1fs, dropping the connection", self.ping_timeout)
+                self.lost_reason = "timeout"
+                protocol.transport.abort() # Not close, which would wait to flush to a dead peer
+                return
+
+    def last_received(self) -> Optional[float]:
+        '''latency.now() when anything last arrived, None if not connected'''
+        return self.protocol.last_received if self.protocol is not None else None
+
+    async def receive(self) -> Optional[TwitchIrc.Message]:
+        """Wait for the next message from the server, in arrival order
+
+        Returns:
+            Optional[TwitchIrc.Message]: the message, or None if the connection has been lost
+        """
+        while (msg := self.store.pop_oldest()) is None:
+            if self.lost:
+                return None
+            self.has_messages.clear()
+            await self.has_messages.wait()
+        return msg
+
+    def _message_received(self, msg: TwitchIrc.Message) -> None:
+        if (self.seen is not None and msg.id == TwitchMessageEnum.PRIVMSG and (msg_id := msg.tag("id")) is not None
+                and self.seen.get_or_add(msg_id, msg, msg.received_at) is not None):
+            metrics.inc("messages_duplicated")
+            return
+        if self.collapser and self.collapser.collapse(msg):
+            return
+        if self.store.append(msg):
+            self.has_messages.set()
+        if msg.id == TwitchMessageEnum.RECONNECT and self.on_lost:
+            self.on_lost(self, "reconnect")
+
+    def _connection_lost(self, exc: Optional[Exception]) -> None:
+        self.lost = True
+        self.has_messages.set() # Wake anyone waiting in receive()
+        if self.on_lost and self.protocol is not None: # Not when disconnected on purpose
+            self.on_lost(self, self.lost_reason)
+
+    def disconnect(self) -> None:
+        if self.watchdog:
+            self.watchdog.cancel()
+            self.watchdog = None
+        if self.is_connected():
+            logging.debug("Closing connection to %s", self.twitchIrc.url_port())
+            self.protocol.transport.close()
+        self.protocol = None
+
+    async def __aenter__(self):
+        if not await self.connect():
+            raise socket.timeout
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.disconnect()
+
+class AsyncChannelConnection(AsyncTwitchConnection):
+    """asyncio equivalent of `twitch.ChannelConnection`
+
+    Iterate over it with `async for` to get chat messages as soon as they arrive.
+    """
+    def __init__(self, channel: str, **kwargs) -> None:
+        """
+        Args:
+            channel (str): channel to join
+            **kwargs: passed on to `AsyncTwitchConnection`
+        """
+        super().__init__(**kwargs)
+        self.channel   = channel
+        self.connected = False
+
+    async def connect(self) -> bool:
+        if self.connected:
+            return True
+        if not await super().connect():
+            return False
+
+        self.send(TwitchIrc.join_message(self.channel))
+        try:
+            await asyncio.wait_for(self._wait_for_join(), self.timeout)
+        except asyncio.TimeoutError:
+            raise socket.timeout
+        self.connected = True
+        return True
+
+    async def _wait_for_join(self) -> None:
+        while (msg := await self.receive()) is not None:
+            if msg.id == TwitchMessageEnum.JOIN:
+                return
+        raise ConnectionError
+
+    async def get_chat_message(self) -> Optional[TwitchIrc.Message]:
+        """Wait for the next PRIVMSG, discarding any other message types
+
+        Returns:
+            Optional[TwitchIrc.Message]: the chat message, or None if the connection has been lost
+        """
+        while (msg := await self.receive()) is not None:
+            if msg.id == TwitchMessageEnum.PRIVMSG:
+                return msg
+            logging.debug("Ignoring %s", msg)
+        return None
+
+    async def chat_messages(self) -> AsyncIterator[TwitchIrc.Message]:
+        while (msg := await self.get_chat_message()) is not None:
+            yield msg
+
+    def __aiter__(self) -> AsyncIterator[TwitchIrc.Message]:
+        return self.chat_messages()
+
+    def disconnect(self) -> None:
+        super().disconnect()
+        self.connected = False
+
+_REASONS = {"lost": "was lost", "timeout": "stopped answering PINGs", "reconnect": "was asked to reconnect"}
+
+def _describe(channels: list[str]) -> str:
+    return ", ".join("#" + channel for channel in channels)
+
+async def _wait_for_joins(connection: AsyncTwitchConnection, channels: list[str]) -> None:
+    joined = set()
+    while not joined.issuperset(channels):
+        if (msg := await connection.receive()) is None:
+            raise ConnectionError
+        if msg.id == TwitchMessageEnum.JOIN and msg.params:
+            joined.add(msg.params[0].lstrip("#"))
+
+class RecentMessages:
+    """Stands in for the `twitch.MessageStore` of a connection that is not yet feeding the pool
+
+    Chat is only kept for the last `window` seconds, so once the connection takes over whatever the one it
+    replaces missed can be carried over.  Anything else is read with `receive` as usual, e.g. to wait for the JOINs.
+    """
+    def __init__(self, window: float = 5.0, max_messages: int = 10000) -> None:
+        self.window = window
+        self.chat: deque[TwitchIrc.Message] = deque(maxlen=max_messages)
+        self.other: deque[TwitchIrc.Message] = deque(maxlen=max_messages)
+
+    def __len__(self) -> int:
+        return len(self.chat) + len(self.other)
+
+    def append(self, msg: TwitchIrc.Message) -> bool:
+        if msg.id != TwitchMessageEnum.PRIVMSG:
+            self.other.append(msg)
+            return True
+        self.chat.append(msg)
+        while self.chat[0].received_at < msg.received_at - self.window:
+            self.chat.popleft()
+        return False # Nothing to wake a reader for
+
+    def pop_oldest(self) -> Optional[TwitchIrc.Message]:
+        return self.other.popleft() if self.other else None
+
+    def since(self, t: float = None) -> list[TwitchIrc.Message]:
+        '''Chat that arrived after latency.now() was `t`, oldest first, all of it if None'''
+        return [msg for msg in self.chat if t is None or msg.received_at > t]
+
+class AsyncChannelPool:
+    """Joins many channels over a small pool of anonymous connections, read as one stream of messages
+
+    Channels are spread round robin over just enough connections to keep each under `channels_per_connection`.
+    Every connection parses into one shared `twitch.MessageStore`, so a single loop reads the chat from all
+    of them and routes each PRIVMSG by its channel, rather than one socket and one loop per channel.
+
+    With `reconnect`, a connection that is lost, stops answering PINGs or is sent RECONNECT is replaced while
+    the rest carry on, retrying with jittered exponential backoff.  With `standby` each connection also has a
+    spare already logged in and joined to the same channels, so the switch takes milliseconds rather than a
+    new connection and its JOINs.  A spare keeps its chat for as long as a dead connection can take to be
+    noticed, `ping_interval` plus `ping_timeout`, and on the switch whatever of it the old connection did not
+    deliver is carried over.  What was delivered is told by the IRCv3 `id` tag, so tags are always requested with
+    `standby`.  Without tags it falls back to when each message arrived, which can double or drop the odd line
+    at the switch, and a new connection made after the old one died can only carry over what arrived after its JOINs.
+    """
+    JOINS_PER_WINDOW = 20   # Twitch's JOIN rate limit for an unverified user...
+    JOIN_WINDOW      = 10.0 # ...per this many seconds
+
+    def __init__(self, channels: Iterable[str], channels_per_connection: int = 20, timeout: float = 5.0, store: MessageStore = None,
+                 tee: Callable[[bytes], None] = None, reconnect: bool = True, standby: bool = False, backoff: Backoff = None, **kwargs) -> None:
+        """
+        Args:
+            channels (Iterable[str]): channels to join
+            channels_per_connection (int, optional): most channels joined on any one connection. Defaults to 20.
+            timeout (float, optional): seconds to wait for connecting, and for the JOINs once they are all sent. Defaults to 5.0.
+            store (MessageStore, optional): shared by every connection. Defaults to None which makes one of 50 messages.
+            tee (Callable[[bytes], None], optional): given the raw bytes, only of the first connection as a capture can only replay one stream. Defaults to None.
+            reconnect (bool, optional): replace a connection that is lost rather than ending the stream. Defaults to True.
+            standby (bool, optional): keep a spare for each connection, joined to the same channels, to switch to straight away, turns on request_tags. Defaults to False.
+            backoff (Backoff, optional): delays between attempts to reconnect, copied for each connection replaced. Defaults to None which is 1s doubling up to 60s.
+            **kwargs: passed on to each `AsyncTwitchConnection`, e.g. twitchIrc, chunk_size, request_tags or ping_interval
+        """
+        self.channels = list(dict.fromkeys(channel.lower().lstrip("#") for channel in channels))
+        if not self.channels or channels_per_connection < 1:
+            raise ValueError("Need at least one channel and at least one channel per connection")
+        self.timeout      = timeout
+        self.store        = store if store is not None else MessageStore(50)
+        self.has_messages = asyncio.Event()
+        self.tee          = tee
+        self.reconnect    = reconnect
+        self.standby      = standby
+        self.backoff      = backoff if backoff else Backoff()
+        self.collapser    = kwargs.pop("collapser", None) # Only on connections feeding the store, or a spare would count every line twice
+        if standby:
+            kwargs["request_tags"] = True
+        self.kwargs       = kwargs
+        self.window       = (kwargs.get("ping_interval") or 0) + kwargs.get("ping_timeout", 10.0) + timeout # Seconds of chat a spare keeps
+        self.seen         = spam.TimeBuckets(self.window) if reconnect and kwargs.get("request_tags") else None
+        n_connections     = math.ceil(len(self.channels) / channels_per_connection)
+        if tee and n_connections > 1:
+            logging.warning("Only recording the raw traffic of the first of %d connections", n_connections)
+        self.connections  = [AsyncTwitchConnection(timeout=timeout, store=self.store, tee=tee if i == 0 else None, has_messages=self.has_messages,
+                                                   collapser=self.collapser, **kwargs)
+                             for i in range(n_connections)]
+        for connection in self.connections:
+            connection.on_lost = self._on_lost
+            connection.seen = self.seen
+        self.slots        = [self.channels[i::n_connections] for i in range(n_connections)] # Channels joined on each connection
+        self.assignment   = {channel: self.connections[i] for i, slot in enumerate(self.slots) for channel in slot}
+        self.spares: list[Optional[AsyncTwitchConnection]] = [None] * n_connections
+        self.replacing: set[int] = set() # Connections being replaced
+        self.tasks: set[asyncio.Task] = set()
+        self.join_times: deque[float] = deque(maxlen=self.JOINS_PER_WINDOW)
+        self.join_lock    = asyncio.Lock()
+        self.joined: set[str] = set()
+        self.pending: deque[TwitchIrc.Message] = deque() # Chat that arrived while waiting for the JOINs
+        self.connected    = False
+        self.closed       = False
+        self.n_failovers  = 0
+        self.connected_at: Optional[float] = None # latency.now() once every connection is open and has sent its login...
+        self.joined_at:    Optional[float] = None # ...and once every channel is joined
+
+    def is_connected(self) -> bool:
+        return all(connection.is_connected() for connection in self.connections)
+
+    def seconds_since_ping(self) -> Optional[float]:
+        '''Longest any connection has gone since a PING, None if none has had one yet'''
+        seconds = [s for connection in self.connections if (s := connection.seconds_since_ping()) is not None]
+        return max(seconds) if seconds else None
+
+    def ping_rtt(self) -> Optional[float]:
+        '''Slowest round trip of any connection's last PING to us, None if none has been answered yet'''
+        rtts = [connection.protocol.rtt for connection in self.connections if connection.protocol and connection.protocol.rtt is not None]
+        return max(rtts) if rtts else None
+
+    async def connect(self) -> bool:
+        """Connect every connection then JOIN each channel on the connection it is assigned to
+
+        Returns:
+            bool: true if connected, false if any connection failed
+
+        Raises:
+            socket.timeout: a channel was not joined in time
+        """
+        if self.connected:
+            return True
+        self.closed = False
+        if not all(await asyncio.gather(*(connection.connect() for connection in self.connections))):
+            self.disconnect()
+            return False
+        self.connected_at = latency.now()
+
+        for channel in self.channels:
+            await self._join_slot()
+            self.assignment[channel].send(TwitchIrc.join_message(channel))
+        try:
+            await asyncio.wait_for(self._wait_for_joins(), self.timeout)
+        except asyncio.TimeoutError:
+            logging.error("Timed out joining %s", ", ".join(sorted(set(self.channels) - self.joined)))
+            raise socket.timeout
+        self.joined_at = latency.now()
+        logging.info("Joined %d channels over %d connections", len(self.channels), len(self.connections))
+        self.connected = True
+        if self.standby:
+            for index in range(len(self.connections)):
+                self._spawn(self._refresh_spare(index))
+        return True
+
+    async def _join_slot(self) -> None:
+        '''Wait until another JOIN is allowed by Twitch's rate limit, one waiter at a time so reconnecting everything at once can't overshoot it'''
+        loop = asyncio.get_running_loop()
+        async with self.join_lock:
+            while len(self.join_times) == self.JOINS_PER_WINDOW and (wait := self.join_times[0] + self.JOIN_WINDOW - loop.time()) > 0:
+                logging.info("Waiting %.1fs for the JOIN rate limit", wait)
+                await asyncio.sleep(wait)
+            self.join_times.append(loop.time())
+
+    async def _wait_for_joins(self) -> None:
+        while not self.joined.issuperset(self.channels):
+            if (msg := await self.receive()) is None:
+                raise ConnectionError
+            if msg.id == TwitchMessageEnum.PRIVMSG:
+                self.pending.append(msg)
+
+    def _spawn(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def _on_lost(self, connection: AsyncTwitchConnection, reason: str) -> None:
+        if self.closed or not self.connected or not self.reconnect:
+            return
+        connection.on_lost = None # Once is enough, e.g. RECONNECT then the server closing the socket
+        if connection in self.spares:
+            index = self.spares.index(connection)
+            logging.info("Standby connection for %s %s, replacing it", _describe(self.slots[index]), _REASONS[reason])
+            self.spares[index] = None
+            connection.disconnect()
+            self._spawn(self._refresh_spare(index))
+        elif connection in self.connections and (index := self.connections.index(connection)) not in self.replacing:
+            logging.warning("Connection for %s %s, failing over", _describe(self.slots[index]), _REASONS[reason])
+            metrics.inc(f"failovers_{reason}")
+            self.replacing.add(index)
+            self._spawn(self._fail_over(index))
+
+    async def _fail_over(self, index: int) -> None:
+        try:
+            if (new := self.spares[index]) is not None:
+                self.spares[index] = None
+                self._spawn(self._refresh_spare(index))
+            elif (new := await self._open(index)) is None:
+                return
+            self._switch(index, new)
+        finally:
+            self.replacing.discard(index)
+
+    async def _refresh_spare(self, index: int) -> None:
+        if (spare := await self._open(index)) is not None:
+            self.spares[index] = spare
+
+    async def _open(self, index: int) -> Optional[AsyncTwitchConnection]:
+        """Open a connection joined to the same channels as connection `index`, not yet feeding the store
+
+        Retries with backoff until it succeeds or the pool is disconnected.
+
+        Returns:
+            Optional[AsyncTwitchConnection]: the new connection, None if the pool was disconnected first
+        """
+        backoff = Backoff(self.backoff.base, self.backoff.cap)
+        while not self.closed:
+            connection = AsyncTwitchConnection(timeout=self.timeout, store=RecentMessages(self.window), **self.kwargs)
+            try:
+                if await connection.connect():
+                    for channel in self.slots[index]:
+                        await self._join_slot()
+                        connection.send(TwitchIrc.join_message(channel))
+                    await asyncio.wait_for(_wait_for_joins(connection, self.slots[index]), self.timeout)
+                    if not self.closed:
+                        connection.on_lost = self._on_lost
+                        return connection
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                logging.debug("Connection attempt failed: %r", e)
+            connection.disconnect()
+            if self.closed:
+                break
+            delay = backoff.next()
+            logging.warning("Could not connect for %s, trying again in %.1fs", _describe(self.slots[index]), delay)
+            await asyncio.sleep(delay)
+        return None
+
+    def _switch(self, index: int, new: AsyncTwitchConnection) -> None:
+        '''Have `new` feed the store in place of connection `index`, starting with the chat it has that the old one did not deliver'''
+        old = self.connections[index]
+        cutoff = old.last_received()
+        old.on_lost = None
+        old.disconnect()
+        recent, new.store = new.store, self.store
+        new.has_messages = new.shared_has_messages = self.has_messages
+        new.collapser = self.collapser
+        new.seen = self.seen
+        if index == 0 and self.tee:
+            new.tee = new.protocol.tee = self.tee
+        self.connections[index] = new
+        for channel in self.slots[index]:
+            self.assignment[channel] = new
+        stored = self.store.n_received
+        if self.seen is not None:
+            carried = recent.since() # Those already delivered are dropped by their id
+        else:
+            carried = recent.since(cutoff) if cutoff is not None else []
+        for msg in carried:
+            new._message_received(msg)
+        self.n_failovers += 1
+        metrics.inc("failovers")
+        logging.info("Switched to a new connection for %s, carried over %d messages", _describe(self.slots[index]), self.store.n_received - stored)
+
+    async def receive(self) -> Optional[TwitchIrc.Message]:
+        """Wait for the next message from any connection, in arrival order
+
+        Returns:
+            Optional[TwitchIrc.Message]: the message, or None if disconnected, or a connection has been lost and is not being replaced
+        """
+        while (msg := self.store.pop_oldest()) is None:
+            if self.closed or (not (self.reconnect and self.connected) and any(connection.lost for connection in self.connections)):
+                return None
+            self.has_messages.clear()
+            await self.has_messages.wait()
+        if msg.id == TwitchMessageEnum.JOIN and msg.params:
+            self.joined.add(msg.params[0].lstrip("#"))
+        return msg
+
+    async def get_chat_message(self) -> Optional[TwitchIrc.Message]:
+        """Wait for the next PRIVMSG from any channel, discarding any other message types
+
+        Returns:
+            Optional[TwitchIrc.Message]: the chat message, or None once `receive` gives up
+        """
+        if self.pending:
+            return self.pending.popleft()
+        while (msg := await self.receive()) is not None:
+            if msg.id == TwitchMessageEnum.PRIVMSG:
+                return msg
+            logging.debug("Ignoring %s", msg)
+        return None
+
+    async def chat_messages(self) -> AsyncIterator[TwitchIrc.Message]:
+        while (msg := await self.get_chat_message()) is not None:
+            yield msg
+
+    def __aiter__(self) -> AsyncIterator[TwitchIrc.Message]:
+        return self.chat_messages()
+
+    def disconnect(self) -> None:
+        self.closed = True
+        for task in list(self.tasks):
+            task.cancel()
+        for connection in self.connections + [spare for spare in self.spares if spare]:
+            connection.disconnect()
+        self.spares = [None] * len(self.connections)
+        self.joined.clear()
+        self.connected = False
+
+    async def __aenter__(self):
+        if not await self.connect():
+            raise socket.timeout
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.disconnect()